@@ -1,16 +1,33 @@
 """Provide the Archive class.
 """
 
+import contextlib
+import copy
 from enum import Enum
+import fnmatch
+from functools import partial
+import io
 import itertools
+import os
 from pathlib import Path
+import random
+import shutil
 import stat
 import sys
 import tarfile
 import tempfile
+from archive.chunkstore import ChunkStore
+from archive.digest import DigestWriter
+from archive.index import ArchiveIndex, FrameWriter, IndexingTarFile
 from archive.manifest import Manifest
+from archive.sparse import addsparse, data_segments
 from archive.exception import *
+from archive.hashing import ParallelHasher
+from archive.tee import TeeWriter, decompressor
+from archive.throttle import TokenBucket, ThrottledReader
 from archive.tools import tmp_chdir, checksum
+from archive.writer import ParallelWriter
+from archive import nocache, zerocopy
 
 def _is_normalized(p):
     """Check if the path is normalized.
@@ -23,6 +40,9 @@ def _is_normalized(p):
     else:
         return False
 
+_unread = object()
+"""Marker for the index of an archive that has not yet been read."""
+
 class DedupMode(Enum):
     NEVER = 'never'
     LINK = 'link'
@@ -56,62 +76,159 @@ class Archive:
         self.path = None
         self.basedir = None
         self.manifest = None
+        self._index = None
         self._file = None
         self._metadata = []
+        self._bases = []
 
     def create(self, path, compression, paths, 
                basedir=None, workdir=None, excludes=None, 
-               dedup=DedupMode.LINK, tags=None):
+               dedup=DedupMode.LINK, tags=None, base=None, chunkstore=None,
+               framesize=None, verify=False, digests=None,
+               dir_hashes=False):
         if sys.version_info < (3, 5):
             # The 'x' (exclusive creation) mode was added to tarfile
             # in Python 3.5.
             mode = 'w:' + compression
         else:
             mode = 'x:' + compression
+        if base:
+            base = Path.cwd() / base
         if workdir:
             with tmp_chdir(workdir):
                 self._create(workdir / path, mode, paths, 
-                             basedir, excludes, dedup, tags)
+                             basedir, excludes, dedup, tags, base, chunkstore,
+                             framesize, verify, digests, dir_hashes)
         else:
-            self._create(path, mode, paths, basedir, excludes, dedup, tags)
+            self._create(path, mode, paths, basedir, excludes, dedup, tags,
+                         base, chunkstore, framesize, verify, digests,
+                         dir_hashes)
         return self
 
-    def _create(self, path, mode, paths, basedir, excludes, dedup, tags):
+    def _create(self, path, mode, paths, basedir, excludes, dedup, tags,
+                base, chunkstore, framesize, verify, digests, dir_hashes):
         self.path = path
         self._check_paths(paths, basedir, excludes)
         self.manifest = Manifest(paths=paths, excludes=excludes, tags=tags)
+        if base:
+            self._set_references(base)
+        if chunkstore:
+            self._store_chunks(chunkstore)
+        if dir_hashes:
+            self.manifest.add_dir_hashes()
         self.manifest.add_metadata(self.basedir / ".manifest.yaml")
         for md in self._metadata:
             md.set_path(self.basedir)
             self.manifest.add_metadata(md.path)
-        with tarfile.open(str(self.path), mode) as tarf:
-            with tempfile.TemporaryFile() as tmpf:
-                self.manifest.write(tmpf)
-                tmpf.seek(0)
-                self.add_metadata(".manifest.yaml", tmpf)
-                md_names = self._add_metadata_files(tarf)
-            dupindex = {}
-            for fi in self.manifest:
-                p = fi.path
-                name = self._arcname(p)
-                if name in md_names:
-                    raise ArchiveCreateError("cannot add %s: "
-                                             "this filename is reserved" % p)
-                if fi.is_file():
-                    ti = tarf.gettarinfo(str(p), arcname=name)
-                    dup = self._check_duplicate(fi, name, dedup, dupindex)
-                    if dup:
-                        ti.type = tarfile.LNKTYPE
-                        ti.linkname = dup
-                        tarf.addfile(ti)
-                    else:
-                        ti.size = fi.size
-                        ti.type = tarfile.REGTYPE
-                        ti.linkname = ''
-                        with p.open("rb") as f:
-                            tarf.addfile(ti, fileobj=f)
+        if framesize:
+            self._create_seekable(mode, dedup, framesize, verify, digests)
+        elif verify or digests:
+            self._create_wrapped(mode, dedup, verify, digests)
+        else:
+            with tarfile.open(str(self.path), mode) as tarf:
+                self._add_items(tarf, dedup)
+
+    def _open_output(self, stack, mode, verify, digests):
+        """Open the archive file for writing.
+
+        The file object is wrapped to calculate the digests of the
+        output and to verify it while it is being written, as needed.
+        Return the file object and the DigestWriter, if any.
+        """
+        filemode, compression = mode.split(':')
+        f = stack.enter_context(open(str(self.path), filemode + 'b'))
+        digester = None
+        if digests:
+            f = digester = DigestWriter(f, digests)
+        if verify:
+            verifier = partial(self._verify_stream, compression)
+            f = stack.enter_context(TeeWriter(f, verifier))
+        return f, digester
+
+    def _create_wrapped(self, mode, dedup, verify, digests):
+        """Create the archive, writing through the wrappers set up in
+        :meth:`_open_output`.
+        """
+        compression = mode.split(':')[1]
+        with contextlib.ExitStack() as stack:
+            f, digester = self._open_output(stack, mode, verify, digests)
+            with tarfile.open(fileobj=f, mode='w:' + compression) as tarf:
+                self._add_items(tarf, dedup)
+        if digester:
+            digester.write_sidecars(self.path)
+
+    def _create_seekable(self, mode, dedup, framesize, verify=False,
+                         digests=None):
+        """Create the archive compressed in independent frames and write
+        an index of the members.
+        """
+        compression = mode.split(':')[1]
+        with contextlib.ExitStack() as stack:
+            f, digester = self._open_output(stack, mode, verify, digests)
+            writer = FrameWriter(f, compression, framesize)
+            with IndexingTarFile.open(fileobj=writer, mode='w') as tarf:
+                self._add_items(tarf, dedup)
+            writer.close()
+        index = ArchiveIndex(compression=compression, points=writer.points,
+                             members=tarf.offsets)
+        index.write(self.path)
+        if digester:
+            digester.write_sidecars(self.path)
+
+    def _add_items(self, tarf, dedup):
+        # For uncompressed archives written to a regular file, copy
+        # the file content in the kernel.
+        if isinstance(tarf.fileobj, io.BufferedWriter):
+            addfile = partial(zerocopy.addfile, tarf)
+        else:
+            addfile = tarf.addfile
+        dropper = nocache.Dropper(tarf.fileobj, write=True)
+        with tempfile.TemporaryFile() as tmpf:
+            self.manifest.write(tmpf)
+            tmpf.seek(0)
+            self.add_metadata(".manifest.yaml", tmpf)
+            md_names = self._add_metadata_files(tarf)
+        dupindex = {}
+        for fi in self.manifest:
+            p = fi.path
+            name = self._arcname(p)
+            if name in md_names:
+                raise ArchiveCreateError("cannot add %s: "
+                                         "this filename is reserved" % p)
+            if fi.is_file() and fi.reference:
+                # The content is taken from the base archive.
+                continue
+            elif fi.is_file() and fi.chunks:
+                # The content is in the chunk store.  Add an empty
+                # member referring to the chunks in its pax header,
+                # so that the members still match the manifest.
+                ti = tarf.gettarinfo(str(p), arcname=name)
+                ti.size = 0
+                ti.type = tarfile.REGTYPE
+                ti.linkname = ''
+                ti.pax_headers = { ChunkStore.PaxHeader: ",".join(fi.chunks) }
+                tarf.addfile(ti)
+            elif fi.is_file():
+                ti = tarf.gettarinfo(str(p), arcname=name)
+                dup = self._check_duplicate(fi, name, dedup, dupindex)
+                if dup:
+                    ti.type = tarfile.LNKTYPE
+                    ti.linkname = dup
+                    tarf.addfile(ti)
                 else:
-                    tarf.add(str(p), arcname=name, recursive=False)
+                    ti.size = fi.size
+                    ti.type = tarfile.REGTYPE
+                    ti.linkname = ''
+                    with p.open("rb") as f:
+                        nocache.sequential(f)
+                        segments = data_segments(f, fi.size)
+                        if not (segments and
+                                addsparse(tarf, ti, f, segments)):
+                            addfile(ti, f)
+                        nocache.release(f)
+            else:
+                tarf.add(str(p), arcname=name, recursive=False)
+            dropper.update()
 
     def _check_paths(self, paths, basedir, excludes):
         """Check the paths to be added to an archive for several error
@@ -173,6 +290,58 @@ class Archive:
             tarf.addfile(ti, md.fileobj)
         return md_names
 
+    def _set_references(self, base):
+        """Mark the files that did not change with respect to the base
+        archive as references to the base archive.
+
+        A file is considered unchanged if it has the same size and
+        modification time as in the base archive or if it has the
+        same checksum.
+        """
+        with Archive().open(base) as base_archive:
+            basefiles = { fi.path: fi for fi in base_archive.manifest
+                          if fi.is_file() }
+            base_head = {
+                "Checksum": base_archive._manifest_checksum(),
+                "Date": base_archive.manifest.head["Date"],
+            }
+        for fi in self.manifest:
+            if not fi.is_file():
+                continue
+            bfi = basefiles.get(fi.path)
+            if bfi is None or bfi.size != fi.size:
+                continue
+            if not all(h in bfi.checksum for h in fi.Checksums):
+                continue
+            if bfi.mtime == fi.mtime:
+                # Take the checksum from the base archive rather than
+                # reading the file.
+                fi._checksum = { h: bfi.checksum[h] for h in fi.Checksums }
+            elif any(fi.checksum[h] != bfi.checksum[h]
+                     for h in fi.Checksums):
+                continue
+            fi.reference = True
+        archive_dir = (Path.cwd() / self.path).parent
+        base_head["Path"] = os.path.relpath(str(base), str(archive_dir))
+        self.manifest.head["Base"] = base_head
+
+    def _store_chunks(self, chunkstore):
+        """Add the content of the files to the chunk store.
+        """
+        for fi in self.manifest:
+            if not fi.is_file() or fi.reference:
+                continue
+            digest = fi.checksum.get(chunkstore.HashAlg)
+            with fi.path.open("rb") as f:
+                nocache.sequential(f)
+                fi.chunks = chunkstore.put(f, digest=digest)
+                nocache.release(f)
+        self.manifest.head["ChunkStore"] = {
+            "Chunking": chunkstore.chunking,
+            "Path": os.path.relpath(str(chunkstore.path),
+                                    str((Path.cwd() / self.path).parent)),
+        }
+
     def _check_duplicate(self, fileinfo, name, dedup, dupindex):
         """Check if the archive item fileinfo should be linked
         to another item already added to the archive.
@@ -214,8 +383,18 @@ class Archive:
         if not self.manifest.metadata:
             # Legacy: Manifest version 1.0 did not have metadata.
             self.manifest.add_metadata(self.basedir / ".manifest.yaml")
+        self._index = _unread
         return self
 
+    @property
+    def index(self):
+        """The random access index of the archive or None if there is
+        no index.  It is read from the sidecar file on first access.
+        """
+        if self._index is _unread:
+            self._index = ArchiveIndex.read(self.path)
+        return self._index
+
     def get_metadata(self, name):
         ti = self._file.next()
         path = Path(ti.path)
@@ -226,10 +405,64 @@ class Archive:
         self._metadata.append(md)
         return md
 
+    def open_base(self, path=None):
+        """Open the base archive of an incremental archive.
+
+        If path is not given, the location of the base archive is
+        taken from the manifest, relative to the directory of this
+        archive.
+        """
+        try:
+            base = self.manifest.head["Base"]
+        except KeyError:
+            raise ArchiveReadError("%s: not an incremental archive"
+                                   % self.path)
+        if path is None:
+            path = self.path.parent / base["Path"]
+            if not path.is_file():
+                raise ArchiveReadError("%s: base archive %s not found"
+                                       % (self.path, path))
+        base_archive = Archive().open(path)
+        if base_archive._manifest_checksum() != base["Checksum"]:
+            base_archive.close()
+            raise ArchiveIntegrityError("%s: not the base archive of %s"
+                                        % (path, self.path))
+        return base_archive
+
+    def open_chunkstore(self, path=None):
+        """Return the chunk store holding the content of this archive.
+
+        If path is not given, the location of the chunk store is
+        taken from the manifest, relative to the directory of this
+        archive.
+        """
+        try:
+            cs = self.manifest.head["ChunkStore"]
+        except KeyError:
+            raise ArchiveReadError("%s: archive does not use a chunk store"
+                                   % self.path)
+        if path is None:
+            path = self.path.parent / cs["Path"]
+        return ChunkStore(path, cs["Chunking"])
+
+    def _manifest_checksum(self):
+        """Calculate a checksum of the manifest as stored in the archive.
+        """
+        md = self._metadata[0]
+        md.fileobj.seek(0)
+        return checksum(md.fileobj, ["sha256"])
+
+    def _is_uncompressed(self):
+        """Check whether the archive file is an uncompressed tar file.
+        """
+        return isinstance(self._file.fileobj, io.BufferedReader)
+
     def close(self):
         if self._file:
             self._file.close()
         self._file = None
+        while self._bases:
+            self._bases.pop().close()
 
     def __enter__(self):
         return self
@@ -246,9 +479,163 @@ class Archive:
         else:
             return str(p)
 
-    def verify(self):
+    def _resolve_references(self, base=None, fileinfos=None):
+        """Follow the chain of base archives for the references in this
+        archive, or in the entries fileinfos, if given.
+
+        Check that each referenced file is present in the base archive
+        with the same content.  Return a dict mapping the path of each
+        reference to a tuple of the archive actually holding the
+        content and the corresponding entry in its manifest.
+
+        The base archives are kept open until this archive is closed.
+        """
+        holders = {}
+        if fileinfos is None:
+            fileinfos = self.manifest
+        refs = [ fi for fi in fileinfos if fi.is_file() and fi.reference ]
+        archive = self
+        while refs:
+            base_archive = archive.open_base(base)
+            self._bases.append(base_archive)
+            base = None
+            basefiles = { fi.path: fi for fi in base_archive.manifest
+                          if fi.is_file() }
+            next_refs = []
+            for fi in refs:
+                itemname = "%s:%s" % (self.path, fi.path)
+                bfi = basefiles.get(fi.path)
+                if bfi is None:
+                    raise ArchiveIntegrityError("%s: missing in base "
+                                                "archive %s"
+                                                % (itemname,
+                                                   base_archive.path))
+                if (bfi.size != fi.size or
+                    any(bfi.checksum.get(h) != c
+                        for h, c in fi.checksum.items())):
+                    raise ArchiveIntegrityError("%s: does not match "
+                                                "base archive %s"
+                                                % (itemname,
+                                                   base_archive.path))
+                if bfi.reference:
+                    next_refs.append(fi)
+                else:
+                    holders[fi.path] = (base_archive, bfi)
+            archive = base_archive
+            refs = next_refs
+        return holders
+
+    def _select(self, paths):
+        """Return the entries from the manifest matching any of the
+        paths, including the content of directories.  The paths may
+        contain shell style wildcards.
+        """
+        paths = set(Path(p) for p in paths)
+        patterns = [ str(p) for p in paths if set("*?[") & set(str(p)) ]
+        selected = []
+        for fi in self.manifest:
+            if fi.path in paths or paths.intersection(fi.path.parents):
+                selected.append(fi)
+            elif patterns:
+                candidates = [ str(p) for p in fi.path.parents ]
+                candidates.append(str(fi.path))
+                if any(fnmatch.fnmatchcase(c, pat)
+                       for pat in patterns for c in candidates):
+                    selected.append(fi)
+        return selected
+
+    def verify(self, base=None, chunkstore=None, entries=None,
+               ratelimit=None, resume_after=None, progress=None,
+               workers=None, sample=None, seed=None):
+        """Verify the integrity of the archive.
+
+        If entries is given, only verify the matching entries,
+        including their references to the base archive.  If
+        ratelimit is given, the bandwidth used to read the content is
+        limited to this number of bytes per second.  If resume_after
+        is the path of an entry, only the content following this entry
+        is verified.  progress is called with each entry verified.  If
+        workers is given, the content is hashed in this number of
+        worker threads, while the archive is being read.
+
+        If sample is given, only the content of this fraction of the
+        regular files, chosen at random, is checked.  The headers of
+        all entries are checked nevertheless.  A sample of 0 checks
+        the headers only.  The choice is reproducible for a given
+        seed.
+        """
         if not self._file:
             raise ValueError("archive is closed.")
+        bucket = TokenBucket(ratelimit) if ratelimit else None
+        if sample is None:
+            sampled = None
+        else:
+            # Select the sample from the whole manifest, so that it
+            # does not depend on entries or resume_after.
+            rng = random.Random(seed)
+            sampled = { fi.path for fi in self.manifest
+                        if fi.is_file() and rng.random() < sample }
+
+        def _content(fileinfo):
+            return sampled is None or fileinfo.path in sampled
+
+        # The checksums of verified regular file members by name, to
+        # avoid hashing the content again for hard links to them.
+        verified = {}
+        if entries is not None:
+            # Only verify selected entries.  Use the index to seek
+            # directly to the members, if available.
+            fileinfos = self._select(entries)
+            if bucket and not self.index:
+                self._verify_throttled(fileinfos, bucket, chunkstore,
+                                       _content, verified, progress)
+            else:
+                self._verify_selected(fileinfos, bucket, chunkstore,
+                                      _content, verified, progress)
+            refs = fileinfos
+        else:
+            fileinfos = self.manifest
+            if resume_after is not None:
+                paths = [ fi.path for fi in self.manifest ]
+                if resume_after in paths:
+                    fileinfos = self.manifest[paths.index(resume_after)
+                                              + 1:]
+            if bucket:
+                self._verify_throttled(fileinfos, bucket, chunkstore,
+                                       _content, verified, progress,
+                                       metadata=True)
+            else:
+                self._verify_all(fileinfos, chunkstore, _content, verified,
+                                 progress, workers)
+            refs = None
+        # Check the references to the base archive.  The base archive
+        # is taken from the manifest, unless given explicitly.
+        if base or "Base" in self.manifest.head:
+            self._resolve_references(base, refs)
+
+    def _verify_selected(self, fileinfos, bucket, chunkstore, content,
+                         verified, progress):
+        """Verify the entries fileinfos, using the index to seek
+        directly to the members, if available.
+        """
+        for fileinfo in fileinfos:
+            content_ok = content(fileinfo)
+            if fileinfo.is_file() and fileinfo.chunks and content_ok:
+                self._verify_chunks(fileinfo,
+                                    self.open_chunkstore(chunkstore),
+                                    bucket)
+            if self.index:
+                self._verify_indexed(fileinfo, bucket, content_ok)
+            else:
+                self._verify_item(fileinfo, verified=verified,
+                                  content=content_ok)
+            if progress:
+                progress(fileinfo)
+
+    def _verify_all(self, fileinfos, chunkstore, content, verified,
+                    progress, workers):
+        """Verify the metadata items and the entries fileinfos.
+        """
         # Verify that all metadata items are present in the proper
         # order at the beginning of the tar file.  Start iterating for
         # TarInfo objects in the tarfile from the beginning,
@@ -259,21 +646,217 @@ class Archive:
             if ti.name != md:
                 raise ArchiveIntegrityError("Expected metadata item '%s' "
                                             "not found" % (md))
-        # Check the content of the archive.
-        for fileinfo in self.manifest:
-            self._verify_item(fileinfo)
+        # Check the content of the archive.  Uncompressed archives
+        # are mapped into memory to hash the content in place.
+        store = None
 
-    def _verify_item(self, fileinfo):
+        def _done(check, fileinfo):
+            if check:
+                check()
+            if progress:
+                progress(fileinfo)
 
-        def _check_condition(cond, item, message):
-            if not cond:
-                raise ArchiveIntegrityError("%s: %s" % (item, message))
+        with contextlib.ExitStack() as stack:
+            mapped = None
+            if self._is_uncompressed():
+                try:
+                    mapped = zerocopy.MappedArchive(self.path)
+                    stack.enter_context(mapped)
+                except (OSError, ValueError, OverflowError):
+                    mapped = None
+            hasher = None
+            if workers:
+                hasher = stack.enter_context(ParallelHasher(workers))
+            dropper = nocache.Dropper(self._file.fileobj)
+            try:
+                for fileinfo in fileinfos:
+                    check = None
+                    content_ok = content(fileinfo)
+                    if (fileinfo.is_file() and fileinfo.chunks and
+                        content_ok):
+                        if store is None:
+                            store = self.open_chunkstore(chunkstore)
+                        self._verify_chunks(fileinfo, store)
+                    check = self._verify_item(fileinfo, mapped, hasher,
+                                              verified, content_ok)
+                    # The members are not read in order, see
+                    # nocache.Dropper.
+                    dropper.update(size=fileinfo.size
+                                   if fileinfo.is_file() else 0)
+                    if hasher:
+                        hasher.defer(partial(_done, check, fileinfo))
+                    else:
+                        _done(check, fileinfo)
+            except ArchiveIntegrityError:
+                # A failed check of a preceding item takes precedence.
+                if hasher:
+                    hasher.wait()
+                raise
+            if hasher:
+                hasher.wait()
+            dropper.update(final=True)
+
+    def _verify_throttled(self, fileinfos, bucket, chunkstore, content,
+                          verified, progress, metadata=False):
+        """Verify the entries fileinfos, limiting the rate at which the
+        archive file is read to bucket.
+
+        The members are read sequentially from a separate file object
+        that takes the tokens for the bytes read from disk.  Looking
+        up members with :meth:`tarfile.TarFile.getmember` would read
+        the whole archive at once.
+        """
+        store = None
+        with open(str(self.path), "rb") as raw:
+            dropper = nocache.Dropper(raw)
+            fileobj = ThrottledReader(raw, bucket)
+            with tarfile.open(fileobj=fileobj, mode='r:*') as tarf:
+                members = iter(tarf)
+                if metadata:
+                    for md in self.manifest.metadata:
+                        ti = next(members, None)
+                        if ti is None or ti.name != md:
+                            raise ArchiveIntegrityError("Expected metadata "
+                                                        "item '%s' not found"
+                                                        % (md))
+                # The members already passed by name.  Hard links
+                # are read from their target, which precedes them.
+                seen = {}
+
+                def _extractfile(tarinfo):
+                    if tarinfo.islnk():
+                        tarinfo = seen.get(tarinfo.linkname, tarinfo)
+                    return tarf.extractfile(tarinfo)
 
+                for fileinfo in fileinfos:
+                    content_ok = content(fileinfo)
+                    if (fileinfo.is_file() and fileinfo.chunks and
+                        content_ok):
+                        if store is None:
+                            store = self.open_chunkstore(chunkstore)
+                        self._verify_chunks(fileinfo, store, bucket)
+                    if not (fileinfo.is_file() and fileinfo.reference):
+                        itemname = "%s:%s" % (self.path, fileinfo.path)
+                        name = self._arcname(fileinfo.path)
+                        tarinfo = seen.get(name)
+                        while tarinfo is None:
+                            ti = next(members, None)
+                            if ti is None:
+                                raise ArchiveIntegrityError("%s: missing"
+                                                            % itemname)
+                            seen[ti.name] = ti
+                            if ti.name == name:
+                                tarinfo = ti
+                        self._check_item(itemname, fileinfo, tarinfo,
+                                         _extractfile, verified=verified,
+                                         content=content_ok)
+                        dropper.update()
+                    if progress:
+                        progress(fileinfo)
+            dropper.update(final=True)
+
+    def _verify_item(self, fileinfo, mapped=None, hasher=None,
+                     verified=None, content=True):
+        if fileinfo.is_file() and fileinfo.reference:
+            # The content is in the base archive.
+            return None
         itemname = "%s:%s" % (self.path, fileinfo.path)
         try:
             tarinfo = self._file.getmember(self._arcname(fileinfo.path))
         except KeyError:
             raise ArchiveIntegrityError("%s: missing" % itemname)
+        return self._check_item(itemname, fileinfo, tarinfo,
+                                self._file.extractfile, mapped, hasher,
+                                verified, content)
+
+    def _verify_indexed(self, fileinfo, bucket=None, content=True):
+        """Verify one item, seeking directly to the member using the
+        index.
+        """
+        if fileinfo.is_file() and fileinfo.reference:
+            return
+        itemname = "%s:%s" % (self.path, fileinfo.path)
+        with contextlib.ExitStack() as stack:
+            try:
+                tarf = self.index.open_member(self.path,
+                                              self._arcname(fileinfo.path),
+                                              bucket)
+            except KeyError:
+                raise ArchiveIntegrityError("%s: missing" % itemname)
+            stack.enter_context(tarf)
+            tarinfo = tarf.next()
+            if tarinfo.islnk():
+                # Hard links can't be read in stream mode, we need to
+                # go to the link target.
+                datatarf = self.index.open_member(self.path,
+                                                  tarinfo.linkname, bucket)
+                stack.enter_context(datatarf)
+                datainfo = datatarf.next()
+            else:
+                datatarf, datainfo = tarf, tarinfo
+            self._check_item(itemname, fileinfo, tarinfo,
+                             lambda ti: datatarf.extractfile(datainfo),
+                             content=content)
+
+    def _verify_stream(self, compression, fileobj):
+        """Verify the archive, reading it sequentially from fileobj.
+
+        This is used to check the archive while it is being written.
+        """
+        metadata = list(self.manifest.metadata)
+        entries = { self._arcname(fi.path): fi for fi in self.manifest
+                    if not (fi.is_file() and fi.reference) }
+        verified = {}
+        try:
+            f = decompressor(fileobj, compression)
+            with tarfile.open(fileobj=f, mode='r|') as tarf:
+                for tarinfo in tarf:
+                    if metadata:
+                        md = metadata.pop(0)
+                        if tarinfo.name != md:
+                            raise ArchiveIntegrityError("Expected metadata "
+                                                        "item '%s' not found"
+                                                        % (md))
+                        continue
+                    try:
+                        fileinfo = entries.pop(tarinfo.name)
+                    except KeyError:
+                        raise ArchiveIntegrityError("%s:%s: unexpected member"
+                                                    % (self.path,
+                                                       tarinfo.name))
+                    itemname = "%s:%s" % (self.path, fileinfo.path)
+                    self._check_item(itemname, fileinfo, tarinfo,
+                                     tarf.extractfile, verified=verified)
+            # Read up to the end, to check the integrity of the
+            # compressed stream.
+            while f.read(64*1024):
+                pass
+        except (tarfile.TarError, OSError, EOFError) as e:
+            raise ArchiveIntegrityError("%s: %s" % (self.path, e))
+        if metadata:
+            raise ArchiveIntegrityError("Expected metadata item '%s' "
+                                        "not found" % (metadata[0]))
+        for fileinfo in self.manifest:
+            if self._arcname(fileinfo.path) in entries:
+                raise ArchiveIntegrityError("%s:%s: missing"
+                                            % (self.path, fileinfo.path))
+
+    def _check_item(self, itemname, fileinfo, tarinfo, extractfile,
+                    mapped=None, hasher=None, verified=None, content=True):
+        """Check one item against the archive member.
+
+        If hasher is given, the checksum is calculated asynchronously.
+        A function to be called to check the result is returned in
+        this case, None otherwise.  If verified is given, it maps the
+        names of regular file members that have been checked to their
+        checksum.  Hard links to these members are not hashed again.
+        If content is False, the checksum is not checked.
+        """
+
+        def _check_condition(cond, item, message):
+            if not cond:
+                raise ArchiveIntegrityError("%s: %s" % (item, message))
+
         _check_condition(tarinfo.mode == fileinfo.mode,
                          itemname, "wrong mode")
         _check_condition(int(tarinfo.mtime) == int(fileinfo.mtime),
@@ -284,13 +867,48 @@ class Archive:
         elif fileinfo.is_file():
             _check_condition(tarinfo.isfile() or tarinfo.islnk(),
                              itemname, "wrong type, expected regular file")
+            if fileinfo.chunks:
+                # The content is checked in the chunk store.
+                _check_condition(tarinfo.isfile() and tarinfo.size == 0 and
+                                 tarinfo.pax_headers.get(ChunkStore.PaxHeader) ==
+                                 ",".join(fileinfo.chunks),
+                                 itemname, "wrong chunk store placeholder")
+                return None
             if tarinfo.isfile():
                 _check_condition(tarinfo.size == fileinfo.size,
                                  itemname, "wrong size")
-            with self._file.extractfile(tarinfo) as f:
-                cs = checksum(f, fileinfo.checksum.keys())
-                _check_condition(cs == fileinfo.checksum,
-                                 itemname, "checksum does not match")
+            if not content:
+                return None
+            hashalg = fileinfo.checksum.keys()
+            if verified is not None:
+                if tarinfo.islnk():
+                    cs = verified.get(tarinfo.linkname)
+                    if cs is not None and cs.keys() == hashalg:
+                        _check_condition(cs == fileinfo.checksum,
+                                         itemname, "checksum does not match")
+                        return None
+                else:
+                    # Checks are completed in order, so the link
+                    # target will have been verified before any link
+                    # relying on this entry.
+                    verified[tarinfo.name] = fileinfo.checksum
+            if hasher:
+                if mapped and tarinfo.isfile() and tarinfo.sparse is None:
+                    future = hasher.submit(mapped.checksum, tarinfo, hashalg)
+                else:
+                    with extractfile(tarinfo) as f:
+                        future = hasher.checksum(f, hashalg)
+                return lambda: _check_condition(
+                    future.result() == fileinfo.checksum,
+                    itemname, "checksum does not match")
+            cs = None
+            if mapped and tarinfo.isfile():
+                cs = mapped.checksum(tarinfo, hashalg)
+            if cs is None:
+                with extractfile(tarinfo) as f:
+                    cs = checksum(f, hashalg)
+            _check_condition(cs == fileinfo.checksum,
+                             itemname, "checksum does not match")
         elif fileinfo.is_symlink():
             _check_condition(tarinfo.issym(),
                              itemname, "wrong type, expected symbolic link")
@@ -299,23 +917,201 @@ class Archive:
         else:
             raise ArchiveIntegrityError("%s: invalid type" % (itemname))
 
-    def extract(self, targetdir, inclmeta=False):
+    def _verify_chunks(self, fileinfo, chunkstore, bucket=None):
+        itemname = "%s:%s" % (self.path, fileinfo.path)
+        try:
+            with chunkstore.open(fileinfo.chunks) as f:
+                if bucket:
+                    f = ThrottledReader(f, bucket)
+                cs = checksum(f, fileinfo.checksum.keys())
+        except ArchiveIntegrityError as e:
+            raise ArchiveIntegrityError("%s: %s" % (itemname, e))
+        if cs != fileinfo.checksum:
+            raise ArchiveIntegrityError("%s: checksum does not match"
+                                        % itemname)
+
+    def _extract_chunks(self, fileinfo, chunkstore, chunks, targetdir):
+        """Extract a file from the chunk store.
+        """
+        path = targetdir / self._arcname(fileinfo.path)
+        os.makedirs(str(path.parent), exist_ok=True)
+        with chunkstore.open(chunks) as src, path.open("wb") as dst:
+            shutil.copyfileobj(src, dst)
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            os.chown(str(path), fileinfo.uid, fileinfo.gid)
+        os.chmod(str(path), fileinfo.mode)
+        os.utime(str(path), (fileinfo.mtime, fileinfo.mtime))
+
+    def _extract_reference(self, fileinfo, holder, targetdir, extracted):
+        """Extract a referenced file from the base archive holding the
+        content.
+
+        extracted maps the base archive members already extracted to
+        the name they have been extracted as.  Further references to
+        the same member are extracted as hard links to it, so that
+        hard links in the base archive are retained.
+        """
+        ti = holder._file.getmember(holder._arcname(fileinfo.path))
+        if ti.islnk():
+            ti = holder._file.getmember(ti.linkname)
+        key = (id(holder), ti.name)
+        ti = copy.copy(ti)
+        ti.name = self._arcname(fileinfo.path)
+        if key in extracted:
+            ti.type = tarfile.LNKTYPE
+            ti.linkname = extracted[key]
+            ti.size = 0
+        else:
+            extracted[key] = ti.name
+        ti.mode = fileinfo.mode
+        ti.mtime = fileinfo.mtime
+        ti.uid = fileinfo.uid
+        ti.gid = fileinfo.gid
+        ti.uname = fileinfo.uname or ''
+        ti.gname = fileinfo.gname or ''
+        holder._file.extract(ti, path=str(targetdir))
+
+    def _extract_indexed(self, fileinfo, targetdir):
+        """Extract one item, seeking directly to the member using the
+        index.
+        """
+        name = self._arcname(fileinfo.path)
+        with self.index.open_member(self.path, name) as tarf:
+            tarinfo = tarf.next()
+            if tarinfo.islnk():
+                with self.index.open_member(self.path,
+                                            tarinfo.linkname) as datatarf:
+                    datainfo = copy.copy(datatarf.next())
+                    datainfo.name = tarinfo.name
+                    datainfo.mode = tarinfo.mode
+                    datainfo.mtime = tarinfo.mtime
+                    datatarf.extract(datainfo, path=str(targetdir))
+            else:
+                tarf.extract(tarinfo, path=str(targetdir))
+
+    def _extract_members(self, members, writer):
+        """Extract the members reading the archive sequentially,
+        passing them on to a ParallelWriter.
+        """
+        for ti in self._file:
+            if not members:
+                break
+            if members.pop(ti.name, None) is None:
+                continue
+            if ti.isfile() or ti.islnk():
+                writer.add(ti, self._file.extractfile(ti))
+            else:
+                writer.add(ti)
+        if members:
+            name = sorted(members.keys())[0]
+            raise ArchiveIntegrityError("%s:%s: missing"
+                                        % (self.path, members[name].path))
+
+    def _is_identical(self, fileinfo, targetdir, checksums=False):
+        """Check whether the file is already present in targetdir.
+
+        Compare size and modification time and, if checksums is True,
+        also the content.  The modification time is set last when
+        extracting a file, so a file that has only partly been
+        written by an interrupted extraction does not match.
+        """
+        path = targetdir / self._arcname(fileinfo.path)
+        try:
+            st = os.lstat(str(path))
+        except FileNotFoundError:
+            return False
+        if (not stat.S_ISREG(st.st_mode) or st.st_size != fileinfo.size or
+            int(st.st_mtime) != int(fileinfo.mtime)):
+            return False
+        if checksums:
+            with path.open("rb") as f:
+                cs = checksum(f, fileinfo.checksum.keys())
+            return cs == fileinfo.checksum
+        return True
+
+    def extract(self, targetdir, inclmeta=False, base=None, chunkstore=None,
+                paths=None, workers=None, skip_identical=False,
+                compare_checksum=False):
+        """Extract the archive into targetdir.
+
+        If paths is given, only extract the matching entries.  If
+        workers is given, the files are written using a pool of this
+        number of worker threads, while the archive is read
+        sequentially.  If skip_identical is True, files already
+        present in targetdir with the same size and modification
+        time, and the same checksum if compare_checksum is True, are
+        not written again.
+        """
         # We extract the directories last in reverse order.  This way,
         # the directory attributes, in particular the file modification
         # time, is set correctly after the file content is written into
         # the directory.
         dirstack = []
-        if inclmeta:
-            for mi in self.manifest.metadata:
-                self._file.extract(mi, path=str(targetdir))
-        for fi in self.manifest:
-            if fi.is_dir():
-                dirstack.append(fi.path)
+        holders = None
+        extracted = {}
+        store = None
+        if paths is not None:
+            # Only extract selected entries.  Use the index to seek
+            # directly to the members, if available.
+            fileinfos = self._select(paths)
+            indexed = self.index is not None
+        else:
+            fileinfos = self.manifest
+            indexed = False
+        with contextlib.ExitStack() as stack:
+            if workers and not indexed:
+                if self._is_uncompressed():
+                    source_fd = self._file.fileobj.fileno()
+                else:
+                    source_fd = None
+                writer = ParallelWriter(targetdir, workers,
+                                        source_fd=source_fd)
+                stack.enter_context(writer)
+                extract_chunks = partial(writer.submit, self._extract_chunks)
+                members = {}
             else:
-                self._file.extract(self._arcname(fi.path), path=str(targetdir))
+                writer = None
+                extract_chunks = self._extract_chunks
+            if inclmeta:
+                for mi in self.manifest.metadata:
+                    self._file.extract(mi, path=str(targetdir))
+            for fi in fileinfos:
+                if (skip_identical and fi.is_file() and
+                    self._is_identical(fi, targetdir, compare_checksum)):
+                    if writer:
+                        writer.skip(self._arcname(fi.path))
+                    continue
+                if fi.is_file() and fi.reference:
+                    if holders is None:
+                        holders = self._resolve_references(base)
+                    holder, hfi = holders[fi.path]
+                    if hfi.chunks:
+                        extract_chunks(fi, holder.open_chunkstore(),
+                                       hfi.chunks, targetdir)
+                    else:
+                        self._extract_reference(fi, holder, targetdir,
+                                                extracted)
+                elif fi.is_file() and fi.chunks:
+                    if store is None:
+                        store = self.open_chunkstore(chunkstore)
+                    extract_chunks(fi, store, fi.chunks, targetdir)
+                elif writer:
+                    members[self._arcname(fi.path)] = fi
+                elif fi.is_dir():
+                    dirstack.append(fi)
+                elif indexed:
+                    self._extract_indexed(fi, targetdir)
+                else:
+                    self._file.extract(self._arcname(fi.path),
+                                       path=str(targetdir))
+            if writer:
+                self._extract_members(members, writer)
         while True:
             try:
-                p = dirstack.pop()
+                fi = dirstack.pop()
             except IndexError:
                 break
-            self._file.extract(self._arcname(p), path=str(targetdir))
+            if indexed:
+                self._extract_indexed(fi, targetdir)
+            else:
+                self._file.extract(self._arcname(fi.path), path=str(targetdir))
@@ -0,0 +1,230 @@
+"""Provide the ChunkStore class.
+
+A chunk store is a directory holding file content indexed by the
+hash of the content.  It may be shared between a series of archives,
+so that content that is present in several archives is only stored
+once.
+"""
+
+import hashlib
+import io
+import os
+from pathlib import Path
+import tempfile
+import warnings
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from archive.exception import ArchiveIntegrityError, ArchiveWarning
+
+
+def _gear_table():
+    """Return a table of pseudo random 64 bit values for each byte
+    value to be used by the gear hash.  The table is derived from a
+    fixed seed, so that chunk boundaries are reproducible.
+    """
+    table = []
+    for i in range(256):
+        seed = ("archive-tools-gear-%d" % i).encode("ascii")
+        d = hashlib.sha256(seed).digest()
+        table.append(int.from_bytes(d[:8], 'big'))
+    return table
+
+_gear = _gear_table()
+_gear_np = numpy.array(_gear, dtype=numpy.uint64) if numpy else None
+
+
+class ChunkReader(io.RawIOBase):
+    """A read-only file object for the concatenated content of a list
+    of chunks.
+    """
+
+    def __init__(self, store, chunks):
+        super().__init__()
+        self._paths = [store.chunk_path(c) for c in chunks]
+        self._chunks = list(chunks)
+        self._file = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while True:
+            if self._file is None:
+                if not self._paths:
+                    return 0
+                p = self._paths.pop(0)
+                c = self._chunks.pop(0)
+                try:
+                    self._file = p.open("rb")
+                except FileNotFoundError:
+                    raise ArchiveIntegrityError("missing chunk %s" % c)
+            n = self._file.readinto(b)
+            if n:
+                return n
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        super().close()
+
+
+class ChunkStore:
+    """A content addressed store of chunks of file content.
+
+    The chunking mode may either be 'file' to store each file as one
+    single chunk or 'cdc' for content defined chunking using a gear
+    hash.  The latter is able to deduplicate parts of large files
+    that are only partly modified, but is considerably slower.  The
+    gear hash is calculated with NumPy if available.  Otherwise, it
+    runs in pure Python, at a few MB/s only.
+    """
+
+    Chunkings = ['file', 'cdc']
+    HashAlg = 'sha256'
+    # The pax header of the empty placeholder member in the archive
+    # listing the chunks of a file.
+    PaxHeader = 'ARCHIVETOOLS.chunks'
+
+    # Parameters for content defined chunking.
+    MinSize = 512*1024
+    AvgBits = 20
+    MaxSize = 8*1024*1024
+
+    def __init__(self, path, chunking='file'):
+        if chunking not in self.Chunkings:
+            raise ValueError("invalid chunking mode '%s'" % chunking)
+        self.path = Path.cwd() / path
+        self.chunking = chunking
+        if chunking == 'cdc' and numpy is None:
+            warnings.warn("NumPy is not available, content defined "
+                          "chunking will be very slow", ArchiveWarning)
+
+    def chunk_path(self, digest):
+        return self.path / "chunks" / digest[:2] / digest
+
+    def has(self, digest):
+        return self.chunk_path(digest).is_file()
+
+    def _tmpfile(self):
+        tmpdir = self.path / "tmp"
+        os.makedirs(str(tmpdir), exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=str(tmpdir), delete=False)
+
+    def _commit(self, tmpname, digest):
+        """Move a temporary file into its place in the store.
+        """
+        path = self.chunk_path(digest)
+        if path.is_file():
+            os.unlink(tmpname)
+        else:
+            os.makedirs(str(path.parent), exist_ok=True)
+            os.replace(tmpname, str(path))
+
+    def _put_file(self, fileobj):
+        m = hashlib.new(self.HashAlg)
+        with self._tmpfile() as tmpf:
+            while True:
+                data = fileobj.read(1024*1024)
+                if not data:
+                    break
+                m.update(data)
+                tmpf.write(data)
+        digest = m.hexdigest()
+        self._commit(tmpf.name, digest)
+        return [digest]
+
+    def _put_chunk(self, data):
+        digest = hashlib.new(self.HashAlg, data).hexdigest()
+        if not self.has(digest):
+            with self._tmpfile() as tmpf:
+                tmpf.write(data)
+            self._commit(tmpf.name, digest)
+        return digest
+
+    def _cdc_cut_py(self, buf, end):
+        """Find the first chunk boundary in buf between the minimum
+        chunk size and end, or return end if there is none.
+
+        The gear hash only depends on the last 64 bytes, so we may
+        skip hashing the data below the minimum chunk size, save for
+        this window.
+        """
+        mask = ((1 << self.AvgBits) - 1) << (64 - self.AvgBits)
+        m64 = (1 << 64) - 1
+        gear = _gear
+        h = 0
+        for i in range(self.MinSize - 64, self.MinSize):
+            h = ((h << 1) + gear[buf[i]]) & m64
+        for i in range(self.MinSize, end):
+            h = ((h << 1) + gear[buf[i]]) & m64
+            if not h & mask:
+                return i + 1
+        return end
+
+    def _cdc_cut_np(self, buf, end):
+        """Same as :meth:`_cdc_cut_py`, but vectorized using NumPy.
+
+        The gear hash at position i is the sum of gear[buf[i-k]] << k
+        for k < 64, modulo 2**64.  It is calculated for a whole block
+        of positions at once in six steps, each one doubling the
+        number of terms summed up.
+        """
+        mask = numpy.uint64(((1 << self.AvgBits) - 1) << (64 - self.AvgBits))
+        data = numpy.frombuffer(buf, dtype=numpy.uint8)
+        blocksize = 1024*1024
+        for start in range(self.MinSize, end, blocksize):
+            stop = min(start + blocksize, end)
+            h = _gear_np[data[start - 63:stop]]
+            for m in (1, 2, 4, 8, 16, 32):
+                h[m:] += h[:-m] << numpy.uint64(m)
+            hits = numpy.flatnonzero((h[63:] & mask) == 0)
+            if len(hits):
+                return start + int(hits[0]) + 1
+        return end
+
+    def _cdc_chunks(self, fileobj):
+        """Split the content of fileobj into chunks using a gear hash.
+        """
+        find_cut = self._cdc_cut_np if numpy else self._cdc_cut_py
+        buf = bytearray()
+        eof = False
+        while True:
+            if not eof and len(buf) < self.MaxSize:
+                data = fileobj.read(self.MaxSize)
+                if data:
+                    buf += data
+                    continue
+                eof = True
+            if not buf:
+                break
+            end = min(len(buf), self.MaxSize)
+            cut = end
+            if end > self.MinSize:
+                cut = find_cut(buf, end)
+            yield bytes(buf[:cut])
+            del buf[:cut]
+
+    def put(self, fileobj, digest=None):
+        """Add the content of fileobj to the store.
+
+        Return the list of chunks.  If the hash of the content is
+        already known, it may be passed in digest.  In whole file
+        chunking mode, reading the file is skipped if this chunk is
+        already present.
+        """
+        if self.chunking == 'file':
+            if digest and self.has(digest):
+                return [digest]
+            return self._put_file(fileobj)
+        else:
+            return [self._put_chunk(c) for c in self._cdc_chunks(fileobj)]
+
+    def open(self, chunks):
+        """Return a file object to read the content of a list of chunks.
+        """
+        return io.BufferedReader(ChunkReader(self, chunks))
@@ -7,7 +7,8 @@ import sys
 import warnings
 from archive.exception import *
 
-subcmds = [ "create", "verify", "ls", "info", "check", "diff", "find", ]
+subcmds = [ "create", "verify", "ls", "info", "check", "diff", "find",
+           "index_gz", "extract", "scrub", "history", "du", ]
 
 def showwarning(message, category, filename, lineno, file=None, line=None):
     """Display ArchiveWarning in a somewhat more user friendly manner.
@@ -3,7 +3,9 @@
 
 from pathlib import Path
 import sys
+from archive import nocache
 from archive.archive import Archive
+from archive.cli.output import OutputWriter, add_arguments
 from archive.exception import ArgError
 from archive.manifest import FileInfo
 
@@ -20,7 +22,15 @@ def _matches(prefix, fi, entry):
             return False
     return True
 
+def _output(out, fmt, fi, present):
+    if fmt == 'jsonl':
+        out.record({ "path": str(fi.path), "type": fi.type,
+                     "present": present })
+    else:
+        out.line(str(fi.path))
+
 def check(args):
+    nocache.enabled = args.io_nocache
     if args.stdin:
         if args.files:
             raise ArgError("can't accept both, --stdin and the files argument")
@@ -29,7 +39,8 @@ def check(args):
         if not args.files:
             raise ArgError("either --stdin or the files argument is required")
         files = args.files
-    with Archive().open(args.archive) as archive:
+    with Archive().open(args.archive) as archive, \
+         OutputWriter(null=args.null) as out:
         metadata = { Path(md) for md in archive.manifest.metadata }
         FileInfo.Checksums = archive.manifest.checksums
         file_iter = FileInfo.iterpaths(files, set())
@@ -44,10 +55,10 @@ def check(args):
             if (args.prefix / fi.path in metadata or 
                 entry and _matches(args.prefix, fi, entry)):
                 if args.present and not fi.is_dir():
-                    print(str(fi.path))
+                    _output(out, args.format, fi, True)
             else:
                 if not args.present:
-                    print(str(fi.path))
+                    _output(out, args.format, fi, False)
                 if fi.is_dir():
                     skip = True
     return 0
@@ -64,6 +75,10 @@ def add_parser(subparsers):
     parser.add_argument('--stdin', action='store_true',
                         help=("read files to be checked from stdin, "
                               "rather then from the command line"))
+    parser.add_argument('--io-nocache', action='store_true',
+                        help=("avoid filling the page cache with the files "
+                              "read"))
+    add_arguments(parser, null=True)
     parser.add_argument('archive', type=Path,
                         help=("path to the archive file"))
     parser.add_argument('files', nargs='*', type=Path,
@@ -2,7 +2,10 @@
 """
 
 from pathlib import Path
+from archive import nocache
 from archive.archive import Archive, DedupMode
+from archive.chunkstore import ChunkStore
+from archive.digest import algorithms
 
 
 suffix_map = {
@@ -14,6 +17,7 @@ suffix_map = {
 """Map path suffix to compression mode."""
 
 def create(args):
+    nocache.enabled = args.io_nocache
     if args.compression is None:
         try:
             args.compression = suffix_map["".join(args.archive.suffixes)]
@@ -22,10 +26,19 @@ def create(args):
             args.compression = 'gz'
     if args.compression == 'none':
         args.compression = ''
+    if args.chunk_store:
+        chunkstore = ChunkStore(args.chunk_store, args.chunking)
+    else:
+        chunkstore = None
     archive = Archive().create(args.archive, args.compression, args.files,
                                basedir=args.basedir, excludes=args.exclude,
                                dedup=DedupMode(args.deduplicate),
-                               tags=args.tag)
+                               tags=args.tag, base=args.incremental_from,
+                               chunkstore=chunkstore,
+                               framesize=args.frame_size if args.seekable
+                               else None,
+                               verify=args.verify, digests=args.digest,
+                               dir_hashes=args.dir_hashes)
     return 0
 
 def add_parser(subparsers):
@@ -42,6 +55,41 @@ def add_parser(subparsers):
     parser.add_argument('--deduplicate',
                         choices=[d.value for d in DedupMode], default='link',
                         help=("when to use hard links to duplicate files"))
+    parser.add_argument('--incremental-from', type=Path, metavar="base",
+                        help=("only store files that are new or changed "
+                              "with respect to the base archive"))
+    parser.add_argument('--chunk-store', type=Path, metavar="dir",
+                        help=("store the file content in a content "
+                              "addressed chunk store that may be shared "
+                              "by a series of archives"))
+    parser.add_argument('--chunking', choices=ChunkStore.Chunkings,
+                        default='file',
+                        help=("how to split files into chunks in the "
+                              "chunk store, cdc for content defined "
+                              "chunking is slow and needs NumPy to reach "
+                              "a reasonable throughput"))
+    parser.add_argument('--seekable', action='store_true',
+                        help=("compress in independent frames and write "
+                              "an index of the members to allow random "
+                              "access"))
+    parser.add_argument('--frame-size', type=int, default=4*1024*1024,
+                        metavar="size",
+                        help=("size of the frames in bytes of uncompressed "
+                              "data in the seekable mode"))
+    parser.add_argument('--io-nocache', action='store_true',
+                        help=("avoid filling the page cache with the files "
+                              "read and the archive written"))
+    parser.add_argument('--verify', action='store_true',
+                        help=("verify the archive while it is being "
+                              "written"))
+    parser.add_argument('--digest', choices=algorithms, action='append',
+                        help=("calculate a digest of the archive file "
+                              "with this hash algorithm and write it into "
+                              "a sidecar file"))
+    parser.add_argument('--dir-hashes', action='store_true',
+                        help=("record a hash over the content of each "
+                              "directory in the manifest, to allow "
+                              "archive-tool diff to skip equal subtrees"))
     parser.add_argument('archive', type=Path,
                         help=("path to the archive file"))
     parser.add_argument('files', nargs='+', type=Path,
@@ -1,11 +1,21 @@
 """Implement the diff subcommand.
 """
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import hashlib
+import os
 from pathlib import Path
 from archive.archive import Archive
 from archive.exception import ArchiveReadError
+from archive.manifest import Manifest
+from archive.cli.output import OutputWriter, add_arguments
 
 
+_ChecksumBatch = 1000
+"""Number of entries to calculate the checksums for at once when
+comparing with a live directory."""
+
 def _common_checksum(manifest1, manifest2):
     for algorithm in manifest1.checksums:
         if algorithm in manifest2.checksums:
@@ -14,109 +24,423 @@ def _common_checksum(manifest1, manifest2):
         raise ArchiveReadError("No common checksum algorithm, "
                                "cannot compare archive content.")
 
-def _next(it, skip=None):
-    try:
-        while True:
-            fi = next(it)
-            if skip:
-                try:
-                    fi.path.relative_to(skip)
-                except ValueError:
-                    pass
-                else:
-                    continue
-            return fi
-    except StopIteration:
+def _get(manifest, idx):
+    if idx < len(manifest):
+        return manifest[idx]
+    else:
         return None
 
-def _relpath(fi, basedir):
-    if fi is not None:
-        if fi.path.is_absolute():
-            return fi.path
+def _subtree_end(manifest, idx):
+    """Return the index of the first entry following the content of
+    the directory at index idx in the sorted manifest.
+    """
+    parts = manifest[idx].path.parts
+    n = len(parts)
+    # The content of the directory immediately follows in the sorted
+    # manifest, so we can find its end in a binary search.
+    lo, hi = idx + 1, len(manifest)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if manifest[mid].path.parts[:n] == parts:
+            lo = mid + 1
         else:
-            return fi.path.relative_to(basedir)
+            hi = mid
+    return lo
+
+def _same_subtree(fi1, hashes1, fi2, hashes2):
+    """Check whether the directory hashes indicate that the content of
+    both directories is the same.
+    """
+    if hashes1 is None or hashes2 is None:
+        return False
+    h1 = hashes1.get(str(fi1.path))
+    return h1 is not None and h1 == hashes2.get(str(fi2.path))
+
+def _relpath(fi, basedir):
+    if fi.path.is_absolute():
+        return fi.path
     else:
-        return None
+        return fi.path.relative_to(basedir)
 
-def diff(args):
-    archive1 = Archive().open(args.archive1)
-    archive1.close()
-    archive2 = Archive().open(args.archive2)
-    archive2.close()
-    algorithm = _common_checksum(archive1.manifest, archive2.manifest)
-    # In principle, we might rely on the fact that the manifest of an
-    # archive is always sorted at creation time.  On the other hand,
-    # as we depend on this, we sort them again to be on the safe side.
-    archive1.manifest.sort()
-    archive2.manifest.sort()
-    it1 = iter(archive1.manifest)
-    it2 = iter(archive2.manifest)
-    fi1 = _next(it1)
-    fi2 = _next(it2)
-    status = 0
+def _open(path):
+    archive = Archive().open(path)
+    archive.close()
+    return archive
+
+def _load_manifest(path):
+    """Read the manifest from an archive in a worker process.
+    """
+    with Archive().open(path) as archive:
+        return archive.basedir, archive.manifest
+
+def _open_parallel(paths, jobs):
+    """Open the archives, loading the manifests in a process pool.
+    """
+    archives = []
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+        for path, (basedir, manifest) in zip(paths,
+                                             executor.map(_load_manifest,
+                                                          paths)):
+            archive = Archive()
+            archive.path = path
+            archive.basedir = basedir
+            archive.manifest = manifest
+            archives.append(archive)
+    return archives
+
+def _pairs(archive1, relpath1, archive2, relpath2, skip_dir_content):
+    """Merge the sorted manifests of both archives.
+
+    Yield pairs of corresponding entries, with None in place of an
+    entry that is missing in one of the archives.
+    """
+    manifest1 = archive1.manifest
+    manifest2 = archive2.manifest
+    # Directory hashes allow to skip subtrees having the same content
+    # in both archives.  Older manifests do not have them.
+    hashes1 = manifest1.dir_hashes
+    hashes2 = manifest2.dir_hashes
+    idx1 = idx2 = 0
     while True:
-        path1 = _relpath(fi1, archive1.basedir)
-        path2 = _relpath(fi2, archive2.basedir)
+        fi1 = _get(manifest1, idx1)
+        fi2 = _get(manifest2, idx2)
+        path1 = relpath1(fi1) if fi1 is not None else None
+        path2 = relpath2(fi2) if fi2 is not None else None
         if path1 is None and path2 is None:
             break
         elif path1 is None or path1 > path2:
-            print("Only in %s: %s" % (archive2.path, fi2.path))
-            if args.skip_dir_content and fi2.is_dir():
-                fi2 = _next(it2, skip=fi2.path)
+            yield (None, fi2)
+            if skip_dir_content and fi2.is_dir():
+                idx2 = _subtree_end(manifest2, idx2)
             else:
-                fi2 = _next(it2)
-            status = max(status, 102)
+                idx2 += 1
         elif path2 is None or path2 > path1:
-            print("Only in %s: %s" % (archive1.path, fi1.path))
-            if args.skip_dir_content and fi1.is_dir():
-                fi1 = _next(it1, skip=fi1.path)
+            yield (fi1, None)
+            if skip_dir_content and fi1.is_dir():
+                idx1 = _subtree_end(manifest1, idx1)
             else:
-                fi1 = _next(it1)
-            status = max(status, 102)
+                idx1 += 1
         else:
             assert path1 == path2
-            if fi1.type != fi2.type:
-                print("Entries %s:%s and %s:%s have different type"
-                      % (archive1.path, fi1.path, archive2.path, fi2.path))
-                status = max(status, 102)
-            elif fi1.type == "l":
-                if fi1.target != fi2.target:
-                    print("Symbol links %s:%s and %s:%s have different target"
-                          % (archive1.path, fi1.path, archive2.path, fi2.path))
-                    status = max(status, 101)
-            elif fi1.type == "f":
-                # Note: we don't need to compare the size, because if
-                # the size differs, it's mostly certain that also the
-                # checksums do.
-                if fi1.checksum[algorithm] != fi2.checksum[algorithm]:
-                    print("Files %s:%s and %s:%s differ"
-                          % (archive1.path, fi1.path, archive2.path, fi2.path))
-                    status = max(status, 101)
-                elif args.report_meta and (fi1.uid != fi2.uid or
-                                           fi1.uname != fi2.uname or
-                                           fi1.gid != fi2.gid or
-                                           fi1.gname != fi2.gname or
-                                           fi1.mode != fi2.mode or
-                                           int(fi1.mtime) != int(fi2.mtime)):
-                    print("File system metadata for %s:%s and %s:%s differ"
-                          % (archive1.path, fi1.path, archive2.path, fi2.path))
-                    status = max(status, 100)
-            fi1 = _next(it1)
-            fi2 = _next(it2)
+            if (fi1.is_dir() and fi2.is_dir() and
+                _same_subtree(fi1, hashes1, fi2, hashes2)):
+                # The hashes do not cover the directories themselves,
+                # only their content can be skipped.
+                yield (fi1, fi2)
+                idx1 = _subtree_end(manifest1, idx1)
+                idx2 = _subtree_end(manifest2, idx2)
+                continue
+            yield (fi1, fi2)
+            idx1 += 1
+            idx2 += 1
+
+def _need_checksum(fi1, fi2, content):
+    """Check whether the checksum of the file fi2 in a live directory
+    needs to be calculated to compare it to fi1.
+    """
+    if not (fi1 and fi2 and fi1.is_file() and fi2.is_file()):
+        return False
+    if fi1.size != fi2.size:
+        return False
+    return content or int(fi1.mtime) != int(fi2.mtime)
+
+def _calc_checksums(files, workers):
+    """Calculate the checksums of the files in a pool of threads.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(lambda fi: fi.checksum, files):
+            pass
+
+def _with_checksums(pairs, content, workers):
+    """Calculate the checksums of the files in a live directory that
+    may have changed, while passing on the pairs.
+
+    Files having a different size differ anyway, files with the same
+    size and modification time are assumed to be unchanged, unless
+    content is True.  The pairs are taken in batches, so that the
+    checksums are calculated in parallel, without the need to merge
+    both sides completely first.
+    """
+    batch = []
+    for pair in pairs:
+        batch.append(pair)
+        if len(batch) >= _ChecksumBatch:
+            _calc_checksums([ fi2 for fi1, fi2 in batch
+                              if _need_checksum(fi1, fi2, content) ],
+                            workers)
+            yield from batch
+            batch = []
+    _calc_checksums([ fi2 for fi1, fi2 in batch
+                      if _need_checksum(fi1, fi2, content) ], workers)
+    yield from batch
+
+def _closest(candidates, path, relpath):
+    """Remove and return the candidate that most likely is the origin
+    of the entry at path.
+
+    Prefer candidates having the same name, then those sharing the
+    longest leading part of their path, then those at the least
+    depth.  Among equal ones, take the first.
+    """
+    def score(fi):
+        cpath = relpath(fi)
+        common = 0
+        for a, b in zip(cpath.parent.parts, path.parent.parts):
+            if a != b:
+                break
+            common += 1
+        return (cpath.name == path.name, common, -len(cpath.parts))
+    best = max(range(len(candidates)), key=lambda i: score(candidates[i]))
+    return candidates.pop(best)
+
+# The hash of a directory without content.  All empty directories
+# have it, so it does not tell which one has been renamed.
+_empty_dir_hash = hashlib.sha256().hexdigest()
+
+def _detect_renames(pairs, algorithm, hashes1, hashes2, relpath1, relpath2):
+    """Find entries that have been renamed or moved.
+
+    Entries only present in one archive are joined with those only
+    present in the other one on the directory hash or on checksum and
+    size respectively.  If there are several candidates with the same
+    content, the one with the same name or the closest path is taken.
+    Empty files and directories are not considered, as there is no
+    way to tell them apart.  Return a dict mapping the id of the
+    entries in the first archive to the renamed ones in the second
+    archive and a set of the ids of entries in the content of renamed
+    directories.
+    """
+    renames = {}
+    hidden = set()
+    # First pass: join directories on their hashes.
+    if hashes1 is not None and hashes2 is not None:
+        dirs1 = {}
+        for fi1, fi2 in pairs:
+            if fi2 is None and fi1.is_dir():
+                h = hashes1.get(str(fi1.path))
+                if h is not None and h != _empty_dir_hash:
+                    dirs1.setdefault(h, []).append(fi1)
+        moved1 = set()
+        moved2 = set()
+        for fi1, fi2 in pairs:
+            if fi1 is not None or not fi2.is_dir():
+                continue
+            if any(p in moved2 for p in fi2.path.parents):
+                continue
+            candidates = [ d1 for d1 in
+                           dirs1.get(hashes2.get(str(fi2.path)), ())
+                           if not any(p in moved1 for p in d1.path.parents) ]
+            if candidates:
+                d1 = _closest(candidates, relpath2(fi2), relpath1)
+                dirs1[hashes1[str(d1.path)]].remove(d1)
+                renames[id(d1)] = fi2
+                moved1.add(d1.path)
+                moved2.add(fi2.path)
+        for fi1, fi2 in pairs:
+            if fi2 is None:
+                if any(p in moved1 for p in fi1.path.parents):
+                    hidden.add(id(fi1))
+            elif fi1 is None:
+                if (fi2.path in moved2 or
+                    any(p in moved2 for p in fi2.path.parents)):
+                    hidden.add(id(fi2))
+    # Second pass: join the remaining files on checksum and size.
+    files1 = {}
+    for fi1, fi2 in pairs:
+        if (fi2 is None and fi1.is_file() and fi1.size > 0 and
+            id(fi1) not in hidden and id(fi1) not in renames):
+            key = (fi1.size, fi1.checksum[algorithm])
+            files1.setdefault(key, []).append(fi1)
+    sizes1 = { key[0] for key in files1 }
+    for fi1, fi2 in pairs:
+        if (fi1 is None and fi2.is_file() and id(fi2) not in hidden and
+            fi2.size in sizes1):
+            candidates = files1.get((fi2.size, fi2.checksum[algorithm]))
+            if candidates:
+                fi1 = _closest(candidates, relpath2(fi2), relpath1)
+                renames[id(fi1)] = fi2
+                hidden.add(id(fi2))
+    return renames, hidden
+
+def _open_directory(path, archive):
+    """Read the directory tree at path to compare it with the archive.
+
+    Return a pseudo archive for the directory and the function to
+    take the relative path of its entries.
+    """
+    if archive.manifest and archive.manifest[0].path.is_absolute():
+        path = path.resolve()
+        relpath = lambda fi: fi.path
+    else:
+        relpath = lambda fi: fi.path.relative_to(path)
+    directory = Archive()
+    directory.path = path
+    directory.basedir = path
+    directory.manifest = Manifest(paths=[path])
+    return directory, relpath
+
+_messages = {
+    "renamed": "Renamed %s:%s to %s:%s",
+    "type": "Entries %s:%s and %s:%s have different type",
+    "target": "Symbol links %s:%s and %s:%s have different target",
+    "content": "Files %s:%s and %s:%s differ",
+    "metadata": "File system metadata for %s:%s and %s:%s differ",
+}
+
+def _report(out, fmt, change, archive1, fi1, archive2, fi2):
+    """Write one difference in the selected output format.
+
+    fi1 or fi2 may be None for entries only present in one archive.
+    """
+    if fmt == 'jsonl':
+        record = { "change": change }
+        if fi1 is not None:
+            record.update(archive1=str(archive1.path), path1=str(fi1.path))
+        if fi2 is not None:
+            record.update(archive2=str(archive2.path), path2=str(fi2.path))
+        out.record(record)
+    elif fi1 is None:
+        out.line("Only in %s: %s" % (archive2.path, fi2.path))
+    elif fi2 is None:
+        out.line("Only in %s: %s" % (archive1.path, fi1.path))
+    else:
+        out.line(_messages[change]
+                 % (archive1.path, fi1.path, archive2.path, fi2.path))
+
+def diff(args):
+    live = args.archive2.is_dir()
+    if live:
+        archive1 = _open(args.archive1)
+        archive2, relpath2 = _open_directory(args.archive2, archive1)
+    else:
+        if args.jobs > 1:
+            archive1, archive2 = _open_parallel([args.archive1,
+                                                 args.archive2],
+                                                args.jobs)
+        else:
+            archive1 = _open(args.archive1)
+            archive2 = _open(args.archive2)
+        relpath2 = partial(_relpath, basedir=archive2.basedir)
+    relpath1 = partial(_relpath, basedir=archive1.basedir)
+    algorithm = _common_checksum(archive1.manifest, archive2.manifest)
+    # In principle, we might rely on the fact that the manifest of an
+    # archive is always sorted at creation time.  On the other hand,
+    # as we depend on this, we sort them again to be on the safe side.
+    # Manifests having directory hashes have been written by a
+    # version that sorts them, so we spare the cost of creating all
+    # the FileInfo objects in this case.
+    for manifest in (archive1.manifest, archive2.manifest):
+        if manifest.dir_hashes is None:
+            manifest.sort()
+    pairs = _pairs(archive1, relpath1, archive2, relpath2,
+                   args.skip_dir_content)
+    workers = args.jobs if args.jobs > 1 else (os.cpu_count() or 1)
+    if live:
+        pairs = _with_checksums(pairs, args.content, workers)
+
+    def compare(fi1, fi2):
+        """Report the difference of two corresponding entries.
+        Return the exit status.
+        """
+        if fi1 is None or fi2 is None:
+            report("only", archive1, fi1, archive2, fi2)
+            return 102
+        elif fi1.type != fi2.type:
+            report("type", archive1, fi1, archive2, fi2)
+            return 102
+        elif fi1.type == "l":
+            if fi1.target != fi2.target:
+                report("target", archive1, fi1, archive2, fi2)
+                return 101
+        elif fi1.type == "f":
+            if live:
+                differ = (fi1.size != fi2.size or
+                          (_need_checksum(fi1, fi2, args.content) and
+                           fi1.checksum[algorithm] !=
+                           fi2.checksum[algorithm]))
+            else:
+                # Note: we don't need to compare the size, because
+                # if the size differs, it's mostly certain that
+                # also the checksums do.
+                differ = (fi1.checksum[algorithm] !=
+                          fi2.checksum[algorithm])
+            if differ:
+                report("content", archive1, fi1, archive2, fi2)
+                return 101
+            elif args.report_meta and (fi1.uid != fi2.uid or
+                                       fi1.uname != fi2.uname or
+                                       fi1.gid != fi2.gid or
+                                       fi1.gname != fi2.gname or
+                                       fi1.mode != fi2.mode or
+                                       int(fi1.mtime) != int(fi2.mtime)):
+                report("metadata", archive1, fi1, archive2, fi2)
+                return 100
+        return 0
+
+    status = 0
+    # Entries only present in one archive, kept to detect renames.
+    only = []
+    with OutputWriter(null=args.null) as out:
+        report = partial(_report, out, args.format)
+        for fi1, fi2 in pairs:
+            if args.detect_renames and (fi1 is None or fi2 is None):
+                only.append((fi1, fi2))
+            else:
+                status = max(status, compare(fi1, fi2))
+        if only:
+            if live:
+                # Candidates for renamed files need the checksum.
+                sizes1 = { fi1.size for fi1, fi2 in only
+                           if fi2 is None and fi1.is_file() and
+                           fi1.size > 0 }
+                files = [ fi2 for fi1, fi2 in only
+                          if fi1 is None and fi2.is_file() and
+                          fi2.size in sizes1 ]
+                _calc_checksums(files, workers)
+            renames, hidden = _detect_renames(only, algorithm,
+                                              archive1.manifest.dir_hashes,
+                                              archive2.manifest.dir_hashes,
+                                              relpath1, relpath2)
+            for fi1, fi2 in only:
+                if id(fi1) in hidden or id(fi2) in hidden:
+                    continue
+                elif id(fi1) in renames:
+                    report("renamed", archive1, fi1,
+                           archive2, renames[id(fi1)])
+                    status = max(status, 102)
+                else:
+                    status = max(status, compare(fi1, fi2))
     return status
 
 def add_parser(subparsers):
     parser = subparsers.add_parser('diff',
                                    help=("show the differences between "
-                                         "two archives"))
+                                         "two archives or an archive and "
+                                         "a directory"))
     parser.add_argument('--report-meta', action='store_true',
                         help=("also show differences in file system metadata"))
     parser.add_argument('--skip-dir-content', action='store_true',
                         help=("in the case of a subdirectory missing from "
                               "one archive, only report the directory, but "
                               "skip its content"))
+    parser.add_argument('--detect-renames', action='store_true',
+                        help=("report files and directories that have been "
+                              "renamed or moved, rather than as missing "
+                              "from either side, directories only if "
+                              "both archives have been created with "
+                              "--dir-hashes"))
+    parser.add_argument('--content', action='store_true',
+                        help=("when comparing with a directory, check the "
+                              "content of all files, not only those having "
+                              "a different modification time"))
+    parser.add_argument('--jobs', type=int, default=1, metavar="n",
+                        help=("load the manifests of the archives in n "
+                              "parallel worker processes, or calculate "
+                              "the checksums of the files in a directory "
+                              "in n threads"))
+    add_arguments(parser, null=True)
     parser.add_argument('archive1', type=Path,
                         help=("first archive to compare"))
     parser.add_argument('archive2', type=Path,
-                        help=("second archive to compare"))
+                        help=("second archive or a directory to compare"))
     parser.set_defaults(func=diff)
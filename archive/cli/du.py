@@ -0,0 +1,43 @@
+"""Implement the du subcommand.
+"""
+
+from pathlib import Path
+from archive.archive import Archive
+from archive.cli.output import OutputWriter, add_arguments
+from archive.usage import DiskUsage
+
+
+def du(args):
+    usage = None
+    if not args.store:
+        usage = DiskUsage.read(args.archive)
+    if usage is None:
+        with Archive().open(args.archive) as archive:
+            usage = DiskUsage.calc(archive.manifest)
+        if args.store:
+            usage.write(args.archive)
+    with OutputWriter() as out:
+        for path, size, files, dedup in usage.query(args.path, args.depth):
+            if args.format == 'jsonl':
+                out.record({ "path": path, "size": size,
+                             "files": files, "dedup": dedup })
+            else:
+                out.line("%d\t%d\t%d\t%s" % (size, files, dedup, path))
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('du',
+                                   help=("show the size of the content "
+                                         "of the directories in an archive"))
+    parser.add_argument('--depth', type=int, metavar="n",
+                        help=("only show directories at most n levels "
+                              "below path"))
+    parser.add_argument('--store', action='store_true',
+                        help=("store the results in a sidecar file next "
+                              "to the archive to be used by later calls"))
+    add_arguments(parser)
+    parser.add_argument('archive', type=Path,
+                        help=("path to the archive file"))
+    parser.add_argument('path', type=Path, nargs='?',
+                        help=("directory in the archive to start from"))
+    parser.set_defaults(func=du)
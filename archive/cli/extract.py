@@ -0,0 +1,51 @@
+"""Implement the extract subcommand.
+"""
+
+from pathlib import Path
+from archive.archive import Archive
+
+
+def extract(args):
+    with Archive().open(args.archive) as archive:
+        archive.extract(args.directory, inclmeta=args.include_metadata,
+                        base=args.base, chunkstore=args.chunk_store,
+                        paths=args.patterns or None,
+                        workers=args.jobs if args.jobs > 1 else None,
+                        skip_identical=args.skip_identical,
+                        compare_checksum=args.compare_checksum)
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('extract',
+                                   help="extract files from the archive")
+    parser.add_argument('-C', '--directory', type=Path, default=Path("."),
+                        metavar="dir",
+                        help=("extract into this directory, default is "
+                              "the current working directory"))
+    parser.add_argument('--include-metadata', action='store_true',
+                        help="also extract the metadata, e.g. the manifest")
+    parser.add_argument('--base', type=Path,
+                        help=("location of the base archive of an "
+                              "incremental archive, if it differs from the "
+                              "one recorded in the archive"))
+    parser.add_argument('--chunk-store', type=Path, metavar="dir",
+                        help=("location of the chunk store, if it differs "
+                              "from the one recorded in the archive"))
+    parser.add_argument('--jobs', type=int, default=1, metavar="n",
+                        help=("write the files in n parallel threads, "
+                              "default is 1, writing serially"))
+    parser.add_argument('--skip-identical', action='store_true',
+                        help=("skip files already present in the target "
+                              "directory with the same size and "
+                              "modification time"))
+    parser.add_argument('--compare-checksum', action='store_true',
+                        help=("with --skip-identical, also compare the "
+                              "checksum of the present files"))
+    parser.add_argument('archive', type=Path,
+                        help=("path to the archive file"))
+    parser.add_argument('patterns', metavar="pattern", nargs='*',
+                        help=("only extract entries matching pattern, "
+                              "either a path in the archive or a shell "
+                              "style wildcard, including the content of "
+                              "matching directories"))
+    parser.set_defaults(func=extract)
@@ -1,11 +1,20 @@
 """Implement the find subcommand.
 """
 
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import datetime
 import fnmatch
+import itertools
+import operator
 from pathlib import Path
 import re
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from archive.archive import Archive
+from archive.cli.output import OutputWriter, add_arguments
 from archive.tools import parse_date
 
 
@@ -57,29 +66,179 @@ class timeinterval:
         elif self.direct == '>':
             return timestamp > self.point
 
+class sizeinterval:
+    """Represent a condition on the size of a file: larger or smaller
+    than a given size or exactly that size.
+    """
+
+    units = {'': 1, 'k': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+    def __init__(self, s):
+        m = re.match(r"^([+-]?)(\d+)([kMGT]?)$", s)
+        if not m:
+            raise ValueError("Invalid size '%s'" % s)
+        (sign, num, unit) = m.groups()
+        self.direct = {'+': '>', '-': '<', '': '='}[sign]
+        self.size = int(num) * self.units[unit]
+
+def checksum_value(s):
+    """Parse a checksum search argument, optionally prefixed by the
+    name of the hash algorithm, such as sha256:<hex>.
+    """
+    if ':' in s:
+        algorithm, value = s.split(':', 1)
+    else:
+        algorithm, value = None, s
+    if not re.match(r"^[0-9a-fA-F]+$", value):
+        raise ValueError("Invalid checksum '%s'" % s)
+    return (algorithm, value.lower())
+
+def regex(s):
+    try:
+        return re.compile(s)
+    except re.error as e:
+        raise ValueError("Invalid regular expression '%s': %s" % (s, e))
+
+
 class SearchFilter:
+    """Select the entries of a manifest matching the search criteria.
+
+    The criteria are compiled into a list of tests, each one operating
+    on a single column of the manifest, e.g. the values of one key in
+    all entries.  The numeric tests are evaluated first over the whole
+    column, using NumPy if available, so that the more expensive
+    string matches only need to look at the remaining candidates.
+    """
+
+    _ops = {'<': operator.lt, '>': operator.gt, '=': operator.eq}
+    _order = ['type', 'uid', 'size', 'mtime', 'checksum', 'name', 'path']
 
     def __init__(self, args):
-        self.name = args.name
-        self.type = args.type
-        self.mtime = args.mtime
+        self.tests = []
+        if args.type:
+            self.tests.append(('type', '=', args.type))
+        if args.uid is not None:
+            self.tests.append(('uid', '=', args.uid))
+        if args.size:
+            if args.type != 'f':
+                # Only files have a size.
+                self.tests.append(('type', '=', 'f'))
+            self.tests.append(('size', args.size.direct, args.size.size))
+        if args.mtime:
+            self.tests.append(('mtime', args.mtime.direct, args.mtime.point))
+        if args.checksum:
+            self.tests.append(('checksum', None, args.checksum))
+        if args.name:
+            pattern = re.compile(fnmatch.translate(args.name))
+            self.tests.append(('name', None, pattern))
+        if args.path:
+            self.tests.append(('path', None, args.path))
+        self.tests.sort(key=lambda t: self._order.index(t[0]))
+
+    @staticmethod
+    def _column(manifest, key, start, end):
+        values = manifest.column(key, start, end)
+        if key == 'type':
+            if numpy is not None:
+                return numpy.array(values)
+            return "".join(values)
+        elif key in {'uid', 'size'}:
+            values = [-1 if v is None else v for v in values]
+            if numpy is not None:
+                return numpy.array(values, dtype=numpy.int64)
+            return array('q', values)
+        elif key == 'mtime':
+            values = [float('nan') if v is None else v for v in values]
+            if numpy is not None:
+                return numpy.array(values, dtype=numpy.float64)
+            return array('d', values)
+        else:
+            return values
+
+    @staticmethod
+    def _match(key, value, v):
+        if key == 'checksum':
+            if v is None:
+                return False
+            algorithm, checksum = value
+            if algorithm:
+                return v.get(algorithm) == checksum
+            return checksum in v.values()
+        elif key == 'name':
+            return value.match(v.rpartition('/')[2]) is not None
+        else:
+            return value.search(v) is not None
 
-    def __call__(self, fileinfo):
-        if self.name and not fnmatch.fnmatch(fileinfo.path.name, self.name):
-            return False
-        if self.type and fileinfo.type != self.type:
-            return False
-        if self.mtime and not self.mtime.match(fileinfo.mtime):
-            return False
-        return True
+    def select(self, manifest, start=0, end=None):
+        """Return the indices of the matching entries of manifest in
+        the range from start to end.
+        """
+        if end is None:
+            end = len(manifest)
+        if numpy is not None:
+            idx = numpy.arange(start, end)
+        else:
+            idx = range(start, end)
+        for key, op, value in self.tests:
+            column = self._column(manifest, 'path' if key == 'name' else key,
+                                  start, end)
+            if op:
+                cmp = self._ops[op]
+                if numpy is not None:
+                    idx = idx[cmp(column[idx - start], value)]
+                else:
+                    idx = [i for i in idx if cmp(column[i - start], value)]
+            else:
+                idx = [i for i in idx
+                       if self._match(key, value, column[i - start])]
+                if numpy is not None:
+                    idx = numpy.array(idx, dtype=numpy.int64)
+        return [int(i) for i in idx]
+
+
+def _find(path, searchfilter, full=False, under=None):
+    """Search the manifest of one archive.
+
+    Return the matching paths as strings, or the full entries as dicts
+    if full is True.  This may be called in a worker process, so we
+    only send back the matches rather than the full manifest.
+    """
+    with Archive().open(path) as archive:
+        manifest = archive.manifest
+        if under:
+            start, end = manifest.subtree_range(under)
+        else:
+            start, end = 0, len(manifest)
+        matches = searchfilter.select(manifest, start, end)
+        if full:
+            return [manifest[i].as_dict() for i in matches]
+        else:
+            return [str(manifest[i].path) for i in matches]
 
+def _output(out, fmt, path, matches):
+    for m in matches:
+        if fmt == 'jsonl':
+            m['archive'] = str(path)
+            out.record(m)
+        else:
+            out.line("%s:%s" % (path, m))
 
 def find(args):
     searchfilter = SearchFilter(args)
-    for path in args.archives:
-        with Archive().open(path) as archive:
-            for fi in filter(searchfilter, archive.manifest):
-                print("%s:%s" % (path, fi.path))
+    full = args.format == 'jsonl'
+    with OutputWriter(null=args.null) as out:
+        if args.jobs > 1:
+            with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                results = executor.map(_find, args.archives,
+                                       itertools.repeat(searchfilter),
+                                       itertools.repeat(full),
+                                       itertools.repeat(args.under))
+                for path, matches in zip(args.archives, results):
+                    _output(out, args.format, path, matches)
+        else:
+            for path in args.archives:
+                _output(out, args.format, path,
+                        _find(path, searchfilter, full, args.under))
 
 def add_parser(subparsers):
     parser = subparsers.add_parser('find',
@@ -92,5 +251,23 @@ def add_parser(subparsers):
     parser.add_argument('--mtime', metavar="time",
                         help="find entries by modification time",
                         type=timeinterval)
+    parser.add_argument('--size', metavar="size", type=sizeinterval,
+                        help=("find files by size, +n for larger than, "
+                              "-n for smaller than or n for exactly n "
+                              "bytes, a suffix k, M, G or T may be used"))
+    parser.add_argument('--path', metavar="regex", type=regex,
+                        help=("find entries whose full path matches "
+                              "regular expression regex"))
+    parser.add_argument('--uid', type=int,
+                        help="find entries by numeric user id")
+    parser.add_argument('--checksum', metavar="[alg:]hex",
+                        type=checksum_value,
+                        help="find files by checksum")
+    parser.add_argument('--under', type=Path, metavar="dir",
+                        help=("only search the entry dir and its content"))
+    parser.add_argument('--jobs', type=int, default=1, metavar="n",
+                        help=("load the manifests of the archives in n "
+                              "parallel worker processes"))
+    add_arguments(parser, null=True)
     parser.add_argument('archives', metavar="archive", type=Path, nargs='+')
     parser.set_defaults(func=find)
@@ -0,0 +1,119 @@
+"""Implement the history subcommand.
+"""
+
+import contextlib
+import heapq
+import itertools
+import json
+from operator import itemgetter
+from pathlib import Path
+import tempfile
+from archive.archive import Archive
+from archive.cli.output import OutputWriter
+from archive.exception import ArchiveReadError
+
+
+def _dump(path, f):
+    """Write a compact record of each entry in the manifest of the
+    archive to f.
+
+    The records are written while iterating over the manifest, which
+    is sorted by path.  Return the checksum algorithms of the
+    manifest.
+    """
+    with Archive().open(path) as archive:
+        manifest = archive.manifest
+        basedir = archive.basedir
+        columns = zip(manifest.column('path'), manifest.column('type'),
+                      manifest.column('checksum'), manifest.column('target'))
+        for p, ftype, checksum, target in columns:
+            if ftype == "f":
+                data = checksum
+            elif ftype == "l":
+                data = target
+            else:
+                data = None
+            if Path(p).is_absolute():
+                relpath = p
+            else:
+                relpath = str(Path(p).relative_to(basedir))
+            print(json.dumps((relpath, p, ftype, data)), file=f)
+        return manifest.checksums
+
+def _read(f, idx, algorithm):
+    """Read the records written by :func:`_dump`.
+
+    The entries of the archives are matched on their path relative to
+    the base directory, compared by path components, which is the
+    order of the manifest.
+    """
+    for line in f:
+        relpath, path, ftype, data = json.loads(line)
+        if ftype == "f":
+            data = data[algorithm]
+        yield (Path(relpath).parts, idx, path, (ftype, data))
+
+def _events(entries, count):
+    """Find the changes of one path in the series of archives.
+
+    entries is a list of (idx, state) of the archives containing the
+    path, sorted by idx.  The first archive serves as the baseline.
+    Yield (event, idx) pairs.
+    """
+    prev_idx = prev_state = None
+    for idx, state in entries:
+        if prev_idx is None:
+            if idx > 0:
+                yield ("added", idx)
+        elif idx > prev_idx + 1:
+            yield ("removed", prev_idx + 1)
+            yield ("added", idx)
+        elif state != prev_state:
+            yield ("changed", idx)
+        prev_idx, prev_state = idx, state
+    if prev_idx < count - 1:
+        yield ("removed", prev_idx + 1)
+
+def history(args):
+    count = len(args.archives)
+    algorithms = None
+    with contextlib.ExitStack() as stack:
+        # Load each manifest once and spool its records to a
+        # temporary file, so that the merge only needs to hold one
+        # record per archive in memory.
+        files = []
+        for path in args.archives:
+            f = stack.enter_context(tempfile.TemporaryFile(mode="w+t"))
+            checksums = _dump(path, f)
+            if algorithms is None:
+                algorithms = list(checksums)
+            else:
+                algorithms = [ a for a in algorithms if a in checksums ]
+            f.seek(0)
+            files.append(f)
+        if not algorithms:
+            raise ArchiveReadError("No common checksum algorithm, "
+                                   "cannot compare archive content.")
+        streams = [ _read(f, idx, algorithms[0])
+                    for idx, f in enumerate(files) ]
+        merged = heapq.merge(*streams)
+        with OutputWriter() as out:
+            for _, group in itertools.groupby(merged, key=itemgetter(0)):
+                group = list(group)
+                # Report the path as it appears in the first archive
+                # containing the entry.
+                path = group[0][2]
+                entries = [ (idx, state) for _, idx, _, state in group ]
+                events = [ "%s in %s" % (e, args.archives[idx])
+                           for e, idx in _events(entries, count) ]
+                if events:
+                    out.line("%s: %s" % (path, ", ".join(events)))
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('history',
+                                   help=("show the changes across a series "
+                                         "of archives"))
+    parser.add_argument('archives', metavar="archive", type=Path, nargs='+',
+                        help=("archives in chronological order"))
+    parser.set_defaults(func=history)
@@ -0,0 +1,23 @@
+"""Implement the index-gz subcommand.
+"""
+
+from pathlib import Path
+from archive.index import ArchiveIndex
+
+
+def index_gz(args):
+    index = ArchiveIndex.build_gz(args.archive, args.span)
+    index.write(args.archive)
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('index-gz',
+                                   help=("build an index for random access "
+                                         "to a gzip compressed archive"))
+    parser.add_argument('--span', type=int, default=1024*1024,
+                        metavar="size",
+                        help=("distance of the checkpoints in bytes of "
+                              "uncompressed data"))
+    parser.add_argument('archive', type=Path,
+                        help=("path to the archive file"))
+    parser.set_defaults(func=index_gz)
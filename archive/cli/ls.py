@@ -3,32 +3,47 @@
 
 from pathlib import Path
 from archive.archive import Archive
+from archive.cli.output import OutputWriter, add_arguments
 from archive.exception import ArchiveReadError
 
 
-def ls_ls_format(archive):
+def ls_ls_format(out, fileinfos):
+    # The columns are aligned to the widest entry, so all lines need
+    # to be collected before the first one can be written.
     items = []
     l_ug = 0
     l_s = 0
-    for fi in archive.manifest:
+    for fi in fileinfos:
         elems = tuple(str(fi).split("  "))
         l_ug = max(l_ug, len(elems[1]))
         l_s = max(l_s, len(elems[2]))
         items.append(elems)
     format_str = "%%s  %%%ds  %%%ds  %%s  %%s" % (l_ug, l_s)
     for i in items:
-        print(format_str % i)
+        out.line(format_str % i)
 
-def ls_checksum_format(archive, algorithm):
-    for fi in archive.manifest:
+def ls_checksum_format(out, fileinfos, algorithm):
+    for fi in fileinfos:
         if not fi.is_file():
             continue
-        print("%s  %s" % (fi.checksum[algorithm], fi.path))
+        out.line("%s  %s" % (fi.checksum[algorithm], fi.path))
+
+def ls_jsonl_format(out, fileinfos):
+    for fi in fileinfos:
+        out.record(fi.as_dict())
 
 def ls(args):
-    with Archive().open(args.archive) as archive:
+    with Archive().open(args.archive) as archive, \
+         OutputWriter(null=args.null) as out:
+        if args.path:
+            fileinfos = archive.manifest.subtree(args.path)
+            if not fileinfos:
+                raise ArchiveReadError("%s: not found in archive"
+                                       % args.path)
+        else:
+            fileinfos = archive.manifest
         if args.format == 'ls':
-            ls_ls_format(archive)
+            ls_ls_format(out, fileinfos)
         elif args.format == 'checksum':
             if not args.checksum:
                 args.checksum = archive.manifest.checksums[0]
@@ -36,17 +51,21 @@ def ls(args):
                 if args.checksum not in archive.manifest.checksums:
                     raise ArchiveReadError("Checksums using '%s' hashes "
                                            "not available" % args.checksum)
-            ls_checksum_format(archive, args.checksum)
+            ls_checksum_format(out, fileinfos, args.checksum)
+        elif args.format == 'jsonl':
+            ls_jsonl_format(out, fileinfos)
         else:
             raise ValueError("invalid format '%s'" % args.format)
     return 0
 
 def add_parser(subparsers):
     parser = subparsers.add_parser('ls', help="list files in the archive")
-    parser.add_argument('--format', choices=['ls', 'checksum'], default='ls',
-                        help=("output style"))
+    add_arguments(parser, null=True, formats=('ls', 'checksum', 'jsonl'))
     parser.add_argument('--checksum',
                         help=("hash algorithm"))
     parser.add_argument('archive', type=Path,
                         help=("path to the archive file"))
+    parser.add_argument('path', type=Path, nargs='?',
+                        help=("only list this entry and, if it is a "
+                              "directory, its content"))
     parser.set_defaults(func=ls)
@@ -0,0 +1,70 @@
+"""Output of the subcommands in machine readable formats.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import json
+import sys
+
+
+def add_arguments(parser, null=False, formats=('text', 'jsonl')):
+    """Add the options to select the output format to parser.
+
+    The first one of formats is the default.
+    """
+    parser.add_argument('--format', choices=list(formats),
+                        default=formats[0],
+                        help=("output style, jsonl writes one JSON "
+                              "object per line"))
+    if null:
+        parser.add_argument('--null', action='store_true',
+                            help=("terminate the output lines with a null "
+                                  "character rather than a newline"))
+
+
+class OutputWriter:
+    """Write the output lines to stdout using a large buffer.
+
+    The lines are collected and written to the binary buffer of
+    :data:`sys.stdout` in chunks of :attr:`BufferSize` bytes, so that
+    the output of very long listings starts early, without the
+    overhead of writing each line on its own.
+    """
+
+    BufferSize = 1024*1024
+
+    def __init__(self, null=False):
+        self.terminator = b"\0" if null else b"\n"
+        sys.stdout.flush()
+        self._out = sys.stdout.buffer
+        self._buffer = []
+        self._size = 0
+
+    def line(self, s):
+        data = s.encode("utf-8", "surrogateescape") + self.terminator
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.BufferSize:
+            self.flush()
+
+    def record(self, obj):
+        """Write obj as one line of JSON.
+        """
+        self.line(json.dumps(obj, sort_keys=True))
+
+    def flush(self):
+        self._out.write(b"".join(self._buffer))
+        self._out.flush()
+        self._buffer = []
+        self._size = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
@@ -0,0 +1,148 @@
+"""Implement the scrub subcommand.
+"""
+
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+from archive.archive import Archive
+from archive.cli.create import suffix_map
+from archive.exception import *
+
+
+def _default_state():
+    cache = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache, "archive-tools", "scrub.json")
+
+def _archive_key(path):
+    """Identify an archive by inode, size and modification time.
+    """
+    st = path.stat()
+    return "%d:%d:%d" % (st.st_ino, st.st_size, int(st.st_mtime))
+
+
+class ScrubState:
+    """Record the last full verification of archives and the progress
+    of an interrupted one.
+    """
+
+    Version = "1.0"
+    SaveInterval = 10.0
+
+    def __init__(self, path):
+        self.path = path
+        self._last_save = time.monotonic()
+        try:
+            with path.open("rt") as f:
+                self.archives = json.load(f)["Archives"]
+        except FileNotFoundError:
+            self.archives = {}
+        except (OSError, ValueError, KeyError) as e:
+            raise ArchiveReadError("%s: invalid scrub state: %s" % (path, e))
+
+    def save(self):
+        os.makedirs(str(self.path.parent), exist_ok=True)
+        data = { "Archives": self.archives, "Version": self.Version }
+        with tempfile.NamedTemporaryFile("wt", dir=str(self.path.parent),
+                                         delete=False) as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(f.name, str(self.path))
+        self._last_save = time.monotonic()
+
+    def get(self, path):
+        """Return the recorded state of the archive at path, without
+        creating an entry for it.
+        """
+        return self.archives.get(_archive_key(path), {})
+
+    def entry(self, path):
+        return self.archives.setdefault(_archive_key(path),
+                                        { "Path": str(path) })
+
+    def is_due(self, path, interval):
+        verified = self.get(path).get("Verified")
+        return verified is None or verified + interval <= time.time()
+
+    def progress(self, path, fileinfo):
+        self.entry(path)["Resume"] = str(fileinfo.path)
+        if time.monotonic() - self._last_save >= self.SaveInterval:
+            self.save()
+
+    def done(self, path, success):
+        entry = self.entry(path)
+        entry.pop("Resume", None)
+        if success:
+            entry["Verified"] = time.time()
+        self.save()
+
+
+def _archives(paths):
+    """Yield the archives in paths, looking into directories.
+    """
+    for p in paths:
+        if p.is_dir():
+            for c in sorted(p.iterdir()):
+                if c.is_file() and any(c.name.endswith(s)
+                                       for s in suffix_map):
+                    yield c
+        else:
+            yield p
+
+def scrub(args):
+    state = ScrubState(args.state)
+    ratelimit = args.rate_limit * 1024 * 1024 if args.rate_limit else None
+    status = 0
+    try:
+        for path in _archives(args.paths):
+            if not args.force and not state.is_due(path,
+                                                   args.interval * 86400):
+                if args.verbose:
+                    print("%s: not due" % path)
+                continue
+            resume = state.get(path).get("Resume")
+            if args.verbose:
+                if resume:
+                    print("%s: resume after %s" % (path, resume))
+                else:
+                    print("%s: verify" % path)
+            try:
+                with Archive().open(path) as archive:
+                    archive.verify(ratelimit=ratelimit,
+                                   resume_after=resume and Path(resume),
+                                   progress=lambda fi: state.progress(path,
+                                                                      fi))
+            except ArchiveError as e:
+                print("%s scrub: error: %s" % (os.path.basename(sys.argv[0]),
+                                               e), file=sys.stderr)
+                status = max(status,
+                             3 if isinstance(e, ArchiveIntegrityError) else 1)
+                state.done(path, False)
+            else:
+                state.done(path, True)
+    finally:
+        state.save()
+    return status
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('scrub',
+                                   help=("regularly verify archives in the "
+                                         "background"))
+    parser.add_argument('--rate-limit', type=float, metavar="MiB/s",
+                        help="limit the bandwidth used to read the archives")
+    parser.add_argument('--state', type=Path, default=_default_state(),
+                        metavar="file",
+                        help=("file to record the verification state, "
+                              "default is %(default)s"))
+    parser.add_argument('--interval', type=float, default=7, metavar="days",
+                        help=("verify archives that have not been verified "
+                              "within this number of days, default is 7"))
+    parser.add_argument('--force', action='store_true',
+                        help="verify all archives, even if not due")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="report what is being done")
+    parser.add_argument('paths', metavar="path", type=Path, nargs='+',
+                        help=("archive files or directories containing "
+                              "archives"))
+    parser.set_defaults(func=scrub)
@@ -1,18 +1,128 @@
 """Implement the verify subcommand.
 """
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
 from pathlib import Path
+import time
+from archive import nocache
 from archive.archive import Archive
+from archive.digest import verify_digests
+from archive.exception import ArchiveError, ArchiveIntegrityError, ArgError
 
 
+def _percentage(s):
+    try:
+        value = float(s[:-1] if s.endswith("%") else s)
+    except ValueError:
+        value = -1
+    if not 0 <= value <= 100:
+        raise argparse.ArgumentTypeError("invalid percentage '%s'" % s)
+    return value
+
+def _verify_archive(path, args):
+    if args.outer_only:
+        verify_digests(path)
+        return
+    ratelimit = args.rate_limit * 1024 * 1024 if args.rate_limit else None
+    workers = args.threads if args.threads > 1 else None
+    if args.quick:
+        sample = 0
+    elif args.sample is not None:
+        sample = args.sample / 100
+    else:
+        sample = None
+    with Archive().open(path) as archive:
+        archive.verify(base=args.base, chunkstore=args.chunk_store,
+                       entries=args.entry, ratelimit=ratelimit,
+                       workers=workers, sample=sample, seed=args.seed)
+
+def _verify_status(path, args):
+    """Verify one archive, catching errors.
+
+    Return a tuple of the exit status, the error message, if any, and
+    the time taken.  This may be called in a worker process.
+    """
+    nocache.enabled = args.io_nocache
+    start = time.monotonic()
+    try:
+        _verify_archive(path, args)
+    except ArchiveIntegrityError as e:
+        return (3, str(e), time.monotonic() - start)
+    except ArchiveError as e:
+        return (1, str(e), time.monotonic() - start)
+    return (0, None, time.monotonic() - start)
+
+def _report(path, status, message, elapsed):
+    if status:
+        print("%s: FAILED: %s" % (path, message))
+    else:
+        size = path.stat().st_size / (1024 * 1024)
+        rate = size / elapsed if elapsed > 0 else 0.0
+        print("%s: OK, %.1f MiB in %.1f s, %.1f MiB/s"
+              % (path, size, elapsed, rate))
+
 def verify(args):
-    with Archive().open(args.archive) as archive:
-        archive.verify()
-    return 0
+    nocache.enabled = args.io_nocache
+    if args.quick and args.sample is not None:
+        raise ArgError("can't accept both, --quick and --sample")
+    if len(args.archives) == 1 and args.jobs <= 1:
+        _verify_archive(args.archives[0], args)
+        return 0
+    if args.base:
+        raise ArgError("--base can only be used with a single archive")
+    # Verify each archive, collecting the errors, rather than
+    # stopping at the first one.
+    if args.jobs > 1:
+        jobs = min(args.jobs, len(args.archives))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_verify_status, args.archives,
+                                        itertools.repeat(args)))
+    else:
+        results = map(_verify_status, args.archives, itertools.repeat(args))
+    status = 0
+    for path, (st, message, elapsed) in zip(args.archives, results):
+        _report(path, st, message, elapsed)
+        status = max(status, st)
+    return status
 
 def add_parser(subparsers):
     parser = subparsers.add_parser('verify',
                                    help="verify integrity of the archive")
-    parser.add_argument('archive', type=Path,
+    parser.add_argument('--base', type=Path,
+                        help=("check the references of an incremental "
+                              "archive against this base archive, rather "
+                              "than the one recorded in the archive"))
+    parser.add_argument('--chunk-store', type=Path, metavar="dir",
+                        help=("location of the chunk store, if it differs "
+                              "from the one recorded in the archive"))
+    parser.add_argument('--entry', type=Path, action='append',
+                        help=("only verify this entry in the archive"))
+    parser.add_argument('--rate-limit', type=float, metavar="MiB/s",
+                        help="limit the bandwidth used to read the archive")
+    parser.add_argument('--io-nocache', action='store_true',
+                        help=("avoid filling the page cache with the "
+                              "archive read"))
+    parser.add_argument('--jobs', type=int, default=1, metavar="n",
+                        help=("verify the archives in n parallel worker "
+                              "processes"))
+    parser.add_argument('--outer-only', action='store_true',
+                        help=("only check the archive file against the "
+                              "digests in its sidecar files"))
+    parser.add_argument('--quick', action='store_true',
+                        help=("only check the headers of the archive "
+                              "members against the manifest, but not "
+                              "the content"))
+    parser.add_argument('--sample', type=_percentage, metavar="N%",
+                        help=("only check the content of a random sample "
+                              "of N percent of the files"))
+    parser.add_argument('--seed', type=int,
+                        help="seed to choose the sample")
+    parser.add_argument('--threads', type=int, default=1, metavar="n",
+                        help=("hash the content of each archive in n "
+                              "worker threads, default is 1, hashing "
+                              "serially"))
+    parser.add_argument('archives', metavar="archive", type=Path, nargs='+',
                         help=("path to the archive file"))
     parser.set_defaults(func=verify)
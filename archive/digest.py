@@ -0,0 +1,108 @@
+"""Digests of the whole archive file, kept in sidecar files.
+
+The digests are calculated from the compressed output while the
+archive is being written.  The sidecar files use the format of
+:command:`sha256sum` and similar tools, so they may also be checked
+with these, e.g. after transferring the archive.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import hashlib
+from pathlib import Path
+from archive.exception import ArchiveIntegrityError, ArchiveReadError
+from archive import nocache
+
+
+algorithms = tuple(sorted(h for h in hashlib.algorithms_guaranteed
+                          if not h.startswith("shake_")))
+"""The hash algorithms that may be used for the digests."""
+
+def digest_path(path, hashalg):
+    """Return the path of the digest sidecar file for an archive.
+    """
+    path = Path(path)
+    return path.with_name("%s.%s" % (path.name, hashalg))
+
+
+class DigestWriter:
+    """A write-only file object wrapper calculating digests of the
+    data written.
+    """
+
+    def __init__(self, fileobj, hashalg):
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, "name", None)
+        self._hashes = { h:hashlib.new(h) for h in hashalg }
+
+    def write(self, data):
+        n = self.fileobj.write(data)
+        for m in self._hashes.values():
+            m.update(data)
+        return n
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def digests(self):
+        return { h: m.hexdigest() for h, m in self._hashes.items() }
+
+    def write_sidecars(self, path):
+        """Write the digests into the sidecar files for the archive at
+        path.
+        """
+        for h, digest in sorted(self.digests().items()):
+            with digest_path(path, h).open("wt") as f:
+                print("%s  %s" % (digest, Path(path).name), file=f)
+
+
+def _read_sidecar(path, hashalg):
+    sidecar = digest_path(path, hashalg)
+    try:
+        with sidecar.open("rt") as f:
+            digest, name = f.readline().rstrip("\n").split(None, 1)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        raise ArchiveReadError("%s: invalid digest file: %s" % (sidecar, e))
+    if name.lstrip("*") != Path(path).name:
+        raise ArchiveReadError("%s: invalid digest file: wrong file name %s"
+                               % (sidecar, name))
+    return digest
+
+def verify_digests(path):
+    """Check the archive file at path against its digest sidecar files.
+
+    Raise :exc:`ArchiveReadError` if there is no sidecar file.
+    """
+    expected = {}
+    for h in algorithms:
+        digest = _read_sidecar(path, h)
+        if digest is not None:
+            expected[h] = digest
+    if not expected:
+        raise ArchiveReadError("%s: no digest file found" % path)
+    m = { h:hashlib.new(h) for h in expected }
+    chunksize = 1024*1024
+    with open(str(path), "rb") as f:
+        dropper = nocache.Dropper(f)
+        while True:
+            chunk = f.read(chunksize)
+            if not chunk:
+                break
+            for h in expected:
+                m[h].update(chunk)
+            dropper.update()
+        dropper.update(final=True)
+    for h in sorted(expected):
+        if m[h].hexdigest() != expected[h]:
+            raise ArchiveIntegrityError("%s: %s digest does not match"
+                                        % (path, h))
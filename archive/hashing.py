@@ -0,0 +1,105 @@
+"""Calculate checksums using a pool of worker threads.
+
+When verifying an archive, the members need to be read sequentially,
+but hashing their content may be done concurrently.  The hash
+functions in :mod:`hashlib` release the GIL while processing large
+amounts of data, so that the :class:`ParallelHasher` allows the
+hashing to proceed in worker threads, while the main thread keeps
+decompressing and parsing the archive.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import queue
+
+
+def _hash_queue(q, m):
+    while True:
+        chunk = q.get()
+        if chunk is None:
+            break
+        for h in m.values():
+            h.update(chunk)
+    return { n: h.hexdigest() for n, h in m.items() }
+
+
+class ParallelHasher:
+    """Calculate checksums in a pool of worker threads.
+
+    The content of a file is read in the calling thread and passed on
+    to a worker through a bounded queue.  Checks depending on the
+    result are deferred and called in order in the calling thread, at
+    most maxpending of them being outstanding at any time.
+    """
+
+    ChunkSize = 64*1024
+    MaxChunks = 16
+
+    def __init__(self, workers, maxpending=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.maxpending = maxpending or 2*workers
+        self._pending = collections.deque()
+
+    def checksum(self, fileobj, hashalg):
+        """Read fileobj and calculate its hashes in a worker thread.
+
+        Return a Future for the checksum.
+        """
+        m = { h:hashlib.new(h) for h in hashalg }
+        q = queue.Queue(self.MaxChunks)
+        future = self.executor.submit(_hash_queue, q, m)
+        try:
+            while True:
+                chunk = fileobj.read(self.ChunkSize)
+                if not chunk:
+                    break
+                q.put(chunk)
+        finally:
+            q.put(None)
+        return future
+
+    def submit(self, fn, *args):
+        """Schedule fn(*args) to be called in a worker thread.
+        """
+        return self.executor.submit(fn, *args)
+
+    def defer(self, check):
+        """Schedule check to be called in the calling thread after the
+        previously deferred ones.
+
+        Block while too many checks are pending.  Errors are raised
+        here or in :meth:`wait`.
+        """
+        while len(self._pending) >= self.maxpending:
+            self._call_next()
+        self._pending.append(check)
+
+    def wait(self):
+        """Call all pending checks.
+        """
+        while self._pending:
+            self._call_next()
+
+    def _call_next(self):
+        check = self._pending.popleft()
+        try:
+            check()
+        except:
+            # Only report the first error.
+            self._pending.clear()
+            raise
+
+    def close(self):
+        self._pending.clear()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
@@ -0,0 +1,338 @@
+"""Provide random access to the members of a (compressed) tar archive.
+
+A compressed archive can only be read sequentially from the start.
+The :class:`ArchiveIndex` records the offsets of the members in the
+uncompressed tar stream together with a list of access points in the
+compressed file where decompression may start.  An archive created
+with :class:`FrameWriter` is compressed in independent frames, each
+frame start being such an access point.  The index is stored in a
+sidecar file next to the archive.
+
+For existing gzip compressed archives, :meth:`ArchiveIndex.build_gz`
+creates an index with decompression checkpoints, see
+:mod:`archive.zran`.
+"""
+
+import bisect
+import gzip
+import json
+from pathlib import Path
+import tarfile
+import zlib
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+try:
+    import lzma
+except ImportError:
+    lzma = None
+from archive.exception import ArchiveReadError
+from archive.throttle import ThrottledReader
+from archive.zran import IndexBuilder, CheckpointReader
+
+
+def _compressor(compression):
+    if compression == 'gz':
+        return zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif compression == 'bz2':
+        return bz2.BZ2Compressor(9)
+    elif compression == 'xz':
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ)
+    else:
+        raise ValueError("invalid compression '%s'" % compression)
+
+def _decompressor(compression, fileobj):
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    elif compression == 'bz2':
+        return bz2.BZ2File(fileobj, mode='rb')
+    elif compression == 'xz':
+        return lzma.LZMAFile(fileobj, mode='rb')
+    else:
+        raise ValueError("invalid compression '%s'" % compression)
+
+def index_path(path):
+    """Return the path of the index sidecar file for an archive.
+    """
+    path = Path(path)
+    return path.with_name(path.name + ".idx")
+
+
+class FrameWriter:
+    """A write-only file object that compresses the data in independent
+    frames of approximately framesize bytes of uncompressed data.
+
+    The frames are gzip members, bzip2 or xz streams respectively.
+    The concatenation of these frames is still a valid compressed file
+    that may be read sequentially with the standard tools.  The
+    uncompressed and compressed offset of the start of each frame is
+    recorded in :attr:`points`.
+    """
+
+    def __init__(self, fileobj, compression, framesize):
+        self.fileobj = fileobj
+        self.compression = compression
+        self.framesize = framesize
+        self.points = []
+        self._offset = 0
+        self._frame_start = 0
+        self._comp = None
+
+    def _start_frame(self):
+        self._frame_start = self._offset
+        self.points.append((self._offset, self.fileobj.tell()))
+        self._comp = _compressor(self.compression)
+
+    def _finish_frame(self):
+        self.fileobj.write(self._comp.flush())
+        self._comp = None
+
+    def write(self, data):
+        if not self.compression:
+            self.fileobj.write(data)
+            self._offset += len(data)
+            return len(data)
+        if self._comp is None:
+            self._start_frame()
+        self.fileobj.write(self._comp.compress(data))
+        self._offset += len(data)
+        if self._offset - self._frame_start >= self.framesize:
+            self._finish_frame()
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        if self._comp is not None:
+            self._finish_frame()
+
+
+class IndexingTarFile(tarfile.TarFile):
+    """A TarFile that records the offset of each member added.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.offsets = {}
+        super().__init__(*args, **kwargs)
+
+    def addfile(self, tarinfo, fileobj=None):
+        self.offsets[tarinfo.name] = self.offset
+        super().addfile(tarinfo, fileobj)
+
+
+class ArchiveIndex:
+    """Random access index of an archive.
+
+    The index maps the names of the members to their offset in the
+    uncompressed tar stream.  The access points are tuples
+    (uoffset, coffset) of the uncompressed offset and the
+    corresponding offset in the compressed file where decompression
+    may start.  Checkpoints within a gzip member are tuples
+    (uoffset, coffset, bits, window), see :mod:`archive.zran`.
+
+    In the sidecar file, the compressed windows follow the gzip
+    compressed JSON data.  When reading the index, the checkpoints
+    only record the position and the length of the window in the
+    sidecar file as tuples (uoffset, coffset, bits, pos, length), the
+    window is only read when it is needed.
+    """
+
+    Version = "1.1"
+
+    def __init__(self, compression='', size=None, points=None, members=None,
+                 path=None):
+        self.compression = compression
+        self.size = size
+        self.points = points or []
+        self.members = members or {}
+        self.path = path
+
+    @classmethod
+    def read(cls, path):
+        """Read the index of the archive at path from its sidecar file.
+        Return None if there is no index, if it does not match the
+        archive or if it has been written by another version.
+        """
+        idx_path = index_path(path)
+        try:
+            with idx_path.open("rb") as f:
+                # The gzip member with the JSON data is followed by
+                # the windows.  Decompress up to the end of the member
+                # to find where they start.
+                d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                chunks = []
+                while not d.eof:
+                    buf = f.read(64*1024)
+                    if not buf:
+                        raise ValueError("unexpected end of file")
+                    chunks.append(d.decompress(buf))
+                winstart = f.tell() - len(d.unused_data)
+            data = json.loads(b"".join(chunks).decode("ascii"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            raise ArchiveReadError("%s: invalid index: %s" % (idx_path, e))
+        if data.get("Version") != cls.Version:
+            return None
+        if data["Size"] != Path(path).stat().st_size:
+            return None
+        points = []
+        for p in data["Points"]:
+            if len(p) > 2:
+                points.append((p[0], p[1], p[2], winstart + p[3], p[4]))
+            else:
+                points.append(tuple(p))
+        return cls(compression=data["Compression"], size=data["Size"],
+                   points=points, members=data["Members"], path=idx_path)
+
+    def write(self, path):
+        """Write the index of the archive at path into its sidecar file.
+        """
+        points = []
+        windows = []
+        pos = 0
+        for p in self.points:
+            if len(p) > 2 and p[3] is not None:
+                window = zlib.compress(self._window(p))
+                points.append([p[0], p[1], p[2], pos, len(window)])
+                windows.append(window)
+                pos += len(window)
+            else:
+                points.append([p[0], p[1]])
+        data = {
+            "Compression": self.compression,
+            "Members": self.members,
+            "Points": points,
+            "Size": Path(path).stat().st_size,
+            "Version": self.Version,
+        }
+        with index_path(path).open("wb") as f:
+            f.write(gzip.compress(json.dumps(data).encode("ascii")))
+            for window in windows:
+                f.write(window)
+
+    def _window(self, point):
+        """Return the window of a checkpoint, reading it from the
+        sidecar file if needed.
+        """
+        if len(point) == 4:
+            return point[3]
+        pos, length = point[3:5]
+        try:
+            with self.path.open("rb") as f:
+                f.seek(pos)
+                return zlib.decompress(f.read(length))
+        except (OSError, zlib.error) as e:
+            raise ArchiveReadError("%s: invalid index: %s" % (self.path, e))
+
+    @classmethod
+    def build_gz(cls, path, span):
+        """Build an index for an existing gzip compressed archive.
+
+        Decompress the archive once, recording checkpoints
+        approximately every span bytes of uncompressed data.  Smaller
+        spans yield faster access at the cost of a larger index, each
+        checkpoint taking up to 32 KiB.
+        """
+        with Path(path).open("rb") as f:
+            if f.read(2) != b"\x1f\x8b":
+                raise ArchiveReadError("%s: not a gzip file" % path)
+            f.seek(0)
+            builder = IndexBuilder(f, span)
+            try:
+                members = {}
+                with tarfile.open(fileobj=builder, mode='r|') as tarf:
+                    for ti in tarf:
+                        members[ti.name] = ti.offset
+            except tarfile.TarError as e:
+                raise ArchiveReadError("%s: %s" % (path, e))
+            finally:
+                builder.close()
+        return cls(compression='gz', points=builder.points, members=members)
+
+    def _point(self, uoffset):
+        """Return the last access point before uoffset.
+        """
+        i = bisect.bisect_right(self.points, (uoffset, float('inf')))
+        return self.points[i - 1]
+
+    def _open_at(self, fileobj, uoffset):
+        """Return a file object to read the uncompressed tar stream,
+        starting at uoffset.
+        """
+        if not self.compression:
+            fileobj.seek(uoffset)
+            return fileobj
+        point = self._point(uoffset)
+        start = point[0]
+        if len(point) > 2 and point[3] is not None:
+            stream = CheckpointReader(fileobj, point[:3] +
+                                      (self._window(point),))
+        else:
+            fileobj.seek(point[1])
+            stream = _decompressor(self.compression, fileobj)
+        skip = uoffset - start
+        try:
+            while skip > 0:
+                data = stream.read(min(skip, 1024*1024))
+                if not data:
+                    raise ArchiveReadError("unexpected end of data")
+                skip -= len(data)
+        except:
+            stream.close()
+            raise
+        return stream
+
+    def open_member(self, path, name, bucket=None):
+        """Return a TarFile reading the archive at path in stream mode,
+        positioned at the member name.  The first call to
+        :meth:`tarfile.TarFile.next` will return this member.  If
+        bucket is given, the archive file is read at the rate limited
+        by this :class:`archive.throttle.TokenBucket`.
+        """
+        try:
+            uoffset = self.members[name]
+        except KeyError:
+            raise KeyError("member %s not found in index" % name)
+        fileobj = Path(path).open("rb")
+        if bucket:
+            fileobj = ThrottledReader(fileobj, bucket)
+        stream = None
+        try:
+            stream = self._open_at(fileobj, uoffset)
+            return _IndexedTarFile.open(fileobj=stream, mode='r|',
+                                        archive_fileobj=fileobj,
+                                        stream=stream)
+        except:
+            if stream is not None and stream is not fileobj:
+                stream.close()
+            fileobj.close()
+            raise
+
+
+class _IndexedTarFile(tarfile.TarFile):
+    """A TarFile opened by :meth:`ArchiveIndex.open_member`.
+    Also close the decompressing stream and the underlying archive
+    file on close.
+    """
+
+    def __init__(self, *args, archive_fileobj=None, stream=None, **kwargs):
+        self._archive_fileobj = archive_fileobj
+        self._stream = stream
+        super().__init__(*args, **kwargs)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._stream and self._stream is not self._archive_fileobj:
+                self._stream.close()
+            self._stream = None
+            if self._archive_fileobj:
+                self._archive_fileobj.close()
+            self._archive_fileobj = None
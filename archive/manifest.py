@@ -1,10 +1,12 @@
 """Provide the Manifest class that defines the archive metadata.
 """
 
+from collections import defaultdict
 from collections.abc import Sequence
 import datetime
 from distutils.version import StrictVersion
 import grp
+import hashlib
 import os
 from pathlib import Path
 import pwd
@@ -12,6 +14,7 @@ import stat
 import warnings
 import yaml
 import archive
+from archive import nocache
 from archive.exception import ArchiveInvalidTypeError, ArchiveWarning
 from archive.tools import now_str, parse_date, checksum, mode_ft, ft_mode
 
@@ -32,6 +35,8 @@ class FileInfo:
             if self.is_file():
                 self.size = data['size']
                 self._checksum = data['checksum'] or []
+                self.reference = data.get('reference', False)
+                self.chunks = data.get('chunks')
             elif self.is_symlink():
                 self.target = Path(data['target'])
         elif path is not None:
@@ -52,6 +57,8 @@ class FileInfo:
             if stat.S_ISREG(fstat.st_mode):
                 self.size = fstat.st_size
                 self._checksum = None
+                self.reference = False
+                self.chunks = None
             elif stat.S_ISDIR(fstat.st_mode):
                 pass
             elif stat.S_ISLNK(fstat.st_mode):
@@ -74,7 +81,9 @@ class FileInfo:
     def checksum(self):
         if self._checksum is None:
             with self.path.open('rb') as f:
+                nocache.sequential(f)
                 self._checksum = checksum(f, self.Checksums)
+                nocache.release(f)
         return self._checksum
 
     def is_dir(self):
@@ -100,6 +109,10 @@ class FileInfo:
         if self.is_file():
             d['size'] = self.size
             d['checksum'] = self.checksum
+            if self.reference:
+                d['reference'] = True
+            if self.chunks:
+                d['chunks'] = self.chunks
         elif self.is_symlink():
             d['target'] = str(self.target)
         return d
@@ -150,7 +163,12 @@ class Manifest(Sequence):
             self.head = next(docs)
             # Legacy: version 1.0 head did not have Metadata:
             self.head.setdefault("Metadata", [])
-            self.fileinfos = [ FileInfo(data=d) for d in next(docs) ]
+            # The FileInfo objects are only created when the entries
+            # are accessed, so that looking at a part of a large
+            # manifest does not need to build all of them.
+            self._data = next(docs)
+            self._fileinfos = [None] * len(self._data)
+            self._columns = {}
         elif paths is not None:
             self.head = {
                 "Checksums": FileInfo.Checksums,
@@ -162,15 +180,73 @@ class Manifest(Sequence):
             if tags is not None:
                 self.head["Tags"] = tags
             fileinfos = FileInfo.iterpaths(paths, set(excludes or ()))
-            self.fileinfos = sorted(fileinfos, key=lambda fi: fi.path)
+            self._data = None
+            self._fileinfos = sorted(fileinfos, key=lambda fi: fi.path)
+            self._columns = {}
         else:
             raise TypeError("Either fileobj or paths must be provided")
 
+    def _get(self, idx):
+        fi = self._fileinfos[idx]
+        if fi is None:
+            fi = self._fileinfos[idx] = FileInfo(data=self._data[idx])
+            self._data[idx] = None
+        return fi
+
+    def _path(self, idx):
+        fi = self._fileinfos[idx]
+        if fi is None:
+            return Path(self._data[idx]['path'])
+        else:
+            return fi.path
+
+    @property
+    def fileinfos(self):
+        """The list of the :class:`FileInfo` objects for all entries.
+
+        Accessing this creates the objects for the entries that have
+        not been accessed yet.  As the list may be modified by the
+        caller, the cached columns are dropped.
+        """
+        if self._data is not None:
+            for i in range(len(self)):
+                self._get(i)
+            self._data = None
+        self._columns = {}
+        return self._fileinfos
+
+    @fileinfos.setter
+    def fileinfos(self, fileinfos):
+        self._data = None
+        self._fileinfos = list(fileinfos)
+        self._columns = {}
+
     def __len__(self):
-        return len(self.fileinfos)
+        return len(self._fileinfos)
 
     def __getitem__(self, index):
-        return self.fileinfos.__getitem__(index)
+        if isinstance(index, slice):
+            return [ self._get(i) for i in range(*index.indices(len(self))) ]
+        else:
+            return self._get(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __getstate__(self):
+        # Pickle the manifest in the same compact form as it is
+        # serialized in the archive, rather than as a list of
+        # FileInfo objects.  This is relevant when manifests are sent
+        # back from worker processes.
+        data = [ self._data[i] if fi is None else fi.as_dict()
+                 for i, fi in enumerate(self._fileinfos) ]
+        return (self.head, data)
+
+    def __setstate__(self, state):
+        self.head, self._data = state
+        self._fileinfos = [None] * len(self._data)
+        self._columns = {}
 
     @property
     def version(self):
@@ -192,9 +268,128 @@ class Manifest(Sequence):
     def tags(self):
         return tuple(self.head.get("Tags", ()))
 
+    @property
+    def dir_hashes(self):
+        """Map the paths of the directories to a hash over their
+        content.  None if the manifest does not provide these hashes.
+
+        The hashes are kept in the head, which grows with the number
+        of directories and is parsed whenever the manifest is read.
+        This is why they are only recorded on request, see
+        :meth:`add_dir_hashes`.
+        """
+        return self.head.get("DirHashes")
+
+    def _calc_dir_hashes(self):
+        """Calculate a hash for each directory as the root of a Merkle
+        tree over the entries it contains.
+
+        The hashes cover the names, types, checksums, symlink targets
+        and the file system metadata (owner, mode and modification
+        time) of all entries in the directory, including
+        subdirectories and symlinks.  They do not cover the path and
+        the metadata of the directory itself.  So equal hashes
+        indicate that two directories have the same content, even if
+        they differ in their location.
+        """
+        hashes = {}
+        entries = defaultdict(list)
+        # Children sort after their parent directory, so we get the
+        # hashes of subdirectories before they are needed.
+        for fi in sorted(self, key=lambda fi: fi.path, reverse=True):
+            meta = ("%s\0%s\0%s\0%s\0%o\0%d"
+                    % (fi.uid, fi.uname, fi.gid, fi.gname, fi.mode,
+                       int(fi.mtime)))
+            if fi.is_dir():
+                m = hashlib.sha256()
+                for e in sorted(entries.pop(fi.path, ())):
+                    m.update(e.encode("utf-8", "surrogateescape"))
+                hashes[str(fi.path)] = m.hexdigest()
+                leaf = "d\0%s\0%s\0%s\n" % (fi.path.name,
+                                           hashes[str(fi.path)], meta)
+            elif fi.is_symlink():
+                leaf = "l\0%s\0%s\0%s\n" % (fi.path.name, fi.target, meta)
+            else:
+                cs = ",".join("%s:%s" % (h, fi.checksum[h])
+                              for h in sorted(fi.checksum))
+                leaf = "f\0%s\0%s\0%s\n" % (fi.path.name, cs, meta)
+            entries[fi.path.parent].append(leaf)
+        return hashes
+
     def add_metadata(self, path):
         self.head["Metadata"].append(str(path))
 
+    def add_dir_hashes(self):
+        """Record the directory hashes in the head, see
+        :attr:`dir_hashes`.  The hashes are calculated from the
+        current entries, so this should be called when the manifest is
+        complete.
+        """
+        self.head["DirHashes"] = self._calc_dir_hashes()
+
+    def subtree_range(self, path):
+        """Return the start and end index of the entries for path and
+        its content, see :meth:`subtree`.
+        """
+        path = Path(path)
+        parts = path.parts
+        n = len(parts)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+        hi = len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._path(mid).parts[:n] == parts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def subtree(self, path):
+        """Return the entries for path and, if it is a directory, its
+        content.
+
+        The entries are located in a binary search, assuming that the
+        manifest is sorted by path, which is the case for manifests
+        read from an archive.
+        """
+        start, end = self.subtree_range(path)
+        return self[start:end]
+
+    def column(self, key, start=0, end=None):
+        """Return the values of key in the entries from start to end,
+        as they appear in the serialized manifest.
+
+        This does not create the FileInfo objects for entries that
+        have not yet been accessed.  The value is None for entries not
+        having the key.  A column taken over all entries is cached, so
+        that it is only extracted once from the entries.  The cache is
+        dropped when the entries are sorted or replaced.
+        """
+        if end is None:
+            end = len(self)
+        try:
+            column = self._columns[key]
+        except KeyError:
+            pass
+        else:
+            return column[start:end]
+        values = []
+        for i in range(start, end):
+            fi = self._fileinfos[i]
+            d = self._data[i] if fi is None else fi.as_dict()
+            values.append(d.get(key))
+        if start == 0 and end == len(self):
+            self._columns[key] = values
+            return list(values)
+        return values
+
     def find(self, path):
         for fi in self:
             if fi.path == path:
@@ -213,4 +408,7 @@ class Manifest(Sequence):
     def sort(self, *, key=None, reverse=False):
         if key is None:
             key = lambda fi: fi.path
-        self.fileinfos.sort(key=key, reverse=reverse)
+        self._fileinfos = list(self)
+        self._data = None
+        self._columns = {}
+        self._fileinfos.sort(key=key, reverse=reverse)
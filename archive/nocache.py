@@ -0,0 +1,100 @@
+"""Keep the page cache clean while processing large amounts of data.
+
+Reading or writing a large archive would otherwise evict the pages
+other processes on the same host depend on.  If :data:`enabled` is
+set, files are read and written with :func:`os.posix_fadvise` hints:
+sequential access is announced, so that the kernel may use a larger
+readahead, and the pages are dropped from the cache once they have
+been processed.  On platforms lacking posix_fadvise, nothing happens.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import io
+import os
+
+
+enabled = False
+"""Whether to give the hints.  Set by the `--io-nocache` option."""
+
+_fadvise = getattr(os, "posix_fadvise", None)
+_datasync = getattr(os, "fdatasync", os.fsync)
+
+def _fileno(fileobj):
+    try:
+        return fileobj.fileno()
+    except (AttributeError, io.UnsupportedOperation, OSError):
+        return None
+
+def _advise(fd, offset, length, advice):
+    if enabled and _fadvise and fd is not None:
+        try:
+            _fadvise(fd, offset, length, advice)
+        except OSError:
+            # E.g. ESPIPE if the file is a pipe.
+            pass
+
+def sequential(fileobj):
+    """Announce that fileobj will be read sequentially.
+    """
+    if enabled and _fadvise:
+        _advise(_fileno(fileobj), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+def release(fileobj, offset=0, length=0):
+    """Drop the cached pages of a file that has been read.  If length
+    is given, only the pages in this range are dropped.
+    """
+    if enabled and _fadvise:
+        _advise(_fileno(fileobj), offset, length, os.POSIX_FADV_DONTNEED)
+
+
+class Dropper:
+    """Drop the cached pages of a large file, while it is being read
+    or written sequentially.
+
+    :meth:`update` should be called regularly.  It drops the pages,
+    once more than :attr:`Step` bytes have been processed.  Written
+    pages need to be flushed to disk before they can be dropped, so
+    the pages up to the current position are dropped in this case.
+    A file being read may also be accessed out of order, e.g.
+    tarfile scans all headers first and then seeks back to the
+    members, so all pages of the file are dropped.  As the position
+    does not tell how much has been read in this case, the caller
+    should pass the size of the content read since the last call.
+    """
+
+    Step = 32*1024*1024
+
+    def __init__(self, fileobj, write=False):
+        if enabled and _fadvise:
+            self.fd = _fileno(fileobj)
+        else:
+            self.fd = None
+        self.write = write
+        self.done = 0
+        self.moved = 0
+        if self.fd is not None:
+            _advise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def update(self, final=False, size=0):
+        if self.fd is None:
+            return
+        try:
+            pos = os.lseek(self.fd, 0, os.SEEK_CUR)
+        except OSError:
+            self.fd = None
+            return
+        if self.write:
+            if pos - self.done >= self.Step or (final and pos > self.done):
+                _datasync(self.fd)
+                _advise(self.fd, self.done, pos - self.done,
+                        os.POSIX_FADV_DONTNEED)
+                self.done = pos
+        else:
+            self.moved += abs(pos - self.done) + size
+            self.done = pos
+            if self.moved >= self.Step or (final and self.moved):
+                _advise(self.fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                self.moved = 0
@@ -0,0 +1,120 @@
+"""Handle sparse files.
+
+Holes in files are detected using SEEK_DATA and SEEK_HOLE.  Such
+files are stored as sparse members in the GNU sparse format 1.0: a
+pax extended header marks the member as sparse and holds the real
+name and size, the data of the member starts with a map of the data
+segments, followed by the content of these segments.  The tarfile
+module from the standard library is able to read this format and to
+recreate the holes on extraction, but not to write it.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import copy
+import errno
+import os
+import tarfile
+
+
+_max_size = 8**11
+"""Sparse members need to fit into the size field of the ustar header,
+the pax size keyword would take precedence over the real size."""
+
+def data_segments(fileobj, size):
+    """Return the list of data segments (offset, length) of a file.
+
+    Return None if the file has no holes or if holes cannot be
+    detected on this platform or file system.
+    """
+    if not hasattr(os, "SEEK_DATA") or size == 0:
+        return None
+    fd = fileobj.fileno()
+    segments = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # No more data after offset.
+                    break
+                raise
+            if start >= size:
+                break
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            segments.append((start, end - start))
+            offset = end
+    except OSError as e:
+        if e.errno in (errno.EINVAL, errno.ENOTSUP):
+            return None
+        raise
+    finally:
+        fileobj.seek(0)
+    if segments == [(0, size)]:
+        return None
+    if not segments or segments[-1][0] + segments[-1][1] < size:
+        # Mark the real end of the file with an empty segment, as GNU
+        # tar does.
+        segments.append((size, 0))
+    return segments
+
+def copy_range(src, dst, length):
+    """Copy length bytes from src to dst.
+    """
+    while length > 0:
+        data = src.read(min(length, 1024*1024))
+        if not data:
+            raise tarfile.ReadError("unexpected end of data")
+        dst.write(data)
+        length -= len(data)
+
+def addsparse(tarf, tarinfo, fileobj, segments):
+    """Add a file as a sparse member to the TarFile tarf.
+
+    This is the equivalent to :meth:`tarfile.TarFile.addfile` for
+    sparse files.  Return False without writing anything if the file
+    cannot be represented as a sparse member.
+    """
+    smap = [len(segments)]
+    for offset, length in segments:
+        smap.extend((offset, length))
+    mapbuf = "".join("%d\n" % n for n in smap).encode("ascii")
+    blocks, remainder = divmod(len(mapbuf), tarfile.BLOCKSIZE)
+    if remainder:
+        mapbuf += tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+    size = len(mapbuf) + sum(length for _, length in segments)
+    if size >= _max_size:
+        return False
+    ti = copy.copy(tarinfo)
+    ti.type = tarfile.REGTYPE
+    ti.size = size
+    ti.pax_headers = dict(tarinfo.pax_headers)
+    ti.pax_headers.update({
+        "GNU.sparse.major": "1",
+        "GNU.sparse.minor": "0",
+        "GNU.sparse.name": tarinfo.name,
+        "GNU.sparse.realsize": "%d" % tarinfo.size,
+    })
+    offsets = getattr(tarf, "offsets", None)
+    if offsets is not None:
+        offsets[tarinfo.name] = tarf.offset
+    buf = ti.tobuf(tarfile.PAX_FORMAT, tarf.encoding, tarf.errors)
+    tarf.fileobj.write(buf)
+    tarf.offset += len(buf)
+    tarf.fileobj.write(mapbuf)
+    for offset, length in segments:
+        fileobj.seek(offset)
+        copy_range(fileobj, tarf.fileobj, length)
+    blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+    if remainder:
+        tarf.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+        blocks += 1
+    tarf.offset += blocks * tarfile.BLOCKSIZE
+    tarinfo = copy.copy(tarinfo)
+    tarinfo.sparse = list(segments)
+    tarf.members.append(tarinfo)
+    return True
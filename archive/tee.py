@@ -0,0 +1,147 @@
+"""Pass the data written to a file on to a consumer in another thread.
+
+This is used to verify an archive while it is being written: the
+compressed output is read back from the :class:`TeeWriter` in a
+separate thread, decompressed and parsed, without the need to read
+the archive file again.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import queue
+import threading
+
+
+class _QueueReader:
+    """A read-only file object taking its data from a queue.
+
+    None in the queue marks the end of the data.
+    """
+
+    def __init__(self, q):
+        self._queue = q
+        self._buffer = b""
+        self._eof = False
+
+    def _fill(self):
+        if not self._eof:
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer += chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self._eof:
+                self._fill()
+        else:
+            while not self._buffer and not self._eof:
+                self._fill()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+    def readable(self):
+        return True
+
+    def drain(self):
+        """Discard all remaining data.
+        """
+        while not self._eof:
+            self._buffer = b""
+            self._fill()
+        self._buffer = b""
+
+
+def decompressor(fileobj, compression):
+    """Return a file object reading the decompressed content of
+    fileobj.
+
+    Concatenated compressed streams are read as one.
+    """
+    if compression == 'gz':
+        import gzip
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    elif compression == 'bz2':
+        import bz2
+        return bz2.BZ2File(fileobj)
+    elif compression == 'xz':
+        import lzma
+        return lzma.LZMAFile(fileobj)
+    else:
+        return fileobj
+
+
+class TeeWriter:
+    """A write-only file object that writes the data to fileobj and
+    passes it on to consumer running in a separate thread.
+
+    consumer is called with a file object to read the data from.  The
+    data is passed through a bounded queue, so the writer may get
+    blocked if the consumer falls behind.  An error in the consumer
+    is raised in :meth:`close`.
+    """
+
+    MaxChunks = 64
+
+    def __init__(self, fileobj, consumer):
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, "name", None)
+        self.error = None
+        self._queue = queue.Queue(self.MaxChunks)
+        self._reader = _QueueReader(self._queue)
+        self._thread = threading.Thread(target=self._run, args=(consumer,))
+        self._thread.start()
+
+    def _run(self, consumer):
+        try:
+            consumer(self._reader)
+        except BaseException as e:
+            self.error = e
+        finally:
+            # Keep on consuming the data, lest the writer would block.
+            self._reader.drain()
+
+    def write(self, data):
+        n = self.fileobj.write(data)
+        if data:
+            self._queue.put(bytes(data))
+        return n
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def _finish(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Signal the end of the data to the consumer and wait for it
+        to finish.
+        """
+        self._finish()
+        if self.error:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        if type is None:
+            self.close()
+        else:
+            # Errors in the consumer are most likely a consequence.
+            self._finish()
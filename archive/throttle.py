@@ -0,0 +1,67 @@
+"""Limit the bandwidth used to read data.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import time
+
+
+class TokenBucket:
+    """Limit the rate of an operation, e.g. the number of bytes read
+    per second.
+
+    Tokens are added at the given rate, up to capacity.  Consuming
+    more tokens than are available sleeps until the deficit is made
+    up.  A small capacity spreads the operation evenly over time,
+    rather than allowing large bursts.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate / 10
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def consume(self, n):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= n
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+
+class ThrottledReader:
+    """A read-only file object wrapper taking tokens from a
+    TokenBucket for each byte read.
+
+    Seeking is passed to the wrapped file object, so that it may be
+    used as the file object of a :class:`tarfile.TarFile`.
+    """
+
+    def __init__(self, fileobj, bucket):
+        self.fileobj = fileobj
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.bucket.consume(len(data))
+        return data
+
+    def seek(self, offset, whence=0):
+        return self.fileobj.seek(offset, whence)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
@@ -0,0 +1,164 @@
+"""Aggregate the size of the content of the directories in an archive.
+
+The recursive size, the number of files and the size of duplicate
+content is calculated for each directory in a single pass over the
+sorted manifest.  The aggregates may be stored in a sidecar file next
+to the archive, so that later queries do not need to read the
+manifest again.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import gzip
+import json
+from pathlib import Path
+from archive.exception import ArchiveReadError
+
+
+def usage_path(path):
+    """Return the path of the usage sidecar file for an archive.
+    """
+    path = Path(path)
+    return path.with_name(path.name + ".du")
+
+
+class DiskUsage:
+    """The aggregates for the directories in an archive.
+
+    :attr:`dirs` is a list of tuples (path, size, files, dedup) sorted
+    by path, where dedup is the size of the files in the directory
+    having the same content as another file earlier in the archive.
+    """
+
+    Version = "1.0"
+
+    def __init__(self, dirs=None):
+        self.dirs = dirs or []
+
+    @classmethod
+    def calc(cls, manifest):
+        """Calculate the aggregates from a manifest.
+
+        The manifest must be sorted by path, which is the case for
+        manifests read from an archive.
+        """
+        paths = manifest.column('path')
+        types = manifest.column('type')
+        sizes = manifest.column('size')
+        checksums = manifest.column('checksum')
+        algorithm = manifest.checksums[0] if manifest.checksums else None
+        # Prefix sums over the entries of size, number of files and
+        # size of duplicates.  The totals for a directory are then
+        # the difference of the sums at the start and the end of its
+        # content.
+        n = len(paths)
+        sum_size = [0] * (n + 1)
+        sum_files = [0] * (n + 1)
+        sum_dedup = [0] * (n + 1)
+        seen = set()
+        for i in range(n):
+            size = files = dedup = 0
+            if types[i] == 'f':
+                size = sizes[i]
+                files = 1
+                if algorithm and checksums[i]:
+                    cs = checksums[i].get(algorithm)
+                    if cs in seen:
+                        dedup = size
+                    else:
+                        seen.add(cs)
+            sum_size[i+1] = sum_size[i] + size
+            sum_files[i+1] = sum_files[i] + files
+            sum_dedup[i+1] = sum_dedup[i] + dedup
+        # The content of a directory immediately follows it in the
+        # sorted manifest.  Keep a stack of the directories containing
+        # the current entry to find where their content ends.
+        dirs = [None] * n
+        stack = []
+        def close(end):
+            start, path, parts = stack.pop()
+            dirs[start] = (path,
+                           sum_size[end] - sum_size[start],
+                           sum_files[end] - sum_files[start],
+                           sum_dedup[end] - sum_dedup[start])
+        for i in range(n):
+            parts = Path(paths[i]).parts
+            while stack and parts[:len(stack[-1][2])] != stack[-1][2]:
+                close(i)
+            if types[i] == 'd':
+                stack.append((i, paths[i], parts))
+        while stack:
+            close(n)
+        return cls([d for d in dirs if d is not None])
+
+    @classmethod
+    def read(cls, path):
+        """Read the aggregates of the archive at path from its sidecar
+        file.  Return None if there is no sidecar file or if it does
+        not match the archive.
+        """
+        try:
+            with gzip.open(str(usage_path(path)), "rt") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            raise ArchiveReadError("%s: invalid usage file: %s"
+                                   % (usage_path(path), e))
+        if data["Size"] != Path(path).stat().st_size:
+            return None
+        return cls([tuple(d) for d in data["Dirs"]])
+
+    def write(self, path):
+        """Write the aggregates of the archive at path into its sidecar
+        file.
+        """
+        data = {
+            "Dirs": [list(d) for d in self.dirs],
+            "Size": Path(path).stat().st_size,
+            "Version": self.Version,
+        }
+        with gzip.open(str(usage_path(path)), "wt") as f:
+            json.dump(data, f)
+
+    def query(self, path=None, depth=None):
+        """Return the aggregates for the directory path and the
+        directories it contains, down to depth levels below path.
+        If path is None, start at the top level directories.
+
+        Raise :exc:`ArchiveReadError` if path is not a directory in
+        the archive.
+        """
+        if not self.dirs:
+            return []
+        if path is None:
+            start, end = 0, len(self.dirs)
+            top = min(len(Path(d[0]).parts) for d in self.dirs)
+        else:
+            path = Path(path)
+            lo, hi = 0, len(self.dirs)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if Path(self.dirs[mid][0]) < path:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == len(self.dirs) or Path(self.dirs[lo][0]) != path:
+                raise ArchiveReadError("%s: no such directory in archive"
+                                       % path)
+            start = lo
+            top = len(path.parts)
+            hi = len(self.dirs)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if Path(self.dirs[mid][0]).parts[:top] == path.parts:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            end = lo
+        if depth is None:
+            return self.dirs[start:end]
+        return [ d for d in self.dirs[start:end]
+                 if len(Path(d[0]).parts) - top <= depth ]
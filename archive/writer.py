@@ -0,0 +1,196 @@
+"""Write extracted files using a pool of worker threads.
+
+Reading a tar archive is inherently sequential.  But writing the
+files and in particular setting their attributes may take a
+considerable amount of time on some file systems, e.g. on NFS each
+change of file metadata requires a round trip to the server.  The
+:class:`ParallelWriter` moves this work into a bounded pool of worker
+threads, while the archive is still read sequentially.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+from pathlib import Path
+import shutil
+from archive.exception import ArchiveIntegrityError
+from archive.sparse import copy_range
+from archive.zerocopy import copy_range as copy_fd_range
+
+
+def _set_attrs(path, tarinfo):
+    """Set owner, mode and modification time of an extracted file.
+    """
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        if tarinfo.issym() and hasattr(os, "lchown"):
+            os.lchown(str(path), tarinfo.uid, tarinfo.gid)
+        else:
+            os.chown(str(path), tarinfo.uid, tarinfo.gid)
+    if not tarinfo.issym():
+        os.chmod(str(path), tarinfo.mode)
+        os.utime(str(path), (tarinfo.mtime, tarinfo.mtime))
+
+def _unlink(path):
+    if os.path.lexists(str(path)):
+        os.unlink(str(path))
+
+def _write_file(path, tarinfo, data):
+    with path.open("wb") as f:
+        f.write(data)
+    _set_attrs(path, tarinfo)
+
+def _write_sparse(path, tarinfo, fileobj):
+    """Write a sparse file, recreating the holes.
+    """
+    with path.open("wb") as f:
+        for offset, length in tarinfo.sparse:
+            fileobj.seek(offset)
+            f.seek(offset)
+            copy_range(fileobj, f, length)
+        f.truncate(tarinfo.size)
+
+def _copy_file(path, tarinfo, source_fd):
+    with path.open("wb") as f:
+        copy_fd_range(source_fd, f.fileno(), tarinfo.offset_data, tarinfo.size)
+    _set_attrs(path, tarinfo)
+
+def _make_symlink(path, tarinfo):
+    _unlink(path)
+    os.symlink(tarinfo.linkname, str(path))
+    _set_attrs(path, tarinfo)
+
+def _make_link(path, target):
+    _unlink(path)
+    os.link(str(target), str(path))
+
+
+class ParallelWriter:
+    """Create files from tar members using a pool of worker threads.
+
+    Small files are read into memory and written by the workers,
+    larger files are written directly, only setting their attributes
+    is left to the workers.  The number of pending jobs is limited, so
+    that the memory consumption stays bounded.  The attributes of
+    directories are set in :meth:`close`, after all content has been
+    written.
+
+    If source_fd is given, it must be a file descriptor of the
+    uncompressed archive.  The content of regular files is then copied
+    directly from the archive file by the workers.
+    """
+
+    MaxBuffered = 1024*1024
+    """Maximum size of files to be buffered in memory."""
+
+    def __init__(self, targetdir, workers, maxpending=None, source_fd=None):
+        self.targetdir = Path(targetdir)
+        self.source_fd = source_fd
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.maxpending = maxpending or 4*workers
+        self._pending = collections.deque()
+        self._files = {}
+        self._dirs = []
+        self._made = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        if type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=True)
+
+    def submit(self, fn, *args):
+        """Schedule fn(*args) to be called in a worker thread.
+
+        Block while too many jobs are pending.  Errors are raised in
+        the calling thread, either here or in :meth:`close`.
+        """
+        while len(self._pending) >= self.maxpending:
+            self._pending.popleft().result()
+        future = self.executor.submit(fn, *args)
+        self._pending.append(future)
+        return future
+
+    def _wait(self):
+        while self._pending:
+            self._pending.popleft().result()
+
+    def _path(self, name):
+        p = Path(name)
+        if p.is_absolute() or ".." in p.parts:
+            raise ArchiveIntegrityError("%s: invalid path" % name)
+        return self.targetdir / p
+
+    def _makedirs(self, path):
+        if path not in self._made:
+            os.makedirs(str(path), exist_ok=True)
+            self._made.add(path)
+
+    def skip(self, name):
+        """Record that the file name is already present in the target
+        directory, so that hard links to it may still be created.
+        """
+        future = Future()
+        future.set_result(None)
+        self._files[name] = future
+
+    def add(self, tarinfo, fileobj=None):
+        """Extract a tar member.
+
+        For regular files and hard links, fileobj must be given to
+        read the content.  A hard link is created as a link if the
+        target has been extracted before, otherwise the content is
+        written as a regular file.
+        """
+        path = self._path(tarinfo.name)
+        if tarinfo.isdir():
+            self._makedirs(path)
+            self._dirs.append((path, tarinfo))
+            return
+        self._makedirs(path.parent)
+        if tarinfo.islnk() and tarinfo.linkname in self._files:
+            self._files[tarinfo.linkname].result()
+            target = self._path(tarinfo.linkname)
+            self._files[tarinfo.name] = self.submit(_make_link, path, target)
+        elif tarinfo.isfile() or tarinfo.islnk():
+            if tarinfo.sparse is not None:
+                _write_sparse(path, tarinfo, fileobj)
+                future = self.submit(_set_attrs, path, tarinfo)
+            elif tarinfo.isfile() and self.source_fd is not None:
+                future = self.submit(_copy_file, path, tarinfo,
+                                     self.source_fd)
+            elif tarinfo.isfile() and tarinfo.size <= self.MaxBuffered:
+                data = fileobj.read()
+                future = self.submit(_write_file, path, tarinfo, data)
+            else:
+                with path.open("wb") as f:
+                    shutil.copyfileobj(fileobj, f)
+                future = self.submit(_set_attrs, path, tarinfo)
+            self._files[tarinfo.name] = future
+        elif tarinfo.issym():
+            self.submit(_make_symlink, path, tarinfo)
+        else:
+            raise ArchiveIntegrityError("%s: invalid type" % tarinfo.name)
+
+    def close(self):
+        """Wait for all jobs and set the attributes of the directories.
+
+        The directories are processed from the deepest level upwards,
+        so that the attributes of a directory are not changed by
+        modifications of its subdirectories.
+        """
+        self._wait()
+        levels = collections.defaultdict(list)
+        for path, tarinfo in self._dirs:
+            levels[len(path.parts)].append((path, tarinfo))
+        for depth in sorted(levels.keys(), reverse=True):
+            for path, tarinfo in levels[depth]:
+                self.submit(_set_attrs, path, tarinfo)
+            self._wait()
+        self.executor.shutdown(wait=True)
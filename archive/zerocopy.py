@@ -0,0 +1,132 @@
+"""Move file content in and out of uncompressed archives without
+copying it through Python buffers.
+
+The content is copied from one file descriptor to another by the
+kernel, using :func:`os.copy_file_range` or :func:`os.sendfile` if
+available.  For reading, the archive is mapped into memory and the
+members are hashed directly from the mapping.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import copy
+import errno
+import hashlib
+import mmap
+import os
+import tarfile
+from archive import nocache
+
+
+_fallback_errnos = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+}
+"""Errors indicating that a method is not supported for these files."""
+
+_chunksize = 4*1024*1024
+
+def _copy_chunk(in_fd, out_fd, offset, count):
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range:
+        try:
+            return copy_file_range(in_fd, out_fd, count, offset)
+        except OSError as e:
+            if e.errno not in _fallback_errnos:
+                raise
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile:
+        try:
+            return sendfile(out_fd, in_fd, offset, count)
+        except OSError as e:
+            if e.errno not in _fallback_errnos:
+                raise
+    data = os.pread(in_fd, min(count, _chunksize), offset)
+    return os.write(out_fd, data)
+
+def copy_range(in_fd, out_fd, offset, count):
+    """Copy count bytes from in_fd, starting at offset, to the current
+    position of out_fd.
+
+    The position of in_fd is not used, so this may be called
+    concurrently from several threads reading the same file.
+    """
+    while count > 0:
+        n = _copy_chunk(in_fd, out_fd, offset, count)
+        if not n:
+            raise OSError("unexpected end of data")
+        offset += n
+        count -= n
+
+def addfile(tarf, tarinfo, fileobj):
+    """Add a regular file to an uncompressed TarFile.
+
+    This is the equivalent to :meth:`tarfile.TarFile.addfile`, but
+    the content is copied by the kernel.  The TarFile must have been
+    opened on a regular file.
+    """
+    tarinfo = copy.copy(tarinfo)
+    buf = tarinfo.tobuf(tarf.format, tarf.encoding, tarf.errors)
+    tarf.fileobj.write(buf)
+    tarf.offset += len(buf)
+    tarf.fileobj.flush()
+    copy_range(fileobj.fileno(), tarf.fileobj.fileno(), 0, tarinfo.size)
+    blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+    if remainder:
+        tarf.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+        blocks += 1
+    tarf.offset += blocks * tarfile.BLOCKSIZE
+    tarf.members.append(tarinfo)
+
+
+class MappedArchive:
+    """An uncompressed archive file mapped into memory.
+
+    If :data:`archive.nocache.enabled` is set, the pages of each
+    member are dropped after hashing it.  They need to be unmapped
+    for this, otherwise the kernel keeps them in the page cache.
+    """
+
+    def __init__(self, path):
+        self._file = open(str(path), "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+
+    def checksum(self, tarinfo, hashalg):
+        """Calculate hashes for the content of a regular file member.
+
+        Return None if the member is sparse.
+        """
+        if tarinfo.sparse is not None:
+            return None
+        m = { h:hashlib.new(h) for h in hashalg }
+        start = tarinfo.offset_data
+        end = start + tarinfo.size
+        with memoryview(self._mmap) as view:
+            for pos in range(start, end, _chunksize):
+                with view[pos:min(pos + _chunksize, end)] as chunk:
+                    for h in hashalg:
+                        m[h].update(chunk)
+        if nocache.enabled and hasattr(self._mmap, "madvise"):
+            start -= start % mmap.PAGESIZE
+            if end > start:
+                self._mmap.madvise(mmap.MADV_DONTNEED, start, end - start)
+                nocache.release(self._file, start, end - start)
+        return { h: m[h].hexdigest() for h in hashalg }
+
+    def close(self):
+        self._mmap.close()
+        # Pages that were still mapped could not be dropped before.
+        nocache.release(self._file)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
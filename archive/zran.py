@@ -0,0 +1,269 @@
+"""Random access into gzip files using decompression checkpoints.
+
+This is a port of the zran.c example from the zlib distribution.
+While decompressing a gzip file once, the state of the decompressor
+is saved at deflate block boundaries approximately every span bytes
+of uncompressed data.  Such a checkpoint consists of the offset in
+the compressed file, the number of bits of the preceding byte that
+still belong to the next block, and the last 32 KiB of uncompressed
+data, needed to resolve back references.  Later, decompression may
+resume at any checkpoint.
+
+The zlib module from the Python standard library does not provide
+the needed functionality, e.g. it is not possible to stop inflate at
+block boundaries or to prime the bit buffer.  So we use ctypes to
+call the zlib C library directly.
+
+.. note::
+   This module is intended for the internal use in archive-tools and
+   is not considered to be part of the API.
+"""
+
+import ctypes
+import ctypes.util
+from archive.exception import ArchiveReadError
+
+
+WINSIZE = 32768
+"""Size of the deflate window."""
+CHUNK = 65536
+"""Size of the input buffer."""
+
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+
+_zlib = None
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ("next_in", ctypes.c_void_p),
+        ("avail_in", ctypes.c_uint),
+        ("total_in", ctypes.c_ulong),
+        ("next_out", ctypes.c_void_p),
+        ("avail_out", ctypes.c_uint),
+        ("total_out", ctypes.c_ulong),
+        ("msg", ctypes.c_char_p),
+        ("state", ctypes.c_void_p),
+        ("zalloc", ctypes.c_void_p),
+        ("zfree", ctypes.c_void_p),
+        ("opaque", ctypes.c_void_p),
+        ("data_type", ctypes.c_int),
+        ("adler", ctypes.c_ulong),
+        ("reserved", ctypes.c_ulong),
+    ]
+
+def _get_zlib():
+    global _zlib
+    if _zlib is None:
+        name = ctypes.util.find_library('z')
+        if not name:
+            raise ArchiveReadError("zlib C library not found")
+        lib = ctypes.CDLL(name)
+        lib.zlibVersion.restype = ctypes.c_char_p
+        p = ctypes.POINTER(_ZStream)
+        lib.inflateInit2_.argtypes = [p, ctypes.c_int,
+                                      ctypes.c_char_p, ctypes.c_int]
+        lib.inflate.argtypes = [p, ctypes.c_int]
+        lib.inflateEnd.argtypes = [p]
+        lib.inflateReset2.argtypes = [p, ctypes.c_int]
+        lib.inflatePrime.argtypes = [p, ctypes.c_int, ctypes.c_int]
+        lib.inflateSetDictionary.argtypes = [p, ctypes.c_char_p,
+                                             ctypes.c_uint]
+        _zlib = lib
+    return _zlib
+
+
+class _Inflater:
+    """Decompress a deflate stream from a file, writing the output
+    into a circular window buffer.
+    """
+
+    def __init__(self, fileobj, wbits):
+        self.zlib = _get_zlib()
+        self.fileobj = fileobj
+        self.strm = _ZStream()
+        self.window = ctypes.create_string_buffer(WINSIZE)
+        self._inbuf = None
+        ret = self.zlib.inflateInit2_(ctypes.byref(self.strm), wbits,
+                                      self.zlib.zlibVersion(),
+                                      ctypes.sizeof(self.strm))
+        if ret != Z_OK:
+            raise ArchiveReadError("inflateInit failed: %d" % ret)
+        self.strm.avail_out = 0
+        self.coffset = fileobj.tell()
+        self.eof = False
+
+    def close(self):
+        if self.strm is not None:
+            self.zlib.inflateEnd(ctypes.byref(self.strm))
+            self.strm = None
+
+    def _fill(self):
+        if self.strm.avail_in == 0 and not self.eof:
+            data = self.fileobj.read(CHUNK)
+            if not data:
+                self.eof = True
+                return
+            self._inbuf = ctypes.create_string_buffer(data, len(data))
+            self.strm.next_in = ctypes.addressof(self._inbuf)
+            self.strm.avail_in = len(data)
+
+    def skip_input(self, n):
+        """Skip n bytes of the input.
+        """
+        while n > 0:
+            self._fill()
+            if self.eof:
+                raise ArchiveReadError("unexpected end of data")
+            k = min(n, self.strm.avail_in)
+            self.strm.next_in += k
+            self.strm.avail_in -= k
+            n -= k
+
+    def inflate(self, flush):
+        """Call inflate once.  Return a tuple of the return value and
+        the uncompressed output.
+        """
+        self._fill()
+        if self.strm.avail_out == 0:
+            self.strm.avail_out = WINSIZE
+            self.strm.next_out = ctypes.addressof(self.window)
+        start = WINSIZE - self.strm.avail_out
+        avail_in = self.strm.avail_in
+        ret = self.zlib.inflate(ctypes.byref(self.strm), flush)
+        self.coffset += avail_in - self.strm.avail_in
+        end = WINSIZE - self.strm.avail_out
+        if ret == Z_NEED_DICT:
+            raise ArchiveReadError("invalid gzip data: need dictionary")
+        if ret < 0 and ret != Z_BUF_ERROR:
+            msg = self.strm.msg.decode() if self.strm.msg else str(ret)
+            raise ArchiveReadError("invalid gzip data: %s" % msg)
+        if ret == Z_BUF_ERROR and self.eof:
+            raise ArchiveReadError("unexpected end of data")
+        return ret, self.window.raw[start:end]
+
+    def get_window(self):
+        """Return the last WINSIZE bytes of uncompressed data.
+        """
+        left = self.strm.avail_out
+        raw = self.window.raw
+        return raw[WINSIZE - left:] + raw[:WINSIZE - left]
+
+    def next_member(self):
+        """Prepare for the next gzip member after the end of a stream.
+        Return False if there is no more data.
+        """
+        self._fill()
+        if self.eof:
+            return False
+        self.zlib.inflateReset2(ctypes.byref(self.strm), 16 + 15)
+        return True
+
+
+class IndexBuilder:
+    """A file object that decompresses a gzip file and records
+    checkpoints while being read.
+
+    The checkpoints are tuples (uoffset, coffset, bits, window) in
+    :attr:`points`.  At the start of each gzip member, a point with
+    window None is recorded: decompression may simply start at this
+    position with a new gzip reader.
+    """
+
+    def __init__(self, fileobj, span):
+        self.span = span
+        self.points = []
+        self.uoffset = 0
+        self._last = 0
+        self._inflater = _Inflater(fileobj, 16 + 15)
+        self._buffer = b""
+        self._stream_end = False
+        self.points.append((0, self._inflater.coffset, 0, None))
+
+    def _decompress(self):
+        inflater = self._inflater
+        if self._stream_end:
+            # Skip the gzip trailer, handled by inflate, and look
+            # for the next member.
+            self._stream_end = False
+            coffset = inflater.coffset
+            if not inflater.next_member():
+                return None
+            self.points.append((self.uoffset, coffset, 0, None))
+            self._last = self.uoffset
+        ret, data = inflater.inflate(Z_BLOCK)
+        self.uoffset += len(data)
+        if ret == Z_STREAM_END:
+            self._stream_end = True
+        else:
+            data_type = inflater.strm.data_type
+            if ((data_type & 128) and not (data_type & 64) and
+                self.uoffset - self._last > self.span):
+                self.points.append((self.uoffset, inflater.coffset,
+                                    data_type & 7, inflater.get_window()))
+                self._last = self.uoffset
+        return data
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            data = self._decompress()
+            if data is None:
+                break
+            self._buffer += data
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self._inflater.close()
+
+
+class CheckpointReader:
+    """A file object that reads the uncompressed data of a gzip file,
+    starting at a checkpoint recorded by :class:`IndexBuilder`.
+    """
+
+    def __init__(self, fileobj, point):
+        uoffset, coffset, bits, window = point
+        fileobj.seek(coffset - (1 if bits else 0))
+        prime = fileobj.read(1)[0] if bits else None
+        self._inflater = _Inflater(fileobj, -15)
+        self._raw = True
+        strm = ctypes.byref(self._inflater.strm)
+        zlib = self._inflater.zlib
+        if bits:
+            zlib.inflatePrime(strm, bits, prime >> (8 - bits))
+        zlib.inflateSetDictionary(strm, window, len(window))
+        self._buffer = b""
+        self._eof = False
+
+    def _decompress(self):
+        inflater = self._inflater
+        ret, data = inflater.inflate(Z_NO_FLUSH)
+        if ret == Z_STREAM_END:
+            if self._raw:
+                # A raw deflate stream has no trailer, skip the gzip
+                # trailer of this member.
+                inflater.skip_input(8)
+                self._raw = False
+            if not inflater.next_member():
+                self._eof = True
+        return data
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            self._buffer += self._decompress()
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self._inflater.close()
@@ -0,0 +1,270 @@
+"""Timing of the I/O paths of archive-tools on synthetic data.
+
+This is not part of the test suite, but a script to reproduce the
+numbers behind the performance claims in CHANGES.rst.  It needs the
+package from a build tree:
+
+    python3 setup.py build
+    PYTHONPATH=build/lib python3 tests/bench_io.py sparse
+    PYTHONPATH=build/lib python3 tests/bench_io.py zerocopy
+    PYTHONPATH=build/lib python3 tests/bench_io.py nocache
+
+Each benchmark compares the optimized path with the plain one, that
+is selectively disabled for the comparison.  The test data is created
+in a temporary directory below --dir, which should be on the file
+system of interest.  Times are the best out of --repeat runs with a
+warm page cache, except for the nocache benchmark.  The nocache
+benchmark measures the page cache footprint with fincore(1) from
+util-linux.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+from pathlib import Path
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import archive.archive
+from archive import Archive
+from archive.manifest import Manifest
+from archive import nocache, zerocopy
+import archive.writer
+
+
+MiB = 1024*1024
+
+def _random_file(path, size):
+    with path.open("wb") as f:
+        while size > 0:
+            n = min(size, 4*MiB)
+            f.write(random.getrandbits(8*n).to_bytes(n, 'big'))
+            size -= n
+
+def _best(repeat, fn, setup=None):
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        t = time.perf_counter() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+def _report(label, seconds, size=None, extra=""):
+    if size:
+        rate = "%8.1f MiB/s" % (size / MiB / seconds)
+    else:
+        rate = " " * 13
+    print("%-36s %8.3f s %s %s" % (label, seconds, rate, extra))
+
+def _rmtree(path):
+    shutil.rmtree(str(path), ignore_errors=True)
+
+@contextlib.contextmanager
+def _patched(obj, name, value):
+    orig = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, orig)
+
+def _create(archive_path, paths, compression=""):
+    if archive_path.exists():
+        archive_path.unlink()
+    Archive().create(archive_path, compression, paths)
+
+def _extract(archive_path, outdir, workers=None):
+    _rmtree(outdir)
+    outdir.mkdir()
+    with Archive().open(archive_path) as archive:
+        archive.extract(outdir, workers=workers)
+
+def _verify(archive_path):
+    with Archive().open(archive_path) as archive:
+        archive.verify()
+
+def _buffered_addfile(tarf, tarinfo, fileobj):
+    tarf.addfile(tarinfo, fileobj)
+
+def _buffered_copy_range(in_fd, out_fd, offset, count):
+    while count > 0:
+        data = os.pread(in_fd, min(count, 4*MiB), offset)
+        if not data:
+            raise OSError("unexpected end of data")
+        os.write(out_fd, data)
+        offset += len(data)
+        count -= len(data)
+
+def _no_mapping(path):
+    raise OSError("disabled")
+
+
+def bench_sparse(args, workdir):
+    """A file of --size MiB having a data segment of 1 MiB every 64 MiB.
+    """
+    size = args.size * MiB
+    src = workdir / "src"
+    src.mkdir()
+    sparse = src / "disk.img"
+    with sparse.open("wb") as f:
+        for offset in range(0, size, 64*MiB):
+            f.seek(offset)
+            f.write(random.getrandbits(8*MiB).to_bytes(MiB, 'big'))
+        f.truncate(size)
+    print("sparse file: %d MiB, %d MiB allocated"
+          % (args.size, sparse.stat().st_blocks * 512 // MiB))
+    archive_path = workdir / "archive.tar"
+    outdir = workdir / "out"
+    os.chdir(str(workdir))
+    paths = [Path("src")]
+    for label, segments in (("sparse", archive.archive.data_segments),
+                            ("dense", lambda f, s: None)):
+        with _patched(archive.archive, "data_segments", segments):
+            t = _best(args.repeat, lambda: _create(archive_path, paths))
+        _report("create (%s)" % label, t, size,
+                "archive %d MiB" % (archive_path.stat().st_size // MiB))
+        t = _best(args.repeat, lambda: _extract(archive_path, outdir))
+        st = (outdir / "src" / "disk.img").stat()
+        _report("extract (%s)" % label, t, size,
+                "%d MiB allocated" % (st.st_blocks * 512 // MiB))
+        t = _best(args.repeat,
+                  lambda: _extract(archive_path, outdir, args.jobs))
+        st = (outdir / "src" / "disk.img").stat()
+        _report("extract --jobs %d (%s)" % (args.jobs, label), t, size,
+                "%d MiB allocated" % (st.st_blocks * 512 // MiB))
+
+
+def _make_tree(src, size, filesize):
+    src.mkdir()
+    for i in range(max(size // filesize, 1)):
+        _random_file(src / ("f%04d.dat" % i), filesize)
+
+def bench_zerocopy(args, workdir):
+    """Files of 16 MiB of random data, --size MiB in total, in an
+    uncompressed archive.
+    """
+    size = args.size * MiB
+    src = workdir / "src"
+    _make_tree(src, size, 16*MiB)
+    archive_path = workdir / "archive.tar"
+    outdir = workdir / "out"
+    os.chdir(str(workdir))
+    paths = [Path("src")]
+    t = _best(args.repeat, lambda: subprocess.check_call(
+        ["cp", "-r", "src", str(outdir)]), lambda: _rmtree(outdir))
+    _report("cp -r", t, size)
+    # Creating an archive first calculates the checksums for the
+    # manifest, this part does not depend on the way of copying.
+    t = _best(args.repeat, lambda: Manifest(paths=paths).write(io.BytesIO()))
+    _report("manifest (checksums only)", t, size)
+    with _patched(zerocopy, "addfile", _buffered_addfile):
+        t = _best(args.repeat, lambda: _create(archive_path, paths))
+    _report("create (copyfileobj)", t, size)
+    t = _best(args.repeat, lambda: _create(archive_path, paths))
+    _report("create (zero copy)", t, size)
+    with _patched(zerocopy, "MappedArchive", _no_mapping):
+        t = _best(args.repeat, lambda: _verify(archive_path))
+    _report("verify (tarfile)", t, size)
+    t = _best(args.repeat, lambda: _verify(archive_path))
+    _report("verify (mmap)", t, size)
+    with _patched(archive.writer, "copy_fd_range", _buffered_copy_range):
+        t = _best(args.repeat,
+                  lambda: _extract(archive_path, outdir, args.jobs))
+    _report("extract --jobs %d (pread/write)" % args.jobs, t, size)
+    t = _best(args.repeat, lambda: _extract(archive_path, outdir, args.jobs))
+    _report("extract --jobs %d (zero copy)" % args.jobs, t, size)
+
+
+def _drop_cache(paths):
+    for p in paths:
+        fd = os.open(str(p), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def _cached(paths):
+    """The number of bytes of paths in the page cache.
+    """
+    cmd = ["fincore", "--bytes", "--noheadings", "--output", "RES"]
+    out = subprocess.check_output(cmd + [str(p) for p in paths])
+    return sum(int(l) for l in out.split())
+
+def bench_nocache(args, workdir):
+    """Files of 16 MiB of random data, --size MiB in total.  Report
+    the amount of the source files and the archive left in the page
+    cache after create and verify.
+    """
+    if not shutil.which("fincore"):
+        raise SystemExit("fincore(1) is needed for this benchmark")
+    size = args.size * MiB
+    src = workdir / "src"
+    _make_tree(src, size, 16*MiB)
+    files = sorted(src.iterdir())
+    archive_path = workdir / "archive.tar"
+    os.chdir(str(workdir))
+    paths = [Path("src")]
+    for compression in ("", "gz"):
+        suffix = ".tar.gz" if compression else ".tar"
+        archive_path = workdir / ("archive" + suffix)
+        for enabled in (False, True):
+            label = "%s, %s" % (suffix, "--io-nocache" if enabled
+                                else "default")
+            with _patched(nocache, "enabled", enabled):
+                t = _best(args.repeat,
+                          lambda: _create(archive_path, paths, compression),
+                          lambda: _drop_cache(files))
+                _report("create (%s)" % label, t, size,
+                        "cached: src %d MiB, archive %d MiB"
+                        % (_cached(files) // MiB,
+                           _cached([archive_path]) // MiB))
+                t = _best(args.repeat, lambda: _verify(archive_path),
+                          lambda: _drop_cache([archive_path]))
+                _report("verify (%s)" % label, t, size,
+                        "cached: archive %d MiB"
+                        % (_cached([archive_path]) // MiB))
+
+
+benchmarks = {
+    "sparse": bench_sparse,
+    "zerocopy": bench_zerocopy,
+    "nocache": bench_nocache,
+}
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    argparser.add_argument('--dir', type=Path, default=Path("."),
+                           help=("directory to create the test data in, "
+                                 "default is the current directory"))
+    argparser.add_argument('--size', type=int, default=1024,
+                           help="size of the test data in MiB")
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help="number of runs to take the best time from")
+    argparser.add_argument('--jobs', type=int, default=4,
+                           help="number of workers for extract")
+    argparser.add_argument('--seed', type=int, default=0,
+                           help="seed for the random test data")
+    argparser.add_argument('benchmark', choices=sorted(benchmarks.keys()),
+                           nargs='+', help="benchmarks to run")
+    args = argparser.parse_args()
+    random.seed(args.seed)
+    cwd = os.getcwd()
+    for name in args.benchmark:
+        workdir = Path(tempfile.mkdtemp(prefix="bench-", dir=str(args.dir)))
+        try:
+            print("== %s: %s" % (name, benchmarks[name].__doc__.strip()))
+            benchmarks[name](args, workdir.resolve())
+        finally:
+            os.chdir(cwd)
+            _rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
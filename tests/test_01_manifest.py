@@ -2,7 +2,10 @@
 """
 
 import datetime
+import os
 from pathlib import Path
+import pickle
+from tempfile import TemporaryFile
 import pytest
 from archive.manifest import FileInfo, Manifest
 from conftest import *
@@ -160,3 +163,126 @@ def test_manifest_tags(test_dir, monkeypatch, tags, expected):
     monkeypatch.chdir(str(test_dir))
     manifest = Manifest(paths=[Path("base")], tags=tags)
     assert manifest.tags == expected
+
+
+def test_manifest_pickle(test_dir, monkeypatch):
+    """A manifest may be pickled and unpickled, as needed to send it
+    back from a worker process.
+    """
+    monkeypatch.chdir(str(test_dir))
+    manifest = Manifest(paths=[Path("base")])
+    manifest = pickle.loads(pickle.dumps(manifest))
+    assert manifest.checksums == tuple(FileInfo.Checksums)
+    check_manifest(manifest, testdata)
+
+
+def test_manifest_dir_hashes(test_dir, monkeypatch):
+    """Directory hashes are written with the manifest, if requested.
+    A change of a file only affects the hashes of the directories
+    containing it.
+    """
+    monkeypatch.chdir(str(test_dir))
+    manifest = Manifest(paths=[Path("base")])
+    assert manifest.dir_hashes is None
+    with TemporaryFile() as f:
+        manifest.write(f)
+        f.seek(0)
+        assert Manifest(fileobj=f).dir_hashes is None
+    manifest.add_dir_hashes()
+    with TemporaryFile() as f:
+        manifest.write(f)
+        f.seek(0)
+        hashes = Manifest(fileobj=f).dir_hashes
+    assert set(hashes.keys()) == {"base", "base/data", "base/empty"}
+    p = Path("base", "msg.txt")
+    p.chmod(0o600)
+    try:
+        with TemporaryFile() as f:
+            manifest = Manifest(paths=[Path("base")])
+            manifest.add_dir_hashes()
+            manifest.write(f)
+            f.seek(0)
+            new_hashes = Manifest(fileobj=f).dir_hashes
+    finally:
+        setup_testdata(test_dir, [d for d in testdata if d.path == p])
+    assert new_hashes["base"] != hashes["base"]
+    assert new_hashes["base/data"] == hashes["base/data"]
+    assert new_hashes["base/empty"] == hashes["base/empty"]
+
+def test_manifest_dir_hashes_metadata(test_dir, monkeypatch):
+    """The metadata of subdirectories and symlinks is included in the
+    hash of the directory containing them, but not in their own hash.
+    """
+    monkeypatch.chdir(str(test_dir))
+    manifest = Manifest(paths=[Path("base")])
+    manifest.add_dir_hashes()
+    hashes = manifest.dir_hashes
+    d = Path("base", "data")
+    s = Path("base", "s.dat")
+    d.chmod(0o700)
+    os.utime(str(s), (1565100853, 1565100853), follow_symlinks=False)
+    try:
+        manifest = Manifest(paths=[Path("base")])
+        manifest.add_dir_hashes()
+        new_hashes = manifest.dir_hashes
+    finally:
+        d.chmod(0o750)
+        os.utime(str(s), (1564333266, 1564333266), follow_symlinks=False)
+    assert new_hashes["base"] != hashes["base"]
+    assert new_hashes["base/data"] == hashes["base/data"]
+    manifest = Manifest(paths=[Path("base")])
+    manifest.add_dir_hashes()
+    assert manifest.dir_hashes == hashes
+
+
+@pytest.mark.parametrize(("path", "expected"), [
+    ("base/data", ["base/data", "base/data/rnd.dat"]),
+    ("base/msg.txt", ["base/msg.txt"]),
+    ("base", sorted(str(d.path) for d in testdata)),
+    ("base/dat", []),
+    ("nonexistent", []),
+])
+def test_manifest_subtree(path, expected):
+    """Select the entries below a path in a manifest.  Only the
+    FileInfo objects of these entries are created.
+    """
+    with gettestdata("manifest.yaml").open("rt") as f:
+        manifest = Manifest(fileobj=f)
+    assert [str(fi.path) for fi in manifest.subtree(path)] == expected
+    assert sum(fi is not None for fi in manifest._fileinfos) == len(expected)
+
+
+def test_manifest_fileinfos():
+    """The fileinfos property creates the FileInfo objects for all
+    entries.
+    """
+    with gettestdata("manifest.yaml").open("rt") as f:
+        manifest = Manifest(fileobj=f)
+    assert all(fi is None for fi in manifest._fileinfos)
+    fileinfos = manifest.fileinfos
+    assert [str(fi.path) for fi in fileinfos] == \
+        sorted(str(d.path) for d in testdata)
+    assert fileinfos[0] is manifest[0]
+    manifest.fileinfos = fileinfos[1:]
+    assert len(manifest) == len(fileinfos) - 1
+    assert list(manifest) == fileinfos[1:]
+
+
+def test_manifest_column():
+    """Take the values of a key from the entries.  The column over all
+    entries is cached until the entries are sorted.
+    """
+    with gettestdata("manifest.yaml").open("rt") as f:
+        manifest = Manifest(fileobj=f)
+    paths = sorted(str(d.path) for d in testdata)
+    assert manifest.column('path') == paths
+    assert manifest.column('path', 1, 3) == paths[1:3]
+    assert manifest.column('target') == \
+        [str(d.target) if d.type == 'l' else None
+         for d in sorted(testdata, key=lambda d: d.path)]
+    assert all(fi is None for fi in manifest._fileinfos)
+    assert set(manifest._columns) == {'path', 'target'}
+    manifest.column('path').clear()
+    assert manifest.column('path') == paths
+    manifest.sort(reverse=True)
+    assert manifest.column('path') == paths[::-1]
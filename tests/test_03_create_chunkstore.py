@@ -0,0 +1,164 @@
+"""Test archives storing their content in a shared chunk store.
+"""
+
+import filecmp
+import io
+from pathlib import Path
+from random import getrandbits
+import shutil
+import tarfile
+import pytest
+from archive import Archive
+from archive.chunkstore import ChunkStore
+from archive.exception import ArchiveIntegrityError
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(Path("base", "data", "rnd.dat"), 0o600),
+    DataFile(Path("base", "rnd.dat"), 0o600),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+@pytest.fixture(scope="function")
+def test_data(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    shutil.rmtree("base", ignore_errors=True)
+    shutil.rmtree("store", ignore_errors=True)
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+def count_chunks(store_dir):
+    return len(list((store_dir / "chunks").glob("*/*")))
+
+def test_create_chunkstore(test_data, testname):
+    """Create a series of two archives sharing a chunk store.
+    """
+    store = ChunkStore(Path("store"))
+    archive_path1 = Path(archive_name(tags=[testname, "1"]))
+    Archive().create(archive_path1, "", [Path("base")], chunkstore=store)
+    # Two files have the same content.
+    assert count_chunks(test_data / "store") == 2
+    with Archive().open(archive_path1) as archive:
+        check_manifest(archive.manifest, testdata)
+    shutil.copy(str(gettestdata("rnd2.dat")), "base/rnd.dat")
+    archive_path2 = Path(archive_name(tags=[testname, "2"]))
+    Archive().create(archive_path2, "", [Path("base")], chunkstore=store)
+    assert count_chunks(test_data / "store") == 3
+    for p in (archive_path1, archive_path2):
+        with Archive().open(p) as archive:
+            assert archive.manifest.head["ChunkStore"]["Path"] == "store"
+            archive.verify()
+            chunks = { str(fi.path): ",".join(fi.chunks)
+                       for fi in archive.manifest if fi.is_file() }
+        # The files are represented by empty placeholder members
+        # referring to the chunks, so that the members still match
+        # the manifest.
+        with tarfile.open(str(p), "r") as tarf:
+            members = [ti for ti in tarf
+                       if not ti.name.endswith(".manifest.yaml")]
+        assert [ti.name for ti in members] == \
+            sorted(str(d.path) for d in testdata)
+        for ti in members:
+            if ti.name in chunks:
+                assert ti.isfile() and ti.size == 0
+                assert ti.pax_headers[ChunkStore.PaxHeader] == chunks[ti.name]
+
+def test_extract_chunkstore(test_data, testname):
+    """Extract an archive reading the content from the chunk store.
+    """
+    store = ChunkStore(Path("store"))
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")], chunkstore=store)
+    outdir = test_data / "out"
+    shutil.rmtree(str(outdir), ignore_errors=True)
+    outdir.mkdir()
+    with Archive().open(archive_path) as archive:
+        archive.extract(outdir)
+    for p in ("msg.txt", "rnd.dat", "data/rnd.dat"):
+        assert filecmp.cmp(str(Path("base", p)), str(outdir / "base" / p),
+                           shallow=False)
+
+def test_verify_chunkstore_modes(test_data, testname):
+    """Verify an archive using the chunk store while it is being
+    written, with a limited rate and selected entries.
+    """
+    store = ChunkStore(Path("store"))
+    archive_path = Path(archive_name(ext="gz", tags=[testname]))
+    Archive().create(archive_path, "gz", [Path("base")], chunkstore=store,
+                     verify=True)
+    with Archive().open(archive_path) as archive:
+        archive.verify(ratelimit=100000000)
+        archive.verify(entries=[Path("base", "msg.txt")])
+        archive.verify(entries=[Path("base", "msg.txt")],
+                       ratelimit=100000000)
+
+def test_verify_missing_chunk(test_data, testname):
+    """Verify an archive having a chunk removed from the store.
+    """
+    store = ChunkStore(Path("store"))
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")], chunkstore=store)
+    with Archive().open(archive_path) as archive:
+        fi = archive.manifest.find(Path("base", "msg.txt"))
+        store.chunk_path(fi.chunks[0]).unlink()
+        with pytest.raises(ArchiveIntegrityError) as err:
+            archive.verify()
+        assert "base/msg.txt: missing chunk" in str(err.value)
+
+
+class SmallChunkStore(ChunkStore):
+    MinSize = 1024
+    AvgBits = 10
+    MaxSize = 8192
+
+def test_cdc_chunking(tmpdir):
+    """Content defined chunking finds the same chunks after a
+    modification in the middle of the data.
+    """
+    data = bytes(getrandbits(8) for _ in range(64*1024))
+    store = SmallChunkStore(tmpdir / "cdc-store", chunking='cdc')
+    chunks1 = store.put(io.BytesIO(data))
+    assert len(chunks1) > 1
+    with store.open(chunks1) as f:
+        assert f.read() == data
+    modified = data[:30000] + b"inserted" + data[30000:]
+    chunks2 = store.put(io.BytesIO(modified))
+    with store.open(chunks2) as f:
+        assert f.read() == modified
+    assert len(set(chunks2) - set(chunks1)) <= 2
+
+def test_cdc_chunking_large(tmpdir):
+    """Content defined chunking of several MB of data with the default
+    parameters.
+    """
+    size = 6*1024*1024
+    data = getrandbits(8*size).to_bytes(size, 'big')
+    store = ChunkStore(tmpdir / "cdc-large-store", chunking='cdc')
+    chunks = list(store._cdc_chunks(io.BytesIO(data)))
+    assert b"".join(chunks) == data
+    assert len(chunks) > 1
+    for c in chunks[:-1]:
+        assert ChunkStore.MinSize < len(c) <= ChunkStore.MaxSize
+
+def test_cdc_chunking_numpy(tmpdir):
+    """The vectorized gear hash finds the same boundaries as the pure
+    Python implementation.
+    """
+    pytest.importorskip("numpy")
+    size = 4*1024*1024
+    data = bytearray(getrandbits(8*size).to_bytes(size, 'big'))
+    for store in (ChunkStore(tmpdir / "cdc-np-store", chunking='cdc'),
+                  SmallChunkStore(tmpdir / "cdc-np-store", chunking='cdc')):
+        start = 0
+        while start < size - store.MaxSize:
+            buf = data[start:start + store.MaxSize]
+            cut = store._cdc_cut_np(buf, len(buf))
+            assert cut == store._cdc_cut_py(buf, len(buf))
+            start += cut
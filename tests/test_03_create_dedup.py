@@ -111,3 +111,19 @@ def test_verify(test_dir, dep_testcase):
             assert ti_cp.linkname == str(src)
         else:
             assert False, "invalid dedup mode"
+
+@pytest.mark.dependency()
+def test_verify_links_not_hashed(test_dir, dep_testcase):
+    """Hard links to a verified member are not read again.
+    """
+    dedup = dep_testcase
+    archive_path = test_dir / archive_name(tags=[dedup.value])
+    with Archive().open(archive_path) as archive:
+        extracted = []
+        extractfile = archive._file.extractfile
+        def _extractfile(member):
+            extracted.append(member)
+            return extractfile(member)
+        archive._file.extractfile = _extractfile
+        archive.verify()
+        assert not [ti for ti in extracted if ti.islnk()]
@@ -0,0 +1,182 @@
+"""Test creating incremental archives against a base archive.
+"""
+
+import filecmp
+import os
+from pathlib import Path
+import shutil
+import tarfile
+import pytest
+from archive import Archive
+from archive.exception import ArchiveIntegrityError, ArchiveReadError
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(Path("base", "data", "rnd.dat"), 0o600),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    with tmp_chdir(tmpdir):
+        Archive().create(Path("archive-base.tar"), "", [Path("base")])
+    return tmpdir
+
+@pytest.fixture(scope="function")
+def test_data(test_dir, monkeypatch):
+    monkeypatch.chdir(str(test_dir))
+    shutil.rmtree("base", ignore_errors=True)
+    setup_testdata(test_dir, testdata)
+    return test_dir
+
+def compare_dirs(dir1, dir2):
+    cmp = filecmp.dircmp(str(dir1), str(dir2))
+    assert not cmp.left_only and not cmp.right_only
+    assert not cmp.diff_files
+    for d in cmp.common_dirs:
+        compare_dirs(dir1 / d, dir2 / d)
+
+def test_create_incremental(test_data, testname):
+    """Create an incremental archive with one file modified and one
+    file added.
+    """
+    modified = Path("base", "data", "rnd.dat")
+    added = Path("base", "data", "rnd2.dat")
+    shutil.copy(str(gettestdata("rnd2.dat")), str(modified))
+    shutil.copy(str(gettestdata("rnd2.dat")), str(added))
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")],
+                     base=Path("archive-base.tar"))
+    with Archive().open(archive_path) as archive:
+        assert archive.manifest.head["Base"]["Path"] == "archive-base.tar"
+        refs = { fi.path for fi in archive.manifest
+                 if fi.is_file() and fi.reference }
+        assert refs == { Path("base", "msg.txt") }
+        archive.verify(base=Path("archive-base.tar"))
+    with tarfile.open(str(archive_path), "r") as tarf:
+        names = set(tarf.getnames())
+    assert "base/msg.txt" not in names
+    assert str(modified) in names
+    assert str(added) in names
+
+def test_create_incremental_touched(test_data, testname):
+    """A file having only its modification time changed is still a
+    reference to the base archive.
+    """
+    p = Path("base", "msg.txt")
+    os.utime(str(p), (1565100853, 1565100853))
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")],
+                     base=Path("archive-base.tar"))
+    with Archive().open(archive_path) as archive:
+        fi = archive.manifest.find(p)
+        assert fi.reference
+        assert int(fi.mtime) == 1565100853
+
+def test_extract_incremental(test_data, testname):
+    """Extract an incremental archive, resolving the references in the
+    base archive.
+    """
+    shutil.copy(str(gettestdata("rnd2.dat")), "base/data/rnd.dat")
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")],
+                     base=Path("archive-base.tar"))
+    outdir = test_data / "out"
+    shutil.rmtree(str(outdir), ignore_errors=True)
+    outdir.mkdir()
+    with Archive().open(archive_path) as archive:
+        archive.extract(outdir)
+    compare_dirs(Path("base"), outdir / "base")
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_extract_incremental_hardlink(test_data, testname, workers):
+    """Hard links between referenced files in the base archive are
+    retained on extraction.
+    """
+    os.link("base/msg.txt", "base/hard.txt")
+    base_path = Path(archive_name(tags=[testname, "base", str(workers)]))
+    Archive().create(base_path, "", [Path("base")])
+    shutil.copy(str(gettestdata("rnd2.dat")), "base/data/rnd.dat")
+    archive_path = Path(archive_name(tags=[testname, str(workers)]))
+    Archive().create(archive_path, "", [Path("base")], base=base_path)
+    outdir = test_data / "out"
+    shutil.rmtree(str(outdir), ignore_errors=True)
+    outdir.mkdir()
+    with Archive().open(archive_path) as archive:
+        refs = { fi.path for fi in archive.manifest
+                 if fi.is_file() and fi.reference }
+        assert refs == { Path("base", "msg.txt"), Path("base", "hard.txt") }
+        archive.extract(outdir, workers=workers)
+    compare_dirs(Path("base"), outdir / "base")
+    assert (outdir / "base" / "hard.txt").samefile(outdir / "base" / "msg.txt")
+    st = (outdir / "base" / "msg.txt").stat()
+    assert st.st_nlink == 2
+    assert st.st_mode & 0o777 == 0o644
+
+def test_verify_incremental_wrong_base(test_data, testname):
+    """Verify an incremental archive against the wrong base archive.
+    """
+    other_base = Path(archive_name(tags=[testname, "base"]))
+    Archive().create(other_base, "", [Path("base")])
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")],
+                     base=Path("archive-base.tar"))
+    with Archive().open(archive_path) as archive:
+        with pytest.raises(ArchiveIntegrityError) as err:
+            archive.verify(base=other_base)
+        assert "not the base archive" in str(err.value)
+
+def test_verify_incremental_entries(test_data, testname):
+    """Verifying selected entries of an incremental archive also
+    checks their references to the base archive.
+    """
+    other_base = Path(archive_name(tags=[testname, "base"]))
+    Archive().create(other_base, "", [Path("base")])
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")],
+                     base=Path("archive-base.tar"))
+    with Archive().open(archive_path) as archive:
+        archive.verify(entries=[Path("base", "msg.txt")])
+        for ratelimit in (None, 100000000):
+            with pytest.raises(ArchiveIntegrityError) as err:
+                archive.verify(base=other_base,
+                               entries=[Path("base", "msg.txt")],
+                               ratelimit=ratelimit)
+            assert "not the base archive" in str(err.value)
+
+def test_verify_incremental_recorded_base(test_data, testname):
+    """Verify an incremental archive, taking the base archive from the
+    manifest.  The base archives are closed with the archive.
+    """
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")],
+                     base=Path("archive-base.tar"))
+    archive = Archive().open(archive_path)
+    archive.verify()
+    bases = list(archive._bases)
+    assert [b.path for b in bases] == [Path("archive-base.tar")]
+    archive.close()
+    assert all(b._file is None for b in bases)
+
+def test_verify_incremental_missing_base(test_data, testname):
+    """Verifying an incremental archive fails if the base archive
+    recorded in the manifest is not found.
+    """
+    base_path = Path(archive_name(tags=[testname, "base"]))
+    Archive().create(base_path, "", [Path("base")])
+    archive_path = Path(archive_name(tags=[testname]))
+    Archive().create(archive_path, "", [Path("base")], base=base_path)
+    base_path.unlink()
+    with Archive().open(archive_path) as archive:
+        with pytest.raises(ArchiveReadError) as err:
+            archive.verify()
+        assert "base archive %s not found" % base_path in str(err.value)
@@ -0,0 +1,97 @@
+"""Test creating seekable archives with an index of the members.
+"""
+
+import filecmp
+import os
+from pathlib import Path
+import shutil
+import tarfile
+import pytest
+from archive import Archive
+from archive.exception import ArchiveIntegrityError
+from archive.index import index_path
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+src = Path("base", "data", "rnd.dat")
+dest_lnk = src.with_name("rnd_lnk.dat")
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(src, 0o600),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o644, size=20000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o644, size=30000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+compressions = [None, "gz", "bz2", "xz"]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    os.link(str(tmpdir / src), str(tmpdir / dest_lnk))
+    return tmpdir
+
+@pytest.fixture(scope="module", params=compressions,
+                ids=lambda c: c if c else "none")
+def test_archive(request, test_dir):
+    compression = request.param
+    require_compression(compression)
+    archive_path = test_dir / archive_name(ext=compression, tags=["seekable"])
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, compression or "", [Path("base")],
+                         framesize=4096)
+    return archive_path
+
+def test_seekable_index(test_archive):
+    """The archive can be read sequentially as usual and has an index.
+    """
+    assert index_path(test_archive).is_file()
+    with tarfile.open(str(test_archive), "r") as tarf:
+        names = set(tarf.getnames())
+    with Archive().open(test_archive) as archive:
+        assert archive.index is not None
+        assert set(archive.index.members.keys()) == names
+        if archive.index.compression:
+            assert len(archive.index.points) > 1
+        archive.verify()
+
+@pytest.mark.parametrize("entry", [
+    Path("base", "data", "rnd2.dat"),
+    dest_lnk,
+    Path("base", "s.dat"),
+    Path("base", "data"),
+])
+def test_seekable_verify_entry(test_archive, entry):
+    """Verify single entries using the index.
+    """
+    with Archive().open(test_archive) as archive:
+        archive.verify(entries=[entry])
+
+def test_seekable_verify_entry_corrupt(test_archive, test_dir, monkeypatch):
+    """Verify single entries using the index, while the manifest does
+    not match.
+    """
+    with Archive().open(test_archive) as archive:
+        fi = archive.manifest.find(Path("base", "data", "rnd2.dat"))
+        monkeypatch.setitem(fi.checksum, "sha256", "0" * 64)
+        with pytest.raises(ArchiveIntegrityError) as err:
+            archive.verify(entries=[fi.path])
+        assert "checksum does not match" in str(err.value)
+
+def test_seekable_extract_entry(test_archive, test_dir):
+    """Extract a subdirectory using the index.
+    """
+    outdir = test_dir / "out"
+    shutil.rmtree(str(outdir), ignore_errors=True)
+    outdir.mkdir()
+    with Archive().open(test_archive) as archive:
+        archive.extract(outdir, paths=[Path("base", "data")])
+    assert sorted(p.name for p in (outdir / "base").iterdir()) == ["data"]
+    for p in (src, dest_lnk, Path("base", "data", "rnd2.dat")):
+        assert filecmp.cmp(str(test_dir / p), str(outdir / p), shallow=False)
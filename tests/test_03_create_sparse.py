@@ -0,0 +1,80 @@
+"""Test creating and extracting archives with sparse files.
+"""
+
+import filecmp
+import os
+from pathlib import Path
+import shutil
+import tarfile
+import pytest
+from archive import Archive
+from archive.sparse import data_segments
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+]
+sparse_files = {
+    # Path: ([(offset, data)], size)
+    Path("base", "sparse.img"): ([(1 << 20, b"a" * 5000),
+                                  (3 << 20, b"b" * 100)], 5 << 20),
+    Path("base", "head.img"): ([(0, b"c" * 10000)], 2 << 20),
+    Path("base", "hole.img"): ([], 1 << 20),
+}
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    for p, (segments, size) in sparse_files.items():
+        with (tmpdir / p).open("wb") as f:
+            for offset, data in segments:
+                f.seek(offset)
+                f.write(data)
+            f.truncate(size)
+    with (tmpdir / "base" / "sparse.img").open("rb") as f:
+        if data_segments(f, 5 << 20) is None:
+            pytest.skip("file system does not report holes")
+    return tmpdir
+
+@pytest.fixture(scope="module", params=[None, "gz"],
+                ids=lambda c: c if c else "none")
+def test_archive(request, test_dir):
+    compression = request.param
+    archive_path = test_dir / archive_name(ext=compression)
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, compression or "", [Path("base")])
+    return archive_path
+
+def test_sparse_members(test_archive):
+    """The sparse files are stored as sparse members.
+    """
+    with tarfile.open(str(test_archive), "r") as tarf:
+        for p, (segments, size) in sparse_files.items():
+            ti = tarf.getmember(str(p))
+            assert ti.isfile()
+            assert ti.size == size
+            assert ti.sparse is not None
+            stored = sum(length for _, length in ti.sparse)
+            assert stored < size
+        assert tarf.getmember("base/msg.txt").sparse is None
+    with Archive().open(test_archive) as archive:
+        archive.verify()
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_sparse_extract(test_dir, test_archive, workers):
+    """Extracting recreates the holes.
+    """
+    outdir = test_dir / "out"
+    shutil.rmtree(str(outdir), ignore_errors=True)
+    outdir.mkdir()
+    with Archive().open(test_archive) as archive:
+        archive.extract(outdir, workers=workers)
+    for p, (segments, size) in sparse_files.items():
+        assert filecmp.cmp(str(test_dir / p), str(outdir / p), shallow=False)
+        st = os.stat(str(outdir / p))
+        assert st.st_size == size
+        assert st.st_blocks * 512 < size
@@ -0,0 +1,73 @@
+"""Test verifying an archive while it is being created.
+"""
+
+import os
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.archive import DedupMode
+from archive.exception import ArchiveIntegrityError
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o644, size=300000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o644, size=50000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    os.link(str(tmpdir / "base" / "data" / "rnd2.dat"),
+            str(tmpdir / "base" / "rnd2_lnk.dat"))
+    setup_testdata(tmpdir, [testdata[0]])
+    return tmpdir
+
+@pytest.mark.parametrize("seekable", [False, True],
+                         ids=["plain", "seekable"])
+@pytest.mark.parametrize("compression", [None, "gz", "bz2", "xz"],
+                         ids=lambda c: c if c else "none")
+def test_create_verify(test_dir, testname, compression, seekable):
+    """Create and verify the archive in one go.
+    """
+    require_compression(compression)
+    tags = [testname, "seekable" if seekable else "plain"]
+    archive_path = test_dir / archive_name(ext=compression, tags=tags)
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, compression or "", [Path("base")],
+                         dedup=DedupMode.LINK, verify=True,
+                         framesize=100000 if seekable else None)
+    with Archive().open(archive_path) as archive:
+        archive.verify()
+
+def test_create_verify_changed(test_dir, testname, monkeypatch):
+    """A file changed after its checksum has been taken is detected.
+    """
+    path = Path("base", "data", "rnd2.dat")
+    add_metadata_files = Archive._add_metadata_files
+    def _add_metadata_files(self, tarf):
+        # This is called after the manifest has been written.
+        st = (test_dir / path).stat()
+        with (test_dir / path).open("r+b") as f:
+            c = f.read(1)
+            f.seek(0)
+            f.write(bytes([c[0] ^ 0xff]))
+        os.utime(str(test_dir / path), ns=(st.st_atime_ns, st.st_mtime_ns))
+        return add_metadata_files(self, tarf)
+    monkeypatch.setattr(Archive, "_add_metadata_files", _add_metadata_files)
+    archive_path = test_dir / archive_name(ext="gz", tags=[testname])
+    try:
+        with tmp_chdir(test_dir):
+            with pytest.raises(ArchiveIntegrityError) as err:
+                Archive().create(archive_path, "gz", [Path("base")],
+                                 verify=True)
+        assert "%s: checksum does not match" % path in str(err.value)
+    finally:
+        monkeypatch.undo()
+        setup_testdata(test_dir, [f for f in testdata if f.path == path])
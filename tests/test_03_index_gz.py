@@ -0,0 +1,133 @@
+"""Test building an index with decompression checkpoints for existing
+gzip compressed archives.
+"""
+
+import filecmp
+import os
+from pathlib import Path
+import shutil
+import tarfile
+import pytest
+from archive import Archive
+from archive.exception import ArchiveReadError
+from archive.index import ArchiveIndex, index_path
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+src = Path("base", "data", "rnd.dat")
+dest_lnk = src.with_name("rnd_lnk.dat")
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(src, 0o600),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o644, size=200000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o644, size=300000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    os.link(str(tmpdir / src), str(tmpdir / dest_lnk))
+    return tmpdir
+
+@pytest.fixture(scope="module")
+def test_archive(test_dir):
+    archive_path = test_dir / archive_name(ext="gz")
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, "gz", [Path("base")])
+    idx = ArchiveIndex.build_gz(archive_path, 32*1024)
+    idx.write(archive_path)
+    return archive_path
+
+def test_index_gz_points(test_archive):
+    """The index has checkpoints with a window and all members.
+    """
+    with tarfile.open(str(test_archive), "r") as tarf:
+        names = set(tarf.getnames())
+    with Archive().open(test_archive) as archive:
+        assert archive.index is not None
+        assert set(archive.index.members.keys()) == names
+        windows = [p for p in archive.index.points if len(p) > 2]
+        assert len(windows) > 4
+        assert all(len(archive.index._window(p)) == 32768 for p in windows)
+
+def test_index_gz_lazy(test_archive, monkeypatch):
+    """The index is only read when random access is needed.
+    """
+    reads = []
+    read = ArchiveIndex.read
+    def counting_read(path):
+        reads.append(path)
+        return read(path)
+    monkeypatch.setattr(ArchiveIndex, "read", counting_read)
+    with Archive().open(test_archive) as archive:
+        archive.verify()
+        assert reads == []
+        archive.verify(entries=[Path("base", "data", "rnd1.dat")])
+        archive.verify(entries=[Path("base", "data", "rnd2.dat")])
+        assert reads == [test_archive]
+
+def test_index_gz_open_member_close(test_archive):
+    """Opening many members releases the decompressor each time.
+    """
+    name = str(Path("base", "data", "rnd2.dat"))
+    with Archive().open(test_archive) as archive:
+        for _ in range(500):
+            with archive.index.open_member(test_archive, name) as tarf:
+                stream = tarf._stream
+                assert tarf.next().name == name
+            assert stream._inflater.strm is None
+
+@pytest.mark.parametrize("entry", [
+    Path("base", "data", "rnd1.dat"),
+    Path("base", "data", "rnd2.dat"),
+    dest_lnk,
+    Path("base", "s.dat"),
+])
+def test_index_gz_verify_entry(test_archive, entry):
+    """Verify single entries using the checkpoints.
+    """
+    with Archive().open(test_archive) as archive:
+        archive.verify(entries=[entry])
+
+def test_index_gz_extract_entry(test_archive, test_dir):
+    """Extract a subdirectory using the checkpoints.
+    """
+    outdir = test_dir / "out"
+    shutil.rmtree(str(outdir), ignore_errors=True)
+    outdir.mkdir()
+    with Archive().open(test_archive) as archive:
+        archive.extract(outdir, paths=[Path("base", "data")])
+    for p in (src, dest_lnk, Path("base", "data", "rnd1.dat"),
+              Path("base", "data", "rnd2.dat")):
+        assert filecmp.cmp(str(test_dir / p), str(outdir / p), shallow=False)
+
+def test_index_gz_cli(test_dir, monkeypatch):
+    """Build the index using the command line.
+    """
+    monkeypatch.chdir(str(test_dir))
+    archive_path = archive_name(ext="gz", tags=["cli"])
+    Archive().create(Path(archive_path), "gz", [Path("base")])
+    callscript("archive-tool.py", ["index-gz", "--span", "65536",
+                                   archive_path])
+    assert index_path(archive_path).is_file()
+    with Archive().open(Path(archive_path)) as archive:
+        assert len(archive.index.points) > 1
+        archive.verify(entries=[Path("base", "data", "rnd2.dat")])
+
+def test_index_gz_not_gzip(test_dir):
+    """Building the index fails for an archive that is not gzip
+    compressed.
+    """
+    archive_path = test_dir / archive_name(tags=["plain"])
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, "", [Path("base")])
+    with pytest.raises(ArchiveReadError) as err:
+        ArchiveIndex.build_gz(archive_path, 32*1024)
+    assert "not a gzip file" in str(err.value)
@@ -0,0 +1,92 @@
+"""Test the page cache hints given with the --io-nocache option.
+"""
+
+import os
+from pathlib import Path
+import pytest
+from archive import Archive
+import archive.nocache
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o644, size=50000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o644, size=70000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "posix_fadvise"),
+                                reason="posix_fadvise is not available")
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+@pytest.fixture(scope="function")
+def advice(monkeypatch):
+    """Enable the hints and record the calls to posix_fadvise.
+    """
+    calls = []
+    def fadvise(fd, offset, length, advice):
+        calls.append((os.readlink("/proc/self/fd/%d" % fd), offset, length,
+                      advice))
+        os.posix_fadvise(fd, offset, length, advice)
+    monkeypatch.setattr(archive.nocache, "enabled", True)
+    monkeypatch.setattr(archive.nocache, "_fadvise", fadvise)
+    monkeypatch.setattr(archive.nocache.Dropper, "Step", 16*1024)
+    return calls
+
+def dropped(calls, path):
+    return [c for c in calls if c[0] == str(path) and
+            c[3] == os.POSIX_FADV_DONTNEED]
+
+@pytest.mark.parametrize("compression", [None, "gz"],
+                         ids=lambda c: c if c else "none")
+def test_nocache_create_verify(test_dir, advice, compression):
+    """Create and verify an archive while dropping the pages.
+    """
+    if not Path("/proc/self/fd").is_dir():
+        pytest.skip("/proc/self/fd is not available")
+    archive_path = test_dir / archive_name(ext=compression)
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, compression or "", [Path("base")])
+    for f in testdata:
+        if f.type == 'f':
+            calls = dropped(advice, test_dir / f.path)
+            # Dropped after calculating the checksum and after adding
+            # the file to the archive.
+            assert len(calls) == 2
+    assert dropped(advice, archive_path)
+    del advice[:]
+    with Archive().open(archive_path) as arch:
+        arch.verify()
+        members = { ti.name: ti for ti in arch._file.getmembers() }
+    calls = dropped(advice, archive_path)
+    # The members are read out of order, so all pages are dropped.
+    assert calls[-1][1:3] == (0, 0)
+    if not compression:
+        # The content is hashed from a mapping of the archive, the
+        # pages are dropped after each member.
+        for f in testdata:
+            if f.type == 'f':
+                ti = members[str(f.path)]
+                assert any(c[1] <= ti.offset_data and
+                           c[1] + c[2] == ti.offset_data + ti.size
+                           for c in calls)
+
+def test_nocache_cli(test_dir, monkeypatch):
+    """The --io-nocache option for create, verify and check.
+    """
+    monkeypatch.chdir(str(test_dir))
+    archive_path = archive_name(tags=["cli"])
+    callscript("archive-tool.py", ["create", "--io-nocache",
+                                   archive_path, "base"])
+    callscript("archive-tool.py", ["verify", "--io-nocache", archive_path])
+    callscript("archive-tool.py", ["check", "--io-nocache", archive_path,
+                                   "base"])
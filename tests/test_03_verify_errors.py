@@ -134,8 +134,9 @@ def test_verify_wrong_type(test_data, testname):
             archive.verify()
         assert "%s: wrong type" % path in str(err.value)
 
-def test_verify_wrong_checksum(test_data, testname):
-    name = archive_name(tags=[testname])
+@pytest.mark.parametrize("workers", [None, 2])
+def test_verify_wrong_checksum(test_data, testname, workers):
+    name = archive_name(tags=[testname, str(workers)])
     path = Path("base", "data", "rnd.dat")
     stat = os.stat(str(path))
     mode = stat.st_mode
@@ -148,11 +149,33 @@ def test_verify_wrong_checksum(test_data, testname):
     create_archive(name)
     with Archive().open(Path(name)) as archive:
         with pytest.raises(ArchiveIntegrityError) as err:
-            archive.verify()
+            archive.verify(workers=workers)
         assert "%s: checksum" % path in str(err.value)
 
-def test_verify_ok(test_data, testname):
+def test_verify_first_error_parallel(test_data, testname):
+    """When hashing in worker threads, the error of the first item
+    failing is reported, even if a later item fails earlier.
+    """
     name = archive_name(tags=[testname])
+    path = Path("base", "data", "rnd.dat")
+    stat = os.stat(str(path))
+    with path.open("wb") as f:
+        f.write(b'0' * stat.st_size)
+    path.chmod(stat.st_mode)
+    os.utime(str(path), times=(stat.st_mtime, stat.st_mtime))
+    Path("base", "msg.txt").chmod(0o600)
+    create_archive(name)
+    with Archive().open(Path(name)) as archive:
+        with pytest.raises(ArchiveIntegrityError) as err:
+            archive.verify(workers=2)
+        assert "%s: checksum" % path in str(err.value)
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_verify_ok(test_data, testname, workers):
+    name = archive_name(tags=[testname, str(workers)])
     create_archive(name)
+    seen = []
     with Archive().open(Path(name)) as archive:
-        archive.verify()
+        archive.verify(progress=lambda fi: seen.append(fi.path),
+                       workers=workers)
+        assert seen == [fi.path for fi in archive.manifest]
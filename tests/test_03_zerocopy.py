@@ -0,0 +1,93 @@
+"""Test the zero copy data paths for uncompressed archives.
+"""
+
+import filecmp
+import os
+from pathlib import Path
+import shutil
+import tarfile
+import pytest
+from archive import Archive
+from archive.exception import ArchiveIntegrityError
+from archive.tools import tmp_chdir
+import archive.zerocopy
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+src = Path("base", "data", "rnd.dat")
+dest_lnk = src.with_name("rnd_lnk.dat")
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(src, 0o600),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o644, size=100000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o644, size=511),
+    DataRandomFile(Path("base", "data", "zero.dat"), 0o644, size=0),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    os.link(str(tmpdir / src), str(tmpdir / dest_lnk))
+    return tmpdir
+
+@pytest.fixture(params=["copy_file_range", "sendfile", "pread"])
+def copy_method(request, monkeypatch):
+    """Restrict the available methods to copy between file descriptors.
+    """
+    method = request.param
+    if not hasattr(os, method):
+        pytest.skip("os.%s is not available" % method)
+    if method != "copy_file_range":
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+    if method == "pread":
+        monkeypatch.delattr(os, "sendfile", raising=False)
+    return method
+
+def test_zerocopy_create(test_dir, copy_method):
+    """Create an uncompressed archive, extract and verify it.
+    """
+    archive_path = test_dir / archive_name(tags=[copy_method])
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, "", [Path("base")])
+    with tarfile.open(str(archive_path), "r") as tarf:
+        for ti in tarf:
+            if ti.isfile() and not ti.name.endswith(".manifest.yaml"):
+                with tarf.extractfile(ti) as f:
+                    assert f.read() == (test_dir / ti.name).read_bytes()
+    outdir = test_dir / "out"
+    shutil.rmtree(str(outdir), ignore_errors=True)
+    outdir.mkdir()
+    with Archive().open(archive_path) as archive:
+        archive.verify()
+        archive.extract(outdir, workers=4)
+    for f in testdata:
+        if f.type == 'f':
+            assert filecmp.cmp(str(test_dir / f.path), str(outdir / f.path),
+                               shallow=False)
+
+def test_zerocopy_verify_mapped(test_dir, monkeypatch):
+    """Verify an uncompressed archive hashing the mapped content.
+    """
+    archive_path = test_dir / archive_name(tags=["mapped"])
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, "", [Path("base")])
+    calls = []
+    orig_checksum = archive.zerocopy.MappedArchive.checksum
+    def checksum(self, tarinfo, hashalg):
+        calls.append(tarinfo.name)
+        return orig_checksum(self, tarinfo, hashalg)
+    monkeypatch.setattr(archive.zerocopy.MappedArchive, "checksum", checksum)
+    with Archive().open(archive_path) as arch:
+        arch.verify()
+        assert "base/data/rnd1.dat" in calls
+        fi = arch.manifest.find(Path("base", "data", "rnd1.dat"))
+        monkeypatch.setitem(fi.checksum, "sha256", "0" * 64)
+        with pytest.raises(ArchiveIntegrityError) as err:
+            arch.verify()
+        assert "rnd1.dat: checksum does not match" in str(err.value)
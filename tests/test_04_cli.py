@@ -1,6 +1,7 @@
 """Test the command line tool to create an archive and check its content.
 """
 
+import json
 from pathlib import Path
 import stat
 import subprocess
@@ -101,6 +102,61 @@ def test_cli_ls(test_dir, dep_testcase):
                 assert len(fields) == 6
         assert not f.readline()
 
+@pytest.mark.dependency()
+def test_cli_ls_path(test_dir, dep_testcase):
+    compression, abspath = dep_testcase
+    flag = absflag(abspath)
+    archive_path = test_dir / archive_name(ext=compression, tags=[flag])
+    prefix_dir = test_dir if abspath else Path(".")
+    subdir = prefix_dir / "base" / "data"
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["ls", str(archive_path), str(subdir)]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        paths = [l.split()[5] for l in get_output(f)]
+    expected = sorted(prefix_dir / e.path for e in testdata
+                      if e.path == Path("base", "data") or
+                      Path("base", "data") in e.path.parents)
+    assert paths == [str(p) for p in expected]
+
+@pytest.mark.dependency()
+def test_cli_ls_null(test_dir, dep_testcase):
+    compression, abspath = dep_testcase
+    flag = absflag(abspath)
+    archive_path = test_dir / archive_name(ext=compression, tags=[flag])
+    prefix_dir = test_dir if abspath else Path(".")
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["ls", "--null", "--format=checksum", str(archive_path)]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        out = f.read()
+    assert "\n" not in out
+    lines = out.split("\0")
+    assert lines.pop() == ""
+    paths = [l.split("  ", 1)[1] for l in lines]
+    assert paths == [str(prefix_dir / e.path)
+                     for e in sorted(testdata, key=lambda e: e.path)
+                     if e.type == "f"]
+
+@pytest.mark.dependency()
+def test_cli_ls_jsonl(test_dir, dep_testcase):
+    compression, abspath = dep_testcase
+    flag = absflag(abspath)
+    archive_path = test_dir / archive_name(ext=compression, tags=[flag])
+    prefix_dir = test_dir if abspath else Path(".")
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["ls", "--format=jsonl", str(archive_path)]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        for entry in sorted(testdata, key=lambda e: e.path):
+            record = json.loads(f.readline())
+            assert record["type"] == entry.type
+            assert record["path"] == str(prefix_dir / entry.path)
+            assert record["mode"] == entry.mode
+            if entry.type == "l":
+                assert record["target"] == str(entry.target)
+        assert not f.readline()
+
 @pytest.mark.dependency()
 def test_cli_checksums(test_dir, dep_testcase):
     compression, abspath = dep_testcase
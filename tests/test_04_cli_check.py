@@ -1,6 +1,7 @@
 """Test the check subcommand in the command line tool.
 """
 
+import json
 import os
 from pathlib import Path
 import shutil
@@ -172,6 +173,30 @@ def test_check_present_symlink_target(test_dir, copy_data, monkeypatch):
         f.seek(0)
         assert set(get_output(f)) == all_test_files - {str(fp)}
 
+def test_check_jsonl(test_dir, copy_data, monkeypatch):
+    monkeypatch.chdir(str(copy_data))
+    fp = Path("base", "new_msg.txt")
+    with fp.open("wt") as f:
+        print("Greeting!", file=f)
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["check", "--format", "jsonl",
+                str(test_dir / "archive.tar"), "base"]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        records = [json.loads(l) for l in get_output(f)]
+    assert records == [{ "path": str(fp), "type": "f", "present": False }]
+
+def test_check_present_null(test_dir, copy_data, monkeypatch):
+    monkeypatch.chdir(str(copy_data))
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["check", "--present", "--null",
+                str(test_dir / "archive.tar"), "base"]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        out = f.read()
+    assert out.endswith("\0") and "\n" not in out
+    assert set(out[:-1].split("\0")) == all_test_files
+
 def test_check_extract_archive(test_dir, extract_archive, monkeypatch):
     """When extracting an archive and checking the result, 
     check should not report any file to be missing in the archive.
@@ -1,6 +1,8 @@
 """Test the diff subcommand in the command line tool.
 """
 
+import json
+import os
 from pathlib import Path
 import shutil
 from tempfile import TemporaryFile
@@ -26,8 +28,10 @@ testdata = [
 def test_dir(tmpdir):
     setup_testdata(tmpdir, testdata)
     with tmp_chdir(tmpdir):
-        Archive().create(Path("archive-rel.tar"), "", [Path("base")])
-        Archive().create(Path("archive-abs.tar"), "", [tmpdir / "base"])
+        Archive().create(Path("archive-rel.tar"), "", [Path("base")],
+                         dir_hashes=True)
+        Archive().create(Path("archive-abs.tar"), "", [tmpdir / "base"],
+                         dir_hashes=True)
     return tmpdir
 
 @pytest.fixture(scope="function")
@@ -82,6 +86,26 @@ def test_diff_modified_file(test_data, testname, monkeypatch, abspath):
         assert out[0] == ("Files %s:%s and %s:%s differ"
                           % (archive_ref_path, p, archive_path, p))
 
+def test_diff_jobs(test_data, testname, monkeypatch):
+    """Diff two archives, loading the manifests in parallel.
+    """
+    monkeypatch.chdir(str(test_data))
+    archive_ref_path = Path("archive-rel.tar")
+    base_dir = Path("base")
+    p = base_dir / "rnd.dat"
+    shutil.copy(str(gettestdata("rnd2.dat")), str(p))
+    archive_path = Path(archive_name(ext="bz2", tags=[testname]))
+    Archive().create(archive_path, "bz2", [base_dir])
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", "--jobs", "2",
+                str(archive_ref_path), str(archive_path)]
+        callscript("archive-tool.py", args, returncode=101, stdout=f)
+        f.seek(0)
+        out = list(get_output(f))
+        assert len(out) == 1
+        assert out[0] == ("Files %s:%s and %s:%s differ"
+                          % (archive_ref_path, p, archive_path, p))
+
 @pytest.mark.parametrize("abspath", [False, True])
 def test_diff_symlink_target(test_data, testname, monkeypatch, abspath):
     """Diff two archives having one symlink's target modified.
@@ -160,6 +184,57 @@ def test_diff_missing_files(test_data, testname, monkeypatch, abspath):
         assert out[0] == "Only in %s: %s" % (archive_path, p2)
         assert out[1] == "Only in %s: %s" % (archive_ref_path, p1)
 
+def test_diff_jsonl(test_data, testname, monkeypatch):
+    """Diff two archives with JSON lines output.
+    """
+    monkeypatch.chdir(str(test_data))
+    archive_ref_path = Path("archive-rel.tar")
+    base_dir = Path("base")
+    p1 = base_dir / "rnd.dat"
+    p2 = base_dir / "a.dat"
+    p3 = base_dir / "msg.txt"
+    p1.rename(p2)
+    shutil.copy(str(gettestdata("rnd2.dat")), str(p3))
+    archive_path = Path(archive_name(ext="bz2", tags=[testname]))
+    Archive().create(archive_path, "bz2", [base_dir])
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", "--format", "jsonl",
+                str(archive_ref_path), str(archive_path)]
+        callscript("archive-tool.py", args, returncode=102, stdout=f)
+        f.seek(0)
+        out = [json.loads(l) for l in get_output(f)]
+    assert out == [
+        { "change": "only",
+          "archive2": str(archive_path), "path2": str(p2) },
+        { "change": "content",
+          "archive1": str(archive_ref_path), "path1": str(p3),
+          "archive2": str(archive_path), "path2": str(p3) },
+        { "change": "only",
+          "archive1": str(archive_ref_path), "path1": str(p1) },
+    ]
+
+def test_diff_null(test_data, testname, monkeypatch):
+    """Diff two archives with output lines terminated by null
+    characters.
+    """
+    monkeypatch.chdir(str(test_data))
+    archive_ref_path = Path("archive-rel.tar")
+    base_dir = Path("base")
+    p1 = base_dir / "rnd.dat"
+    p2 = base_dir / "msg.txt"
+    p1.unlink()
+    shutil.copy(str(gettestdata("rnd2.dat")), str(p2))
+    archive_path = Path(archive_name(ext="bz2", tags=[testname]))
+    Archive().create(archive_path, "bz2", [base_dir])
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", "--null", str(archive_ref_path), str(archive_path)]
+        callscript("archive-tool.py", args, returncode=102, stdout=f)
+        f.seek(0)
+        out = f.read()
+    assert out == ("Files %s:%s and %s:%s differ\0Only in %s: %s\0"
+                   % (archive_ref_path, p2, archive_path, p2,
+                      archive_ref_path, p1))
+
 @pytest.mark.parametrize("abspath", [False, True])
 def test_diff_mult(test_data, testname, monkeypatch, abspath):
     """Diff two archives having multiple differences.
@@ -299,3 +374,149 @@ def test_diff_dircontent(test_data, testname, monkeypatch, abspath):
         out = list(get_output(f))
         assert len(out) == 1
         assert out[0] == "Only in %s: %s" % (archive_ref_path, pd)
+
+@pytest.mark.parametrize("abspath", [False, True])
+def test_diff_directory_equal(test_data, testname, monkeypatch, abspath):
+    """Diff an archive against a directory having equal content.
+    """
+    monkeypatch.chdir(str(test_data))
+    if abspath:
+        archive_ref_path = Path("archive-abs.tar")
+    else:
+        archive_ref_path = Path("archive-rel.tar")
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", str(archive_ref_path), "base"]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        assert list(get_output(f)) == []
+
+def test_diff_directory_modified(test_data, testname, monkeypatch):
+    """Diff an archive against a directory having modifications.
+    A file modified keeping size and modification time is only
+    detected with --content.
+    """
+    monkeypatch.chdir(str(test_data))
+    archive_ref_path = Path("archive-rel.tar")
+    base_dir = Path("base")
+    pm = base_dir / "data" / "rnd.dat"
+    shutil.copy(str(gettestdata("rnd2.dat")), str(pm))
+    ps = base_dir / "rnd.dat"
+    st = ps.stat()
+    with ps.open("r+b") as f:
+        c = f.read(1)
+        f.seek(0)
+        f.write(bytes([c[0] ^ 0xff]))
+    os.utime(str(ps), ns=(st.st_atime_ns, st.st_mtime_ns))
+    p1 = base_dir / "msg.txt"
+    p2 = base_dir / "o.txt"
+    p1.rename(p2)
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", str(archive_ref_path), str(base_dir)]
+        callscript("archive-tool.py", args, returncode=102, stdout=f)
+        f.seek(0)
+        out = list(get_output(f))
+        assert out == [
+            "Files %s:%s and %s:%s differ"
+            % (archive_ref_path, pm, base_dir, pm),
+            "Only in %s: %s" % (archive_ref_path, p1),
+            "Only in %s: %s" % (base_dir, p2),
+        ]
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", "--content", "--jobs", "2",
+                str(archive_ref_path), str(base_dir)]
+        callscript("archive-tool.py", args, returncode=102, stdout=f)
+        f.seek(0)
+        out = list(get_output(f))
+        assert out == [
+            "Files %s:%s and %s:%s differ"
+            % (archive_ref_path, pm, base_dir, pm),
+            "Only in %s: %s" % (archive_ref_path, p1),
+            "Only in %s: %s" % (base_dir, p2),
+            "Files %s:%s and %s:%s differ"
+            % (archive_ref_path, ps, base_dir, ps),
+        ]
+
+@pytest.mark.parametrize("abspath", [False, True])
+def test_diff_detect_renames(test_data, testname, monkeypatch, abspath):
+    """Diff two archives having a directory and a file renamed.
+    """
+    monkeypatch.chdir(str(test_data))
+    if abspath:
+        archive_ref_path = Path("archive-abs.tar")
+        base_dir = test_data / "base"
+    else:
+        archive_ref_path = Path("archive-rel.tar")
+        base_dir = Path("base")
+    d1 = base_dir / "data"
+    d2 = base_dir / "d2"
+    d1.rename(d2)
+    p1 = base_dir / "msg.txt"
+    p2 = base_dir / "o.txt"
+    p1.rename(p2)
+    flag = absflag(abspath)
+    archive_path = Path(archive_name(ext="bz2", tags=[testname, flag]))
+    Archive().create(archive_path, "bz2", [base_dir], dir_hashes=True)
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", "--detect-renames",
+                str(archive_ref_path), str(archive_path)]
+        callscript("archive-tool.py", args, returncode=102, stdout=f)
+        f.seek(0)
+        out = list(get_output(f))
+        assert out == [
+            "Renamed %s:%s to %s:%s" % (archive_ref_path, d1, archive_path, d2),
+            "Renamed %s:%s to %s:%s" % (archive_ref_path, p1, archive_path, p2),
+        ]
+
+def test_diff_detect_renames_same_content(test_data, testname, monkeypatch):
+    """Diff two archives having several files with the same content
+    renamed.  The renamed files are joined with the closest candidate,
+    empty files are not joined at all.
+    """
+    monkeypatch.chdir(str(test_data))
+    base_dir = Path("base")
+    e1 = base_dir / "data" / "e1.txt"
+    e1.touch()
+    ref_path = Path(archive_name(ext="bz2", tags=[testname, "ref"]))
+    Archive().create(ref_path, "bz2", [base_dir], dir_hashes=True)
+    # base/rnd.dat and base/data/rnd.dat have the same content.
+    p1, p2 = base_dir / "rnd.dat", base_dir / "a.dat"
+    q1, q2 = base_dir / "data" / "rnd.dat", base_dir / "data" / "y.dat"
+    p1.rename(p2)
+    q1.rename(q2)
+    e2 = base_dir / "empty" / "e1.txt"
+    e1.rename(e2)
+    (base_dir / "n.txt").touch()
+    archive_path = Path(archive_name(ext="bz2", tags=[testname]))
+    Archive().create(archive_path, "bz2", [base_dir], dir_hashes=True)
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", "--detect-renames",
+                str(ref_path), str(archive_path)]
+        callscript("archive-tool.py", args, returncode=102, stdout=f)
+        f.seek(0)
+        out = list(get_output(f))
+    assert sorted(out) == sorted([
+        "Renamed %s:%s to %s:%s" % (ref_path, p1, archive_path, p2),
+        "Renamed %s:%s to %s:%s" % (ref_path, q1, archive_path, q2),
+        "Only in %s: %s" % (ref_path, e1),
+        "Only in %s: %s" % (archive_path, e2),
+        "Only in %s: %s" % (archive_path, base_dir / "n.txt"),
+    ])
+
+def test_diff_directory_detect_renames(test_data, testname, monkeypatch):
+    """Diff an archive against a directory having a file renamed.
+    """
+    monkeypatch.chdir(str(test_data))
+    archive_ref_path = Path("archive-rel.tar")
+    base_dir = Path("base")
+    p1 = base_dir / "msg.txt"
+    p2 = base_dir / "o.txt"
+    p1.rename(p2)
+    with TemporaryFile(mode="w+t", dir=str(test_data)) as f:
+        args = ["diff", "--detect-renames",
+                str(archive_ref_path), str(base_dir)]
+        callscript("archive-tool.py", args, returncode=102, stdout=f)
+        f.seek(0)
+        out = list(get_output(f))
+        assert out == [
+            "Renamed %s:%s to %s:%s" % (archive_ref_path, p1, base_dir, p2),
+        ]
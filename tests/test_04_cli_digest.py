@@ -0,0 +1,84 @@
+"""Test digests of the archive file written into sidecar files.
+"""
+
+import hashlib
+from pathlib import Path
+import shutil
+from tempfile import TemporaryFile
+import pytest
+from archive.digest import digest_path
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd.dat"), 0o644, size=100000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+def file_digest(path, hashalg):
+    with path.open("rb") as f:
+        return hashlib.new(hashalg, f.read()).hexdigest()
+
+@pytest.mark.parametrize("args", [[], ["--seekable"], ["--verify"]],
+                         ids=["plain", "seekable", "verify"])
+@pytest.mark.parametrize("compression", [None, "gz"],
+                         ids=lambda c: c if c else "none")
+def test_create_digest(test_dir, testname, compression, args):
+    """Create an archive with digests and check them.
+    """
+    tags = [testname] + [a.strip("-") for a in args]
+    archive_path = test_dir / archive_name(ext=compression, tags=tags)
+    with tmp_chdir(test_dir):
+        callscript("archive-tool.py",
+                   ["create", "--compression", compression or "none",
+                    "--digest", "sha256", "--digest", "md5"] + args +
+                   [str(archive_path), "base"])
+    for h in ("sha256", "md5"):
+        with digest_path(archive_path, h).open("rt") as f:
+            line = f.read()
+        assert line == "%s  %s\n" % (file_digest(archive_path, h),
+                                     archive_path.name)
+    callscript("archive-tool.py",
+               ["verify", "--outer-only", str(archive_path)])
+
+def test_verify_outer_only_corrupt(test_dir, testname):
+    """A corrupted archive file is detected by --outer-only.
+    """
+    archive_path = test_dir / archive_name(ext="gz", tags=[testname])
+    with tmp_chdir(test_dir):
+        callscript("archive-tool.py",
+                   ["create", "--digest", "sha256", str(archive_path), "base"])
+    with archive_path.open("r+b") as f:
+        f.seek(-100, 2)
+        c = f.read(1)
+        f.seek(-100, 2)
+        f.write(bytes([c[0] ^ 0xff]))
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py",
+                   ["verify", "--outer-only", str(archive_path)],
+                   returncode=3, stderr=f)
+        f.seek(0)
+        assert "sha256 digest does not match" in f.readline()
+
+def test_verify_outer_only_missing(test_dir, testname):
+    """--outer-only fails if there is no digest file.
+    """
+    archive_path = test_dir / archive_name(ext="gz", tags=[testname])
+    with tmp_chdir(test_dir):
+        callscript("archive-tool.py", ["create", str(archive_path), "base"])
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py",
+                   ["verify", "--outer-only", str(archive_path)],
+                   returncode=1, stderr=f)
+        f.seek(0)
+        assert "no digest file found" in f.readline()
@@ -0,0 +1,110 @@
+"""Test the du subcommand in the command line tool.
+"""
+
+import json
+from pathlib import Path
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from archive.tools import tmp_chdir
+from archive.usage import usage_path
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# base/rnd.dat and base/data/rnd.dat have the same content.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "data", "sub"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(Path("base", "data", "rnd.dat"), 0o600),
+    DataRandomFile(Path("base", "data", "sub", "rnd1.dat"), 0o600,
+                   size=1000),
+    DataFile(Path("base", "rnd.dat"), 0o600),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    with tmp_chdir(tmpdir):
+        Archive().create(Path("archive.tar"), "", [Path("base")])
+    return tmpdir
+
+def expected_usage(test_dir, path):
+    """Calculate the expected aggregates for a directory.
+    """
+    files = [ d for d in testdata
+              if d.type == 'f' and path in d.path.parents ]
+    size = sum((test_dir / d.path).stat().st_size for d in files)
+    # Duplicates of a file earlier in the sorted archive.
+    dup = Path("base", "rnd.dat")
+    dedup = (test_dir / dup).stat().st_size if path in dup.parents else 0
+    return (size, len(files), dedup)
+
+def run_du(test_dir, args):
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["du"] + args, stdout=f)
+        f.seek(0)
+        out = []
+        for l in get_output(f):
+            size, files, dedup, path = l.split("\t")
+            out.append((path, int(size), int(files), int(dedup)))
+        return out
+
+@pytest.mark.parametrize(("options", "path", "dirs"), [
+    ([], None, ["base", "base/data", "base/data/sub", "base/empty"]),
+    (["--depth", "1"], None, ["base", "base/data", "base/empty"]),
+    ([], "base/data", ["base/data", "base/data/sub"]),
+    (["--depth", "0"], "base/data", ["base/data"]),
+])
+def test_du(test_dir, options, path, dirs):
+    """Show the size of the directories in the archive.
+    """
+    args = options + [str(test_dir / "archive.tar")]
+    if path:
+        args.append(path)
+    expected = [ (d,) + expected_usage(test_dir, Path(d)) for d in dirs ]
+    assert run_du(test_dir, args) == expected
+
+def test_du_jsonl(test_dir):
+    """Show the size of the directories in JSON lines format.
+    """
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["du", "--format", "jsonl", str(test_dir / "archive.tar"),
+                "base/data/sub"]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        records = [ json.loads(l) for l in get_output(f) ]
+    assert records == [{ "path": "base/data/sub", "size": 1000,
+                         "files": 1, "dedup": 0 }]
+
+def test_du_store(test_dir, testname):
+    """Store the aggregates in a sidecar file and use it later on.
+    """
+    archive_path = test_dir / archive_name(tags=[testname])
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, "", [Path("base")])
+    sidecar = usage_path(archive_path)
+    assert not sidecar.exists()
+    out = run_du(test_dir, [str(archive_path)])
+    assert not sidecar.exists()
+    assert run_du(test_dir, ["--store", str(archive_path)]) == out
+    assert sidecar.exists()
+    # Remove the archive content so that a result can only have been
+    # taken from the sidecar file, keeping the size of the archive.
+    size = archive_path.stat().st_size
+    with archive_path.open("wb") as f:
+        f.truncate(size)
+    assert run_du(test_dir, [str(archive_path)]) == out
+
+def test_du_not_found(test_dir):
+    """du fails if the path is not a directory in the archive.
+    """
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["du", str(test_dir / "archive.tar"), "base/msg.txt"]
+        callscript("archive-tool.py", args, returncode=1, stderr=f)
+        f.seek(0)
+        assert "no such directory in archive" in f.readline()
@@ -149,6 +149,18 @@ def test_cli_info_missing_entry(test_dir, testname, monkeypatch):
         line = f.readline()
         assert "base/data/not-present: not found in archive" in line
 
+def test_cli_ls_missing_path(test_dir, testname, monkeypatch):
+    monkeypatch.chdir(str(test_dir))
+    name = archive_name(tags=[testname])
+    args = ["create", name, "base"]
+    callscript("archive-tool.py", args)
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["ls", name, "base/data/not-present"]
+        callscript("archive-tool.py", args, returncode=1, stderr=f)
+        f.seek(0)
+        line = f.readline()
+        assert "base/data/not-present: not found in archive" in line
+
 def test_cli_integrity_no_manifest(test_dir, testname, monkeypatch):
     monkeypatch.chdir(str(test_dir))
     name = archive_name(tags=[testname])
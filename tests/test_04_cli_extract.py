@@ -0,0 +1,126 @@
+"""Test the extract subcommand of the command line tool.
+"""
+
+import filecmp
+import os
+from pathlib import Path
+import shutil
+import stat
+import pytest
+from archive import Archive
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+src = Path("base", "data", "rnd.dat")
+dest_lnk = src.with_name("rnd_lnk.dat")
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1565100853),
+    DataDir(Path("base", "data"), 0o750, mtime=1555271302),
+    DataDir(Path("base", "empty"), 0o755, mtime=1547911753),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataFile(src, 0o600, mtime=1563112510),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o644,
+                   mtime=1563112510, size=3*1024*1024),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat"),
+                mtime=1565100853),
+]
+
+def check_extracted(test_dir, outdir, items):
+    for item in items:
+        path = outdir / item.path
+        st = os.lstat(str(path))
+        assert st.st_mode == item.st_mode
+        if item.type == 'l':
+            assert os.readlink(str(path)) == str(item.target)
+        else:
+            assert int(st.st_mtime) == item.mtime
+        if item.type == 'f':
+            assert filecmp.cmp(str(test_dir / item.path), str(path),
+                               shallow=False)
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    os.link(str(tmpdir / src), str(tmpdir / dest_lnk))
+    # Adding the link changed the modification time of the directory.
+    setup_testdata(tmpdir, [i for i in testdata if i.path == src.parent])
+    return tmpdir
+
+@pytest.fixture(scope="module", params=[None, "gz"],
+                ids=lambda c: c if c else "none")
+def test_archive(request, test_dir):
+    compression = request.param
+    archive_path = test_dir / archive_name(ext=compression)
+    with tmp_chdir(test_dir):
+        Archive().create(archive_path, compression or "", [Path("base")])
+    return archive_path
+
+@pytest.fixture(scope="function")
+def outdir(test_dir):
+    path = test_dir / "out"
+    shutil.rmtree(str(path), ignore_errors=True)
+    path.mkdir()
+    yield path
+    shutil.rmtree(str(path), ignore_errors=True)
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_cli_extract(test_dir, test_archive, outdir, jobs):
+    """Extract the full archive.
+    """
+    args = ["extract", "--jobs", str(jobs), "-C", str(outdir),
+            str(test_archive)]
+    callscript("archive-tool.py", args)
+    check_extracted(test_dir, outdir, testdata)
+    assert os.stat(str(outdir / src)).st_ino == \
+        os.stat(str(outdir / dest_lnk)).st_ino
+
+@pytest.mark.parametrize(("patterns", "expected"), [
+    (["base/data"], [Path("base", "data"), src, dest_lnk,
+                     Path("base", "data", "rnd1.dat")]),
+    (["base/*.txt", "base/s.dat"], [Path("base", "msg.txt"),
+                                    Path("base", "s.dat")]),
+    (["*/rnd_lnk.dat"], [dest_lnk]),
+])
+def test_cli_extract_patterns(test_dir, test_archive, outdir,
+                              patterns, expected):
+    """Extract selected entries only.
+    """
+    args = ["extract", "-C", str(outdir), str(test_archive)] + patterns
+    callscript("archive-tool.py", args)
+    extracted = set(p.relative_to(outdir) for p in outdir.glob("**/*")
+                    if not p.is_dir())
+    assert extracted == set(p for p in expected if not
+                            (test_dir / p).is_dir() or
+                            (test_dir / p).is_symlink())
+    check_extracted(test_dir, outdir,
+                    [i for i in testdata if i.path in expected])
+
+@pytest.mark.parametrize("jobs", [1, 4])
+@pytest.mark.parametrize("compare_checksum", [False, True])
+def test_cli_extract_skip_identical(test_dir, test_archive, outdir,
+                                    jobs, compare_checksum):
+    """Extract into a directory where some files are already present.
+    """
+    args = ["extract", "-C", str(outdir), str(test_archive)]
+    callscript("archive-tool.py", args)
+    # Modify the content of one file, keeping size and modification
+    # time, and remove another one.
+    msg = outdir / "base" / "msg.txt"
+    st = msg.stat()
+    data = msg.read_bytes()
+    msg.chmod(0o644)
+    msg.write_bytes(bytes(reversed(data)))
+    os.utime(str(msg), (st.st_mtime, st.st_mtime))
+    (outdir / src).unlink()
+    args = ["extract", "--jobs", str(jobs), "--skip-identical"]
+    if compare_checksum:
+        args.append("--compare-checksum")
+    args += ["-C", str(outdir), str(test_archive)]
+    callscript("archive-tool.py", args)
+    assert filecmp.cmp(str(test_dir / src), str(outdir / src), shallow=False)
+    assert (msg.read_bytes() == data) == compare_checksum
+    check_extracted(test_dir, outdir,
+                    [i for i in testdata if i.path != msg.relative_to(outdir)])
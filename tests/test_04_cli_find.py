@@ -4,6 +4,8 @@
 import datetime
 import fnmatch
 import itertools
+import json
+import os
 from pathlib import Path
 import shutil
 from tempfile import TemporaryFile
@@ -82,6 +84,89 @@ def test_find_all(test_dir, abspath):
         for l, ex_l in itertools.zip_longest(get_output(f), expected_out):
             assert l == ex_l
 
+@pytest.mark.parametrize("abspath", [False, True])
+def test_find_jobs(test_dir, abspath):
+    """Call archive-tool find loading the manifests in parallel.
+    Expect the same output in the same order as from a serial search.
+    """
+    archives = archive_paths(test_dir, abspath)
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["find", "--jobs", "2", "--type", "f"]
+        args += [str(p) for p in archives]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        expected_out = []
+        for arch, data in zip(archives, testdata):
+            if abspath:
+                paths = sorted(test_dir / e.path
+                               for e in data
+                               if e.type == 'f')
+            else:
+                paths = sorted(e.path
+                               for e in data
+                               if e.type == 'f')
+            expected_out.extend("%s:%s" % (arch, p) for p in paths)
+        for l, ex_l in itertools.zip_longest(get_output(f), expected_out):
+            assert l == ex_l
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_find_jsonl(test_dir, jobs):
+    """Call archive-tool find with JSON lines output.
+    """
+    archives = archive_paths(test_dir, False)
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["find", "--format", "jsonl", "--jobs", str(jobs),
+                "--type", "f"]
+        args += [str(p) for p in archives]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        records = [json.loads(l) for l in get_output(f)]
+    expected = []
+    for arch, data in zip(archives, testdata):
+        expected.extend((str(arch), str(e.path), e.type)
+                        for e in sorted(data, key=lambda e: e.path)
+                        if e.type == 'f')
+    assert [(r["archive"], r["path"], r["type"]) for r in records] == expected
+    assert all("checksum" in r for r in records)
+
+@pytest.mark.parametrize("abspath", [False, True])
+def test_find_under(test_dir, abspath):
+    """Call archive-tool find restricted to a subdirectory.
+    """
+    archives = archive_paths(test_dir, abspath)
+    subdir = Path("base", "data")
+    under = test_dir / subdir if abspath else subdir
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["find", "--under", str(under), "--type", "f"]
+        args += [str(p) for p in archives]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        expected_out = []
+        for arch, data in zip(archives, testdata):
+            paths = sorted(e.path for e in data
+                           if e.type == 'f' and subdir in e.path.parents)
+            if abspath:
+                paths = [test_dir / p for p in paths]
+            expected_out.extend("%s:%s" % (arch, p) for p in paths)
+        for l, ex_l in itertools.zip_longest(get_output(f), expected_out):
+            assert l == ex_l
+
+def test_find_null(test_dir):
+    """Call archive-tool find with output terminated by null characters.
+    """
+    archives = archive_paths(test_dir, False)
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["find", "--null", "--type", "d"] + [str(p) for p in archives]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        out = f.read()
+    expected = []
+    for arch, data in zip(archives, testdata):
+        expected.extend("%s:%s\0" % (arch, p)
+                        for p in sorted(e.path for e in data
+                                        if e.type == 'd'))
+    assert out == "".join(expected)
+
 @pytest.mark.parametrize("type", ['f', 'd', 'l'])
 @pytest.mark.parametrize("abspath", [False, True])
 def test_find_bytype(test_dir, abspath, type):
@@ -153,6 +238,55 @@ def test_find_byname_wildcard(test_dir, pattern, abspath):
         for l, ex_l in itertools.zip_longest(get_output(f), expected_out):
             assert l == ex_l
 
+@pytest.mark.parametrize(("size", "match"), [
+    ("+500", lambda s: s > 500),
+    ("-500", lambda s: s < 500),
+    ("487", lambda s: s == 487),
+    ("-1k", lambda s: s < 1024),
+])
+def test_find_bysize(test_dir, size, match):
+    """Call archive-tool to find files by size.
+    """
+    archives = archive_paths(test_dir, False)
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["find", "--size=%s" % size] + [str(p) for p in archives]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        expected_out = []
+        for arch in archives:
+            with Archive().open(arch) as archive:
+                paths = [fi.path for fi in archive.manifest
+                         if fi.is_file() and match(fi.size)]
+            expected_out.extend("%s:%s" % (arch, p) for p in paths)
+        assert list(get_output(f)) == expected_out
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_find_bypath_checksum(test_dir, jobs):
+    """Call archive-tool to find entries by a regular expression on
+    the path and by checksum.
+    """
+    archives = archive_paths(test_dir, False)
+    with Archive().open(archives[1]) as archive:
+        fi = archive.manifest.find(Path("base", "msg.txt"))
+        checksum = fi.checksum["sha256"]
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["find", "--jobs", str(jobs), "--path", "^base/.*msg",
+                "--checksum", "sha256:%s" % checksum.upper()]
+        args += [str(p) for p in archives]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        expected_out = ["%s:base/msg.txt" % arch for arch in archives]
+        assert list(get_output(f)) == expected_out
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["find", "--jobs", str(jobs), "--path", "data/rnd[0-9]",
+                "--uid", str(os.getuid())]
+        args += [str(p) for p in archives]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        expected_out = ["%s:base/data/%s" % (archives[1], n)
+                        for n in ("rnd1.dat", "rnd2.dat")]
+        assert list(get_output(f)) == expected_out
+
 @pytest.mark.parametrize(("mtime", "delta"), [
     ("-1", datetime.timedelta(days=1)),
     ("+1", datetime.timedelta(days=1)),
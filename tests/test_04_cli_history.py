@@ -0,0 +1,86 @@
+"""Test the history subcommand.
+"""
+
+from pathlib import Path
+import shutil
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(Path("base", "data", "rnd.dat"), 0o600),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    """Create a series of archives, with some changes in between.
+    """
+    setup_testdata(tmpdir, testdata)
+    base = tmpdir / "base"
+    with tmp_chdir(tmpdir):
+        Archive().create(Path("a1.tar"), "", [Path("base")])
+        shutil.copy(str(gettestdata("rnd2.dat")),
+                    str(base / "data" / "rnd.dat"))
+        (base / "new.txt").write_text("new\n")
+        Archive().create(Path("a2.tar"), "", [Path("base")])
+        (base / "new.txt").unlink()
+        (base / "s.dat").unlink()
+        (base / "s.dat").symlink_to(Path("msg.txt"))
+        Archive().create(Path("a3.tar"), "", [Path("base")])
+        (base / "new.txt").write_text("new again\n")
+        Archive().create(Path("a4.tar"), "", [Path("base")])
+    return tmpdir
+
+def test_history(test_dir, monkeypatch):
+    monkeypatch.chdir(str(test_dir))
+    archives = ["a1.tar", "a2.tar", "a3.tar", "a4.tar"]
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["history"] + archives, stdout=f)
+        f.seek(0)
+        out = list(get_output(f))
+    assert out == [
+        "base/data/rnd.dat: changed in a2.tar",
+        "base/new.txt: added in a2.tar, removed in a3.tar, added in a4.tar",
+        "base/s.dat: changed in a3.tar",
+    ]
+
+def test_history_single(test_dir, monkeypatch):
+    monkeypatch.chdir(str(test_dir))
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["history", "a1.tar"], stdout=f)
+        f.seek(0)
+        assert list(get_output(f)) == []
+
+def test_history_basedir(test_dir, monkeypatch):
+    """Entries are matched on their path relative to the base
+    directory, in the order of the manifest.  The paths are reported
+    as in the first archive containing the entry.
+    """
+    monkeypatch.chdir(str(test_dir))
+    shutil.copytree("base", "other", symlinks=True)
+    try:
+        # "data.x" sorts before "data/rnd.dat" as a string, but after
+        # it as a path.
+        Path("other", "data.x").write_text("x\n")
+        Archive().create(Path("b1.tar"), "", [Path("other")])
+        Path("other", "msg.txt").write_text("changed\n")
+        Archive().create(Path("b2.tar"), "", [Path("other")])
+    finally:
+        shutil.rmtree("other")
+    archives = ["a4.tar", "b1.tar", "b2.tar"]
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["history"] + archives, stdout=f)
+        f.seek(0)
+        out = list(get_output(f))
+    assert out == [
+        "other/data.x: added in b1.tar",
+        "base/msg.txt: changed in b2.tar",
+    ]
@@ -0,0 +1,161 @@
+"""Test the scrub subcommand and rate limited verification.
+"""
+
+import json
+from pathlib import Path
+import shutil
+import tarfile
+from tempfile import TemporaryFile
+import time
+import pytest
+from archive import Archive
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o644, size=200000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o644, size=100000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    archives = tmpdir / "archives"
+    archives.mkdir()
+    with tmp_chdir(tmpdir):
+        for n, compression in (("a.tar", ""), ("b.tar.gz", "gz")):
+            Archive().create(archives / n, compression, [Path("base")])
+    return tmpdir
+
+@pytest.fixture(scope="function")
+def state(test_dir):
+    path = test_dir / "scrub.json"
+    if path.exists():
+        path.unlink()
+    return path
+
+def run_scrub(test_dir, args, returncode=0):
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["scrub", "-v"] + args,
+                   returncode=returncode, stdout=f)
+        f.seek(0)
+        return list(get_output(f))
+
+def read_state(path):
+    with path.open("rt") as f:
+        return { e["Path"]: e for e in json.load(f)["Archives"].values() }
+
+def test_scrub_due(test_dir, state):
+    """Only archives that are due are verified.
+    """
+    archives = test_dir / "archives"
+    a, b = archives / "a.tar", archives / "b.tar.gz"
+    args = ["--state", str(state), str(archives)]
+    out = run_scrub(test_dir, args)
+    assert out == ["%s: verify" % a, "%s: verify" % b]
+    entries = read_state(state)
+    verified = entries[str(b)]["Verified"]
+    assert entries[str(a)]["Verified"] <= verified <= time.time()
+    out = run_scrub(test_dir, args)
+    assert out == ["%s: not due" % a, "%s: not due" % b]
+    out = run_scrub(test_dir, ["--interval", "0"] + args)
+    assert out == ["%s: verify" % a, "%s: verify" % b]
+    assert read_state(state)[str(b)]["Verified"] > verified
+
+def test_scrub_resume(test_dir, state):
+    """An interrupted scrub is resumed after the last verified member.
+    """
+    a = test_dir / "archives" / "a.tar"
+    run_scrub(test_dir, ["--state", str(state), str(a)])
+    with state.open("rt") as f:
+        data = json.load(f)
+    for e in data["Archives"].values():
+        del e["Verified"]
+        e["Resume"] = "base/data/rnd1.dat"
+    with state.open("wt") as f:
+        json.dump(data, f)
+    out = run_scrub(test_dir, ["--state", str(state), str(a)])
+    assert out == ["%s: resume after base/data/rnd1.dat" % a]
+    entry = read_state(state)[str(a)]
+    assert "Resume" not in entry
+    assert entry["Verified"]
+
+def test_scrub_corrupt(test_dir, state):
+    """A damaged archive is reported and not recorded as verified.
+    """
+    path = test_dir / "archives" / "c.tar"
+    shutil.copy(str(test_dir / "archives" / "a.tar"), str(path))
+    try:
+        with tarfile.open(str(path), "r") as tarf:
+            offset = tarf.getmember("base/data/rnd2.dat").offset_data
+        with path.open("r+b") as f:
+            f.seek(offset + 1000)
+            c = f.read(1)
+            f.seek(offset + 1000)
+            f.write(bytes([c[0] ^ 0xff]))
+        args = ["--state", str(state), "--rate-limit", "10", str(path)]
+        run_scrub(test_dir, args, returncode=3)
+        assert "Verified" not in read_state(state)[str(path)]
+    finally:
+        path.unlink()
+
+def test_verify_ratelimit(test_dir):
+    """Verify with a limited bandwidth.
+    """
+    with Archive().open(test_dir / "archives" / "b.tar.gz") as archive:
+        start = time.monotonic()
+        archive.verify(ratelimit=1000000)
+        assert time.monotonic() - start > 0.2
+
+def test_verify_resume_after(test_dir):
+    """Resume verification after a given entry.
+    """
+    verified = []
+    with Archive().open(test_dir / "archives" / "a.tar") as archive:
+        archive.verify(resume_after=Path("base", "data", "rnd1.dat"),
+                       progress=lambda fi: verified.append(fi.path))
+    assert verified == [Path("base", "data", "rnd2.dat"),
+                        Path("base", "msg.txt"), Path("base", "s.dat")]
+
+def test_scrub_dotted_names(test_dir, tmpdir):
+    """Archives with dots in their name are found in a directory.
+    State is only recorded for the archives that have been verified.
+    """
+    archives = tmpdir / "dotted"
+    archives.mkdir()
+    a = archives / "archive-v1.2.tar"
+    b = archives / "archive-v1.3.tar.gz"
+    shutil.copy(str(test_dir / "archives" / "a.tar"), str(a))
+    shutil.copy(str(test_dir / "archives" / "b.tar.gz"), str(b))
+    state = tmpdir / "scrub-dotted.json"
+    out = run_scrub(test_dir, ["--state", str(state), str(a)])
+    assert out == ["%s: verify" % a]
+    assert list(read_state(state).keys()) == [str(a)]
+    out = run_scrub(test_dir, ["--state", str(state), str(archives)])
+    assert out == ["%s: not due" % a, "%s: verify" % b]
+    assert set(read_state(state).keys()) == {str(a), str(b)}
+
+def test_verify_ratelimit_sequential(test_dir, monkeypatch):
+    """Rate limited verification reads the members sequentially,
+    rather than looking them up, which would read the whole archive
+    without limit.
+    """
+    def getmember(self, name):
+        raise AssertionError("getmember called for %s" % name)
+    for n in ("a.tar", "b.tar.gz"):
+        with Archive().open(test_dir / "archives" / n) as archive:
+            monkeypatch.setattr(tarfile.TarFile, "getmember", getmember)
+            verified = []
+            archive.verify(ratelimit=10000000,
+                           progress=lambda fi: verified.append(fi.path))
+            assert verified == [fi.path for fi in archive.manifest]
+            archive.verify(ratelimit=10000000,
+                           entries=[Path("base", "msg.txt"),
+                                    Path("base", "data")])
+            monkeypatch.undo()
@@ -0,0 +1,134 @@
+"""Test verifying several archives with the verify subcommand.
+"""
+
+from pathlib import Path
+import shutil
+import tarfile
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from archive.exception import ArchiveIntegrityError
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o644, size=200000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o644, size=100000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    archives = tmpdir / "archives"
+    archives.mkdir()
+    with tmp_chdir(tmpdir):
+        for n, compression in (("a.tar", ""), ("b.tar.gz", "gz")):
+            Archive().create(archives / n, compression, [Path("base")])
+    # Make a copy of the uncompressed archive having one file corrupted.
+    corrupt = archives / "c.tar"
+    shutil.copy(str(archives / "a.tar"), str(corrupt))
+    with tarfile.open(str(corrupt), "r") as tarf:
+        offset = tarf.getmember("base/data/rnd2.dat").offset_data
+    with corrupt.open("r+b") as f:
+        f.seek(offset + 1000)
+        c = f.read(1)
+        f.seek(offset + 1000)
+        f.write(bytes([c[0] ^ 0xff]))
+    return tmpdir
+
+def run_verify(test_dir, args, returncode=0):
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["verify"] + args,
+                   returncode=returncode, stdout=f)
+        f.seek(0)
+        return list(get_output(f))
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_verify_multiple(test_dir, jobs):
+    """Verify several archives, one of them corrupted.  All archives
+    are reported and the exit status indicates the integrity error.
+    """
+    archives = test_dir / "archives"
+    paths = [archives / n for n in ("a.tar", "c.tar", "b.tar.gz")]
+    args = ["--jobs", str(jobs)] + [str(p) for p in paths]
+    out = run_verify(test_dir, args, returncode=3)
+    assert len(out) == 3
+    assert out[0].startswith("%s: OK, " % paths[0])
+    assert out[0].endswith(" MiB/s")
+    assert out[1].startswith("%s: FAILED: " % paths[1])
+    assert "base/data/rnd2.dat" in out[1]
+    assert out[2].startswith("%s: OK, " % paths[2])
+
+def test_verify_multiple_read_error(test_dir):
+    """A missing archive results in exit status 1, the other archives
+    are still verified.
+    """
+    archives = test_dir / "archives"
+    paths = [archives / "missing.tar", archives / "a.tar"]
+    out = run_verify(test_dir, [str(p) for p in paths], returncode=1)
+    assert len(out) == 2
+    assert out[0].startswith("%s: FAILED: " % paths[0])
+    assert out[1].startswith("%s: OK, " % paths[1])
+
+def test_verify_single_corrupt(test_dir):
+    """Verifying a single archive reports the error as before and
+    does not print a status line.
+    """
+    corrupt = test_dir / "archives" / "c.tar"
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["verify", str(corrupt)],
+                   returncode=3, stderr=f)
+        f.seek(0)
+        line = f.readline()
+        assert "verify: error: " in line
+        assert "base/data/rnd2.dat" in line
+
+def test_verify_quick(test_dir):
+    """--quick only checks the headers and does not notice the
+    corrupted content, while a full sample does.
+    """
+    corrupt = test_dir / "archives" / "c.tar"
+    callscript("archive-tool.py", ["verify", "--quick", str(corrupt)])
+    callscript("archive-tool.py", ["verify", "--sample", "0%", str(corrupt)])
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["verify", "--sample", "100%",
+                                       str(corrupt)],
+                   returncode=3, stderr=f)
+        f.seek(0)
+        assert "base/data/rnd2.dat: checksum" in f.readline()
+
+def test_verify_sample_seed(test_dir):
+    """The sample is reproducible for a given seed.
+    """
+    corrupt = test_dir / "archives" / "c.tar"
+    def sample_ok(seed):
+        with Archive().open(corrupt) as archive:
+            try:
+                archive.verify(sample=0.5, seed=seed)
+                return True
+            except ArchiveIntegrityError:
+                return False
+    results = [sample_ok(seed) for seed in range(8)]
+    assert results == [sample_ok(seed) for seed in range(8)]
+    assert True in results and False in results
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_verify_threads(test_dir, threads):
+    """Verify with the content hashed serially and in worker threads.
+    """
+    archives = test_dir / "archives"
+    for n in ("a.tar", "b.tar.gz"):
+        callscript("archive-tool.py", ["verify", "--threads", str(threads),
+                                       str(archives / n)])
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        callscript("archive-tool.py", ["verify", "--threads", str(threads),
+                                       str(archives / "c.tar")],
+                   returncode=3, stderr=f)
+        f.seek(0)
+        assert "base/data/rnd2.dat: checksum" in f.readline()